@@ -5,6 +5,13 @@ import uvicorn
 from fastapi import FastAPI
 from endpoints import faces, get_face, annotate, test_face
 from endpoints import serialise_on_shutdown, discard_image
+from endpoints import inference_stats, stop_inference_on_shutdown
+from endpoints import training_stats, stop_training_on_shutdown
+from endpoints import save_checkpoints_on_shutdown
+from endpoints import share_weights_on_startup, warm_up_on_startup
+from endpoints import configure_training_on_startup
+from endpoints import liveness, readiness
+from settings import SERVING_WORKERS
 from fastapi.middleware.cors import CORSMiddleware
 
 learning_machine_backend = FastAPI()
@@ -32,9 +39,29 @@ get_emotion_face = learning_machine_backend.get("/faces/image/{image_id}")(get_f
 annotate = learning_machine_backend.post("/faces/annotate/")(annotate)
 test_face = learning_machine_backend.get("/faces/test/{image_id}")(test_face)
 trash_image = learning_machine_backend.post("/faces/dispose/")(discard_image)
+inference_stats = learning_machine_backend.get("/stats/inference/")(inference_stats)
+training_stats = learning_machine_backend.get("/stats/training/")(training_stats)
+liveness = learning_machine_backend.get("/health/live")(liveness)
+readiness = learning_machine_backend.get("/health/ready")(readiness)
+share_weights_on_startup = learning_machine_backend.on_event("startup")(
+    share_weights_on_startup
+)
+configure_training_on_startup = learning_machine_backend.on_event("startup")(
+    configure_training_on_startup
+)
+warm_up_on_startup = learning_machine_backend.on_event("startup")(warm_up_on_startup)
 serialise_on_shutdown = learning_machine_backend.on_event("shutdown")(
     serialise_on_shutdown
 )
+stop_training_on_shutdown = learning_machine_backend.on_event("shutdown")(
+    stop_training_on_shutdown
+)
+save_checkpoints_on_shutdown = learning_machine_backend.on_event("shutdown")(
+    save_checkpoints_on_shutdown
+)
+stop_inference_on_shutdown = learning_machine_backend.on_event("shutdown")(
+    stop_inference_on_shutdown
+)
 
 if __name__ == "__main__":
     log_config = uvicorn.config.LOGGING_CONFIG
@@ -44,6 +71,16 @@ if __name__ == "__main__":
     log_config["formatters"]["default"][
         "fmt"
     ] = "%(asctime)s - %(levelname)s - %(message)s"
+    # multiple workers are (re-)started from the import string of the app
+    app = (
+        "app:learning_machine_backend"
+        if SERVING_WORKERS > 1
+        else learning_machine_backend
+    )
     uvicorn.run(
-        learning_machine_backend, host="127.0.0.1", port=8000, log_config=log_config
+        app,
+        host="127.0.0.1",
+        port=8000,
+        log_config=log_config,
+        workers=SERVING_WORKERS,
     )
@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks for the Learning Machine backend.
+
+Each module can be executed as a script from the `backend` folder, e.g.
+
+    python -m benchmarks.sampling
+"""
@@ -0,0 +1,73 @@
+"""
+Sustained write throughput of the annotations store (group commits), against
+committing every annotation in its own transaction, and replay throughput.
+"""
+
+import sqlite3
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+from datasets.annotations import AnnotationStore
+
+N_ANNOTATIONS = 20_000
+
+
+def annotations(n: int):
+    for i in range(n):
+        yield f"{i:064x}_{i:x}", i, i % 7
+
+
+def commit_per_annotation(filepath: Path, n: int) -> float:
+    connection = sqlite3.connect(str(filepath))
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=FULL")
+    connection.execute(AnnotationStore.SCHEMA[0])
+    start = timer()
+    for image_id, index, emotion in annotations(n):
+        with connection:
+            connection.execute(
+                "INSERT INTO annotations (image_id, sample_index, emotion, created)"
+                " VALUES (?, ?, ?, 0)",
+                (image_id, index, emotion),
+            )
+    elapsed = timer() - start
+    connection.close()
+    return n / elapsed
+
+
+def group_commit(filepath: Path, n: int) -> float:
+    store = AnnotationStore(filepath)
+    start = timer()
+    for image_id, index, emotion in annotations(n):
+        store.add(image_id, index, emotion)
+    store.flush()
+    elapsed = timer() - start
+    assert len(store) == n
+    store.close()
+    return n / elapsed
+
+
+def replay(filepath: Path, batch_size: int = 1024) -> float:
+    store = AnnotationStore(filepath)
+    start = timer()
+    n = sum(len(batch) for batch in store.replay(batch_size=batch_size))
+    elapsed = timer() - start
+    store.close()
+    return n / elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        n = N_ANNOTATIONS // 10  # a transaction per annotation is much slower
+        per_annotation = commit_per_annotation(folder / "per_annotation.db", n)
+        print(f"commit per annotation: {per_annotation:>12,.0f} annotations/sec")
+        grouped = group_commit(folder / "grouped.db", N_ANNOTATIONS)
+        print(f"group commit:          {grouped:>12,.0f} annotations/sec")
+        replayed = replay(folder / "grouped.db")
+        print(f"replay:                {replayed:>12,.0f} annotations/sec")
+
+
+if __name__ == "__main__":
+    main()
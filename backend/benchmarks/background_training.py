@@ -0,0 +1,84 @@
+"""
+Latency of predictions while annotations keep arriving, when every
+annotation is trained on inline (i.e. a step on a batch of one, run by the
+`InferenceScheduler` in order with predictions), or in the background by the
+`BackgroundTrainer` (mini-batched steps, weights published with an atomic
+swap). Training lag and steps/s of the background trainer are also reported.
+
+Samples are drawn from a synthetic FER-like dataset (see `batch_predict`).
+"""
+
+from threading import Thread
+from time import sleep
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+
+from benchmarks.batch_predict import RandomFER
+from datasets import Sample
+from models import get_model, UNET_MODEL
+from models.scheduler import InferenceScheduler
+from models.trainer import BackgroundTrainer
+
+N_IMAGES = 1000
+N_ANNOTATIONS = 40
+ANNOTATION_INTERVAL = 0.05  # seconds between annotations
+FACES_PER_REQUEST = 25
+
+
+def serve(scheduler, annotate, samples) -> np.ndarray:
+    """Latency (ms) of predict requests sent back to back, while
+    annotations are trained on (`annotate`)"""
+
+    def annotations():
+        for i in range(N_ANNOTATIONS):
+            annotate(samples[i])
+            sleep(ANNOTATION_INTERVAL)
+
+    annotator = Thread(target=annotations)
+    annotator.start()
+    latencies = list()
+    while annotator.is_alive():
+        indices = torch.randint(0, N_IMAGES, (FACES_PER_REQUEST,)).tolist()
+        start = timer()
+        scheduler.submit([samples[i] for i in indices], refresh=True).result()
+        latencies.append(timer() - start)
+    annotator.join()
+    return np.array(latencies) * 1000
+
+
+def main():
+    source = RandomFER(N_IMAGES)
+    samples = [
+        Sample(index=i, emotion=int(source.targets[i]), source=source)
+        for i in range(N_IMAGES)
+    ]
+    machine = get_model(UNET_MODEL)
+    scheduler = InferenceScheduler(machine)
+    scheduler.submit(samples[:FACES_PER_REQUEST]).result()  # warm-up
+
+    print("training     predict p50 (ms)   p99 (ms)   max (ms)")
+    inline = serve(scheduler, lambda s: scheduler.submit_fit([s]), samples)
+    print(
+        f"inline       {np.percentile(inline, 50):>16.1f}   "
+        f"{np.percentile(inline, 99):>8.1f}   {inline.max():>8.1f}"
+    )
+    trainer = BackgroundTrainer(machine)
+    background = serve(scheduler, trainer.add, samples)
+    trainer.stop()
+    print(
+        f"background   {np.percentile(background, 50):>16.1f}   "
+        f"{np.percentile(background, 99):>8.1f}   {background.max():>8.1f}"
+    )
+    stats = trainer.summary()
+    print(
+        f"background trainer: {stats['steps']} steps ({stats['steps_per_s']:.1f}/s), "
+        f"{stats['publications']} publications, training lag p50 "
+        f"{stats['lag_p50_ms']:.0f} ms, p99 {stats['lag_p99_ms']:.0f} ms"
+    )
+    scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-sample (PIL) vs batched (uint8 tensor) preprocessing of samples
+for `LearningMachine.predict`, for increasing numbers of samples.
+
+Samples are drawn from a synthetic FER-like dataset (three concatenated
+partitions of random images), so that the dataset is not downloaded.
+"""
+
+from timeit import default_timer as timer
+
+import torch
+from torch.utils.data import ConcatDataset, Dataset
+from torch.utils.data.dataloader import default_collate
+from PIL import Image
+
+from datasets import DataSource
+from models import get_model, UNET_MODEL, VGG_MODEL
+
+SIZES = (25, 100, 1000)
+PARTITIONS = (28_709, 3_589, 3_589)
+
+
+class RandomFER(Dataset):
+    def __init__(self, n_images: int):
+        self.data = torch.randint(0, 256, (n_images, 48, 48), dtype=torch.uint8)
+        self.targets = torch.randint(0, 7, (n_images,))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        img = Image.fromarray(self.data[index].numpy(), mode="L")
+        return img, int(self.targets[index])
+
+
+def per_sample_batch(machine, samples):
+    return default_collate([machine.transform(s) for s in samples])
+
+
+def timed(fn, *args, repeat: int = 5) -> float:
+    start = timer()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (timer() - start) / repeat, result
+
+
+def main():
+    data_source = DataSource(
+        dataset_load_fn=lambda: ConcatDataset([RandomFER(n) for n in PARTITIONS])
+    )
+    n_samples = sum(PARTITIONS)
+    for key in (UNET_MODEL, VGG_MODEL):
+        machine = get_model(key)
+        print(f"{key}: preprocessing (ms)   per-sample    batched")
+        for size in SIZES:
+            indices = torch.randint(0, n_samples, (size,)).tolist()
+            # fresh samples, so that no image has been materialised yet
+            per_sample, reference = timed(
+                lambda: per_sample_batch(machine, [data_source[i] for i in indices])
+            )
+            batched, batch = timed(
+                lambda: machine._as_batch([data_source[i] for i in indices])
+            )
+            assert torch.equal(batch, reference)
+            print(
+                f"{size:>10} samples {per_sample * 1e3:>17.2f} {batched * 1e3:>10.2f}"
+            )
+
+    machine = get_model(UNET_MODEL)
+    print(f"{UNET_MODEL}: full predict (ms)")
+    for size in SIZES:
+        samples = [data_source[i] for i in torch.randint(0, n_samples, (size,))]
+        elapsed, _ = timed(machine.predict, samples)
+        print(f"{size:>10} samples {elapsed * 1e3:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
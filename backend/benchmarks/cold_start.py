@@ -0,0 +1,68 @@
+"""
+Latency of the first `/faces` requests of a freshly started server, with no
+warm-up (i.e. the first request loads dataset and model, and runs the first
+forward pass), or once the server reports ready after its background
+warm-up. Each case runs in a new process, so that everything starts cold.
+
+Samples are drawn from a synthetic FER-like dataset (see `batch_predict`).
+"""
+
+import multiprocessing as mp
+from time import sleep
+from timeit import default_timer as timer
+
+from torch.utils.data import ConcatDataset
+
+from benchmarks.batch_predict import PARTITIONS, RandomFER
+
+N_REQUESTS = 3
+
+
+def serve(warm_up: bool, results) -> None:
+    import datasets
+    from datasets import DataSource, FER_DATASET
+
+    datasets.DATASETS_PROXY[FER_DATASET] = DataSource(
+        dataset_load_fn=lambda: ConcatDataset([RandomFER(n) for n in PARTITIONS])
+    )
+    from fastapi.testclient import TestClient
+
+    import app
+    import endpoints
+    from warmup import WarmUp
+
+    if not warm_up:
+        endpoints.SERVER_WARM_UP = WarmUp([])
+    started = timer()
+    with TestClient(app.learning_machine_backend) as client:
+        while client.get("/health/ready").status_code != 200:
+            sleep(0.01)
+        ready = timer() - started
+        latencies = list()
+        for _ in range(N_REQUESTS):
+            start = timer()
+            assert client.get("/faces/25/").status_code == 200
+            latencies.append((timer() - start) * 1000)
+        stages = client.get("/health/ready").json()["stages"]
+    results.put((ready, latencies, stages))
+
+
+def main():
+    context = mp.get_context("spawn")
+    print("warm-up   ready after (s)   /faces latency (ms): 1st   2nd   3rd")
+    for warm_up in (False, True):
+        results = context.Queue()
+        process = context.Process(target=serve, args=(warm_up, results))
+        process.start()
+        ready, latencies, stages = results.get()
+        process.join()
+        print(
+            f"{'yes' if warm_up else 'no':>7}   {ready:>15.2f}   "
+            + "   ".join(f"{latency:>6.1f}" for latency in latencies)
+        )
+        for name, stage in stages.items():
+            print(f"          {name}: {stage['duration_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
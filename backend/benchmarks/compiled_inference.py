@@ -0,0 +1,61 @@
+"""
+CPU throughput of the inference models of the learning machines: eager
+`nn.Module` vs compiled engine (TorchScript traced, and frozen), for
+increasing batch sizes. Compilation time, and loading time of the engine
+cached on disk (i.e. at later starts) are also reported.
+"""
+
+from timeit import default_timer as timer
+
+import torch
+
+from models import get_model, UNET_MODEL, VGG_MODEL
+
+BATCH_SIZES = {UNET_MODEL: (1, 25, 100), VGG_MODEL: (1, 25)}
+REPEAT = 5
+
+
+def throughput(machine, batch: torch.Tensor, compiled: bool) -> float:
+    machine.compiled = compiled
+    if compiled:  # rather than timing the previous engine, whilst compiling
+        machine._update_engine()
+    with torch.no_grad():
+        for _ in range(3):  # warm-up, also for the profiling executor of engines
+            machine._inference_call(batch)
+        start = timer()
+        for _ in range(REPEAT):
+            machine._inference_call(batch)
+    return len(batch) * REPEAT / (timer() - start)
+
+
+def main():
+    for key in (UNET_MODEL, VGG_MODEL):
+        machine = get_model(key)
+        machine.model.eval()
+        for engine in machine.CHECKPOINTS_FOLDER.glob(
+            f"{machine._engines_prefix}.*.ts"
+        ):
+            engine.unlink()
+        start = timer()
+        _ = machine.engine
+        compilation = timer() - start
+        machine._engine = None
+        start = timer()
+        _ = machine.engine
+        print(
+            f"{key}: compiled in {compilation:.2f}s, "
+            f"cached engine loaded in {timer() - start:.2f}s"
+        )
+
+        print(f"{key}: batch size   eager (samples/s)   compiled (samples/s)")
+        for batch_size in BATCH_SIZES[key]:
+            images = torch.randint(0, 256, (batch_size, 48, 48), dtype=torch.uint8)
+            batch = machine.batch_transform(images)
+            eager = throughput(machine, batch, compiled=False)
+            compiled = throughput(machine, batch, compiled=True)
+            print(f"{batch_size:>16}   {eager:>17,.1f}   {compiled:>20,.1f}")
+        machine.compiled = False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Throughput and peak memory of the raw FER CSV processing pipeline.
+
+A synthetic FER-style CSV (i.e. `emotion,pixels,Usage` columns, with
+48x48 space-separated pixels per row) is generated, and converted with
+the chunked pipeline used in `FER.download`. The original per-row
+conversion (one `np.fromstring` per row, on the whole file loaded at
+once) is timed on the same file for comparison.
+
+    python -m benchmarks.fer_processing [n_rows]
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+import torch
+
+from datasets.fer import FER, Partition, _USAGE_PARTITIONS, _peak_rss_mb
+
+USAGES = np.asarray(list(_USAGE_PARTITIONS.keys()))
+
+
+def make_csv(filepath: Path, n_rows: int, chunk_size: int = 1000) -> None:
+    rng = np.random.default_rng(seed=2013)
+    as_str = [str(v) for v in range(256)]
+    with open(filepath, "w") as f:
+        f.write("emotion,pixels,Usage\n")
+        for start in range(0, n_rows, chunk_size):
+            n = min(chunk_size, n_rows - start)
+            pixels = rng.integers(0, 256, size=(n, 48 * 48))
+            emotions = rng.integers(0, 7, size=n)
+            usages = USAGES[rng.choice(3, size=n, p=(0.8, 0.1, 0.1))]
+            for emotion, row, usage in zip(emotions, pixels, usages):
+                f.write(f"{emotion},{' '.join(as_str[v] for v in row)},{usage}\n")
+
+
+def per_row_conversion(filepath: Path) -> float:
+    start = timer()
+    raw_df = pd.read_csv(filepath)
+    for usage in USAGES:
+        dataset = raw_df[raw_df["Usage"] == usage]
+        rows = dataset["pixels"].map(
+            lambda p: np.fromstring(p, dtype=np.uint8, sep=" ")[np.newaxis, ...]
+        )
+        np.concatenate(rows.values, axis=0)
+    return timer() - start
+
+
+def main(n_rows: int = 100_000):
+    with tempfile.TemporaryDirectory() as root:
+        fer = FER.__new__(FER)  # bypass loading: only the pipeline is needed
+        fer.root = root
+        fer.processed_folder.mkdir(parents=True)
+        csv_filepath = Path(root) / FER.RAW_DATA_FILE
+        make_csv(csv_filepath, n_rows)
+
+        baseline_rss = _peak_rss_mb()
+        stats = fer._process_raw_data(csv_filepath)
+        print(f"baseline: peak RSS {baseline_rss:.0f} MB before processing")
+        print(
+            "chunked: {rows:,} rows in {seconds:.2f}s ({rows_per_sec:,.0f} rows/sec), "
+            "peak RSS {peak_rss_mb:.0f} MB main, {peak_rss_workers_mb:.0f} MB "
+            "workers".format(**stats)
+        )
+        images, _ = fer._load_mmap(Partition.train)
+        reference, _ = torch.load(
+            fer.processed_folder / FER.data_files[Partition.train]
+        )
+        assert torch.equal(images, reference)
+
+        # the per-row conversion holds the whole file in memory: keep it last
+        elapsed = per_row_conversion(csv_filepath)
+        print(
+            f"per-row: {n_rows:,} rows in {elapsed:.2f}s ({n_rows / elapsed:,.0f} rows/sec)"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""
+Latency of online updates (i.e. a training step on a mini-batch of
+annotations) of the learning machines, back-propagating through the whole
+model, or fine-tuning the head only: on samples first seen (features are
+encoded), or on samples whose features are cached already. Replaying the
+whole annotation history (one epoch) is reported for both modes too, as well
+as whether the feature extractor is left untouched by head-only updates.
+
+Samples are drawn from a synthetic FER-like dataset (see `batch_predict`).
+"""
+
+from timeit import default_timer as timer
+
+import torch
+
+from benchmarks.batch_predict import RandomFER
+from datasets import Sample
+from models import get_model, UNET_MODEL, VGG_MODEL
+
+N_ANNOTATIONS = 256
+BATCH_SIZE = 16
+REPEAT = 3
+
+
+def step_ms(machine, batches) -> float:
+    """Average latency (ms) of a training step, over the batches"""
+    start = timer()
+    for batch in batches:
+        machine._fit_step(batch)
+    return (timer() - start) / len(batches) * 1000
+
+
+def encoder_weights(machine):
+    head = {id(p) for p in machine.model.head.parameters()}
+    return [p.detach().clone() for p in machine.model.parameters() if id(p) not in head]
+
+
+def main():
+    source = RandomFER(N_ANNOTATIONS)
+    samples = [
+        Sample(index=i, emotion=int(source.targets[i]), source=source)
+        for i in range(N_ANNOTATIONS)
+    ]
+    batches = [samples[i : i + BATCH_SIZE] for i in range(0, N_ANNOTATIONS, BATCH_SIZE)]
+    print(
+        "model   full step (ms)   head step: first seen (ms)   cached (ms)   "
+        "replay: full (s)   head (s)   encoder unchanged"
+    )
+    for key in (UNET_MODEL, VGG_MODEL):
+        machine = get_model(key)
+        # no snapshots of the weights trained by the benchmark
+        machine.checkpoints.every_updates = machine.checkpoints.every_seconds = 1e9
+        machine.head_only = False
+        full = step_ms(machine, batches[:REPEAT])
+        machine.head_only = True
+        machine.features_cache.clear()
+        encoder = encoder_weights(machine)
+        first_seen = step_ms(machine, batches)  # encodes all the annotations
+        cached = step_ms(machine, batches[:REPEAT])
+        unchanged = all(
+            torch.equal(before, after)
+            for before, after in zip(encoder, encoder_weights(machine))
+        )
+        start = timer()
+        step_ms(machine, batches)
+        replay_head = timer() - start
+        replay_full = full * len(batches) / 1000  # estimated, from a full step
+        print(
+            f"{key:>5}   {full:>14.1f}   {first_seen:>26.1f}   {cached:>11.2f}   "
+            f"{replay_full:>16.2f}   {replay_head:>8.3f}   {unchanged!s:>17}"
+        )
+
+
+if __name__ == "__main__":
+    main()
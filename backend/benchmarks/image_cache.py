@@ -0,0 +1,82 @@
+"""
+Requests/sec of `/faces/image/{image_id}` with the encoded-images cache
+cold, warm, and with conditional requests answered with `304`.
+
+The FER dataset is replaced by random 48x48 grayscale images, so that
+the benchmark does not require the dataset to be downloaded.
+"""
+
+import asyncio
+from timeit import default_timer as timer
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+from torch.utils.data import Dataset
+
+import datasets
+from app import learning_machine_backend
+from datasets import DataSource
+from endpoints import get_face
+from settings import DATASET_NAME
+
+N_IMAGES = 500
+ROUNDS = 3
+
+
+class RandomFaces(Dataset):
+    def __init__(self, n_images: int):
+        rng = np.random.default_rng(seed=48)
+        self.data = rng.integers(0, 256, size=(n_images, 48, 48), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return Image.fromarray(self.data[index], mode="L"), index % 7
+
+
+def requests_per_sec(client: TestClient, image_ids, etag: bool = False) -> float:
+    start = timer()
+    for image_id in image_ids:
+        headers = {"If-None-Match": f'"{image_id}"'} if etag else {}
+        response = client.get(f"/faces/image/{image_id}", headers=headers)
+        assert response.status_code == (304 if etag else 200)
+    return len(image_ids) / (timer() - start)
+
+
+def handler_calls_per_sec(image_ids, etag: bool = False) -> float:
+    """Same as above, calling the endpoint handler without the HTTP stack"""
+
+    async def _calls():
+        for image_id in image_ids:
+            await get_face(image_id, if_none_match=f'"{image_id}"' if etag else None)
+
+    start = timer()
+    asyncio.run(_calls())
+    return len(image_ids) / (timer() - start)
+
+
+def main():
+    data_source = DataSource(dataset_load_fn=lambda: RandomFaces(N_IMAGES))
+    datasets.DATASETS_PROXY[DATASET_NAME] = data_source
+    image_ids = [data_source[i].uuid for i in range(N_IMAGES)]
+    client = TestClient(learning_machine_backend)
+
+    for label, measure in (
+        ("HTTP", lambda ids, etag=False: requests_per_sec(client, ids, etag)),
+        ("handler", handler_calls_per_sec),
+    ):
+        for _ in range(ROUNDS):
+            data_source._images_cache.clear()
+            cold = measure(image_ids)
+            warm = measure(image_ids)
+            not_modified = measure(image_ids, etag=True)
+            print(
+                f"{label:>8} cold: {cold:>8,.0f} req/s  warm: {warm:>8,.0f} req/s  "
+                f"304: {not_modified:>8,.0f} req/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
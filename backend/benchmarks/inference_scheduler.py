@@ -0,0 +1,108 @@
+"""
+Concurrent predict requests (e.g. `/faces/` from many users) served by
+calling `LearningMachine.predict` once per request, or merged into larger
+batches by the `InferenceScheduler`, for increasing batching windows and
+maximum batch sizes.
+The longest stall of the event loop (i.e. how long any other request, e.g.
+an image, would have to wait) is also reported.
+
+Samples are drawn from a synthetic FER-like dataset (see `batch_predict`).
+"""
+
+import asyncio
+from itertools import product
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+from torch.utils.data import ConcatDataset
+
+from benchmarks.batch_predict import PARTITIONS, RandomFER
+from datasets import DataSource
+from models import get_model, UNET_MODEL
+from models.scheduler import InferenceScheduler
+
+CONCURRENT_USERS = 32
+REQUESTS_PER_USER = 4
+FACES_PER_REQUEST = 25
+WINDOWS = (0, 0.005, 0.02)
+MAX_BATCH_SIZES = (64, 256)
+
+
+async def serve(predict, requests) -> (float, float):
+    """Throughput (requests/s), and longest stall of the event loop (ms)"""
+    served = asyncio.Event()
+
+    async def user(user_requests):
+        for samples in user_requests:
+            await predict(samples)
+
+    async def heartbeat():
+        longest_stall = 0
+        while not served.is_set():
+            beat = timer()
+            await asyncio.sleep(0.001)
+            longest_stall = max(longest_stall, timer() - beat - 0.001)
+        return longest_stall * 1000
+
+    start = timer()
+    stall = asyncio.ensure_future(heartbeat())
+    await asyncio.gather(*map(user, requests))
+    throughput = sum(map(len, requests)) / (timer() - start)
+    served.set()
+    return throughput, await stall
+
+
+def main():
+    data_source = DataSource(
+        dataset_load_fn=lambda: ConcatDataset([RandomFER(n) for n in PARTITIONS])
+    )
+    n_samples = sum(PARTITIONS)
+    machine = get_model(UNET_MODEL)
+    requests = [
+        [
+            [data_source[i] for i in torch.randint(0, n_samples, (FACES_PER_REQUEST,))]
+            for _ in range(REQUESTS_PER_USER)
+        ]
+        for _ in range(CONCURRENT_USERS)
+    ]
+
+    # predictions of batched requests are the same as those of single requests
+    scheduler = InferenceScheduler(machine)
+    samples = requests[0][0]
+    batched = scheduler.submit(samples).result()
+    reference = machine.predict(samples, refresh=True)
+    np.testing.assert_allclose(batched, reference, atol=1e-5)
+    scheduler.stop()
+
+    async def direct(samples):  # blocks the event loop, one forward pass each
+        return machine.predict(samples)
+
+    machine.refresh_predictions()  # predictions are computed, not cached
+    throughput, stall = asyncio.run(serve(direct, requests))
+    print(
+        f"{CONCURRENT_USERS} users, predict per request: {throughput:>8,.1f} req/s  "
+        f"event loop stalled up to {stall:>6.1f} ms"
+    )
+    for window, max_batch_size in product(WINDOWS, MAX_BATCH_SIZES):
+        machine.refresh_predictions()
+        scheduler = InferenceScheduler(
+            machine, window=window, max_batch_size=max_batch_size
+        )
+        throughput, stall = asyncio.run(serve(scheduler.predict, requests))
+        scheduler.stop()
+        stats = scheduler.stats.summary()
+        print(
+            f"{CONCURRENT_USERS} users, window {window * 1000:>4.0f} ms, "
+            f"batch <= {max_batch_size:>3}: "
+            f"{throughput:>8,.1f} req/s  "
+            f"event loop stalled up to {stall:>6.1f} ms  "
+            f"p50 {stats['latency_p50_ms']:>6.1f} ms  "
+            f"p99 {stats['latency_p99_ms']:>6.1f} ms  "
+            f"requests per batch {stats['requests_per_batch']}"
+        )
+    data_source.serialise_session()
+
+
+if __name__ == "__main__":
+    main()
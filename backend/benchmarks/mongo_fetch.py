@@ -0,0 +1,122 @@
+"""
+Document access patterns of `MongoProxy` against a local `mongod`:
+one `find_one` round trip per sample, batched `$in` fetches (a page of
+faces, or a DataLoader batch), sequential access with read-ahead, and
+concurrent requests served by the event loop, blocking on pymongo or
+awaiting `AsyncMongoProxy`.
+
+A temporary database is populated with random 48x48 faces, and dropped
+at the end. `mongod` is expected on the default host and port.
+"""
+
+import asyncio
+from timeit import default_timer as timer
+
+import numpy as np
+from pymongo import MongoClient
+
+from datasets.mongo import AsyncMongoProxy, MongoDatabaseInfo, MongoProxy
+
+N_DOCUMENTS = 20_000
+BATCH_SIZE = 25
+CONCURRENT_REQUESTS = 32
+DB_INFO = MongoDatabaseInfo(db="learning_machine_benchmark")
+
+
+def populate(client: MongoClient) -> None:
+    rng = np.random.default_rng(seed=48)
+    collection = client[DB_INFO.db][DB_INFO.collection]
+    collection.drop()
+    collection.insert_many(
+        {
+            "set": "train",
+            "emotion": int(rng.integers(0, 7)),
+            "image": rng.integers(0, 256, size=48 * 48, dtype=np.uint8).tobytes(),
+        }
+        for _ in range(N_DOCUMENTS)
+    )
+
+
+def per_document(proxy: MongoProxy, indices) -> float:
+    start = timer()
+    for index in indices:
+        query_filter = {"_id": proxy.sample_oids[index], "set": "train"}
+        proxy._collection.find_one(query_filter)
+    return len(indices) / (timer() - start)
+
+
+def batched(proxy: MongoProxy, indices) -> float:
+    start = timer()
+    for i in range(0, len(indices), BATCH_SIZE):
+        proxy.fetch_many(indices[i : i + BATCH_SIZE])
+    return len(indices) / (timer() - start)
+
+
+def sequential(proxy: MongoProxy, indices) -> float:
+    start = timer()
+    for index in indices:
+        proxy.fetch(index)
+    return len(indices) / (timer() - start)
+
+
+def concurrent_requests(indices, awaitable: bool) -> float:
+    """Serve pages of faces to concurrent requests, as an `async` endpoint"""
+    pages = [indices[i : i + BATCH_SIZE] for i in range(0, len(indices), BATCH_SIZE)]
+
+    async def serve():
+        async_proxy = await AsyncMongoProxy.create(
+            DB_INFO, ml_set="train", read_ahead=0
+        )
+        async_proxy.proxy.sample_oids  # not part of the measure
+
+        async def request(page):
+            if awaitable:
+                return await async_proxy.fetch_many(page)
+            return async_proxy.proxy.fetch_many(page)  # blocks the event loop
+
+        start = timer()
+        for i in range(0, len(pages), CONCURRENT_REQUESTS):
+            await asyncio.gather(*map(request, pages[i : i + CONCURRENT_REQUESTS]))
+        return len(indices) / (timer() - start)
+
+    return asyncio.run(serve())
+
+
+def main():
+    client = MongoClient(DB_INFO.host, DB_INFO.port)
+    populate(client)
+    try:
+        random_indices = np.random.permutation(N_DOCUMENTS)[:5000].tolist()
+
+        def proxy(**kwargs):  # fresh proxy, hence cold cache
+            return MongoProxy(DB_INFO, ml_set="train", **kwargs)
+
+        print(
+            f"find_one per sample: {per_document(proxy(), random_indices):>10,.0f} docs/s"
+        )
+        print(
+            f"$in batches of {BATCH_SIZE}:   "
+            f"{batched(proxy(read_ahead=0), random_indices):>10,.0f} docs/s"
+        )
+        print(
+            f"sequential, no read-ahead: "
+            f"{sequential(proxy(read_ahead=0), range(N_DOCUMENTS)):>10,.0f} docs/s"
+        )
+        print(
+            f"sequential, read-ahead:    "
+            f"{sequential(proxy(), range(N_DOCUMENTS)):>10,.0f} docs/s"
+        )
+        print(
+            f"{CONCURRENT_REQUESTS} concurrent, blocking: "
+            f"{concurrent_requests(random_indices, awaitable=False):>10,.0f} docs/s"
+        )
+        print(
+            f"{CONCURRENT_REQUESTS} concurrent, awaited:  "
+            f"{concurrent_requests(random_indices, awaitable=True):>10,.0f} docs/s"
+        )
+    finally:
+        client.drop_database(DB_INFO.db)
+
+
+if __name__ == "__main__":
+    main()
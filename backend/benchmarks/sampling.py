@@ -0,0 +1,49 @@
+"""
+Per-request cost of drawing random samples, as the number of indices grows.
+
+Compares the original set-difference sampling (rebuilding the pool of
+available indices on every call) with the incrementally maintained
+`IndexPool` used by `DataSource`.
+"""
+
+from random import sample
+from timeit import default_timer as timer
+from typing import Callable, Set
+
+from datasets.sampling import IndexPool
+
+SIZES = (35_000, 1_000_000, 10_000_000)
+K = 25
+REQUESTS = 200
+
+
+def set_difference_draw(n_indices: int, sampled: Set[int], blacklist: Set[int]):
+    excluded = sampled.union(blacklist)
+    pool = set(range(n_indices)).difference(excluded)
+    drawn = sample(sorted(pool), k=K)
+    sampled.update(drawn)
+    return drawn
+
+
+def time_per_request(draw_fn: Callable[[], None], requests: int) -> float:
+    start = timer()
+    for _ in range(requests):
+        draw_fn()
+    return (timer() - start) / requests
+
+
+def main():
+    print(f"{'indices':>12} {'set-diff (ms)':>15} {'IndexPool (us)':>16}")
+    for n_indices in SIZES:
+        sampled, blacklist = set(), set(range(0, n_indices, 1000))
+        # legacy approach is O(N) per call: keep the number of calls small
+        legacy = time_per_request(
+            lambda: set_difference_draw(n_indices, sampled, blacklist), requests=3
+        )
+        pool = IndexPool(n_indices, excluded=blacklist)
+        fast = time_per_request(lambda: pool.draw(K), requests=REQUESTS)
+        print(f"{n_indices:>12,} {legacy * 1e3:>15.2f} {fast * 1e6:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
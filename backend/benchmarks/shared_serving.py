@@ -0,0 +1,118 @@
+"""
+Memory footprint of multiple serving workers, with and without model
+weights shared in memory (see `models.shared.SharedWeights`): private
+memory (USS) of each worker process, time to publish a weight update to
+the other workers, and forward throughput of each worker. Shared weights are
+also measured with background training on (i.e. double-buffered machines),
+as predictions are then served by a copy of the weights, unless shared.
+
+    python -m benchmarks.shared_serving [n_workers]
+"""
+
+import gc
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+import torch
+
+BATCH_SIZE = 25
+REPEAT = 5
+
+
+def private_memory_mb() -> float:
+    """Unique set size (i.e. memory not shared with other processes)"""
+    private = 0
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            if line.startswith(("Private_Clean", "Private_Dirty")):
+                private += int(line.split()[1])
+    return private / 2**10
+
+
+def worker(folder, shared, double_buffered, barrier, results):
+    from models import get_model, MODELS_PROXY
+    from models.shared import SharedWeights
+
+    # every model of the registry is loaded (and shared)
+    machines = {key: get_model(key) for key in MODELS_PROXY}
+    for key, machine in machines.items():
+        _ = machine.model
+        machine.double_buffered = double_buffered
+        if shared:
+            machine.share_weights(
+                SharedWeights(Path(folder) / f"{key}.weights", token=os.getppid())
+            )
+    gc.collect()
+    throughput = dict()
+    images = torch.randint(0, 256, (BATCH_SIZE, 48, 48), dtype=torch.uint8)
+    with torch.no_grad():
+        for key, machine in machines.items():
+            batch = machine.batch_transform(images)
+            machine._inference_call(batch)  # warm-up
+            start = timer()
+            for _ in range(REPEAT):
+                machine._inference_call(batch)
+            throughput[key] = BATCH_SIZE * REPEAT / (timer() - start)
+    uss = private_memory_mb()
+
+    # update propagation: first worker updates, the others wait to see it
+    propagation = None
+    if shared:
+        shared_weights = next(iter(machines.values()))._shared_weights
+        version = shared_weights.version
+        if barrier.wait() == 0:
+            with shared_weights.writing():
+                pass
+        while shared_weights.version == version:
+            pass
+        propagation = timer()
+    results.put((uss, throughput, propagation))
+
+
+def run(n_workers: int, shared: bool, double_buffered: bool = False) -> None:
+    context = mp.get_context("spawn")
+    barrier, results = context.Barrier(n_workers), context.Queue()
+    with tempfile.TemporaryDirectory(dir="/dev/shm") as folder:
+        workers = [
+            context.Process(
+                target=worker,
+                args=(folder, shared, double_buffered, barrier, results),
+            )
+            for _ in range(n_workers)
+        ]
+        for p in workers:
+            p.start()
+        outcomes = [results.get() for _ in workers]
+        for p in workers:
+            p.join()
+    uss = [o[0] for o in outcomes]
+    throughput = ", ".join(
+        f"{key} {sum(o[1][key] for o in outcomes) / n_workers:.1f}"
+        for key in outcomes[0][1]
+    )
+    print(
+        f"{'shared' if shared else 'copies':>6}"
+        f"{' (double-buffered)' if double_buffered else ''}: "
+        f"USS per worker {sum(uss) / n_workers:>7.1f} MB "
+        f"(total {sum(uss):>7.1f} MB), samples/s per worker: {throughput}"
+    )
+    if shared:
+        times = [o[2] for o in outcomes]
+        print(
+            f"        update seen by all in {(max(times) - min(times)) * 1000:.2f} ms"
+        )
+
+
+def main(n_workers: int = 2):
+    print(f"{n_workers} workers")
+    for shared in (False, True):
+        run(n_workers, shared)
+    run(n_workers, shared=True, double_buffered=True)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,87 @@
+"""
+Parity and latency of the inference copy of the `Unet` (BatchNorm folded
+into convolutions, channels-last layout) against the original model in
+eval mode, for the encoder-only predictions and the full forward pass.
+
+Parity is also checked on a model with random BatchNorm statistics and
+affine parameters, as freshly initialised BatchNorms fold into identities.
+"""
+
+from timeit import default_timer as timer
+
+import torch
+from PIL import Image
+
+from datasets import Sample
+from models import get_model, UNET_MODEL
+from models.inference import fold_batchnorm
+from models.unet import Unet
+
+BATCH_SIZES = (1, 25, 100)
+REPEAT = 10
+
+
+def randomise_batchnorm(model: Unet) -> Unet:
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+def assert_parity(model: Unet, batch: torch.Tensor) -> None:
+    folded = fold_batchnorm(model).to(memory_format=torch.channels_last)
+    folded_batch = batch.contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        reco, logits = model(batch)
+        folded_reco, folded_logits = folded(folded_batch)
+        torch.testing.assert_close(folded_reco, reco, rtol=1e-4, atol=1e-4)
+        torch.testing.assert_close(folded_logits, logits, rtol=1e-4, atol=1e-4)
+        classify_logits = folded.classify(folded_batch)
+        torch.testing.assert_close(classify_logits, logits, rtol=1e-4, atol=1e-4)
+
+
+def random_sample() -> Sample:
+    image = Image.fromarray(torch.randint(0, 256, (48, 48)).byte().numpy(), mode="L")
+    return Sample(index=-1, emotion=int(torch.randint(0, 7, ())), image=image)
+
+
+def timed(fn, batch) -> float:
+    with torch.no_grad():
+        fn(batch)  # warm-up
+        start = timer()
+        for _ in range(REPEAT):
+            fn(batch)
+    return (timer() - start) / REPEAT * 1000
+
+
+def main():
+    machine = get_model(UNET_MODEL)
+    model = machine.model.eval()
+    batch = torch.rand(16, 1, 48, 48)
+    assert_parity(model, batch)
+    assert_parity(randomise_batchnorm(Unet()), batch)
+
+    # the machine regenerates its inference copy after every update
+    inference_model = machine.inference_model
+    assert machine.inference_model is inference_model
+    machine.fit([random_sample() for _ in range(2)])
+    assert machine.inference_model is not inference_model
+    assert_parity(machine.model.eval(), batch)
+
+    folded = machine.inference_model
+    print("batch size   classify (ms)   folded (ms)   forward (ms)   folded (ms)")
+    for batch_size in BATCH_SIZES:
+        batch = torch.rand(batch_size, 1, 48, 48)
+        folded_batch = batch.contiguous(memory_format=torch.channels_last)
+        print(
+            f"{batch_size:>10}   {timed(model.classify, batch):>13.1f}   "
+            f"{timed(folded.classify, folded_batch):>11.1f}   "
+            f"{timed(model, batch):>12.1f}   {timed(folded, folded_batch):>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Forward latency and peak memory of the `Unet` for emotion predictions:
+full forward pass (encoder, decoder and reconstruction) vs encoder-only
+(`Unet.classify`), for increasing batch sizes.
+
+Each measure runs in a fresh process, so that the peak resident memory
+(i.e. `ru_maxrss`) only accounts for that forward pass.
+"""
+
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from timeit import default_timer as timer
+
+import torch
+
+from models import get_model, UNET_MODEL
+
+BATCH_SIZES = (1, 25, 100, 500)
+REPEAT = 5
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def forward(batch_size: int, encoder_only: bool) -> (float, float):
+    """Average latency (ms), and peak memory (MB) over the loaded model"""
+    model = get_model(UNET_MODEL).model.eval()
+    batch = torch.rand(batch_size, 1, 48, 48)
+    baseline = peak_rss_mb()
+    with torch.no_grad():
+        start = timer()
+        for _ in range(REPEAT):
+            if encoder_only:
+                model.classify(batch)
+            else:
+                model(batch)
+        latency = (timer() - start) / REPEAT * 1000
+    return latency, peak_rss_mb() - baseline
+
+
+def measure(batch_size: int, encoder_only: bool) -> (float, float):
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(forward, batch_size, encoder_only).result()
+
+
+def main():
+    # same logits, with or without the decoder
+    model = get_model(UNET_MODEL).model.eval()
+    batch = torch.rand(8, 1, 48, 48)
+    with torch.no_grad():
+        _, logits = model(batch)
+        torch.testing.assert_close(model.classify(batch), logits)
+
+    print("batch size   full (ms)   encoder-only (ms)   full (MB)   encoder-only (MB)")
+    for batch_size in BATCH_SIZES:
+        full_latency, full_memory = measure(batch_size, encoder_only=False)
+        enc_latency, enc_memory = measure(batch_size, encoder_only=True)
+        print(
+            f"{batch_size:>10}   {full_latency:>9.1f}   {enc_latency:>17.1f}   "
+            f"{full_memory:>9.1f}   {enc_memory:>17.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Latency of the grayscale-native `VGGNet` (first convolution summed over the
+RGB channels) against the original RGB model, loaded from the same
+checkpoint: per-sample transform (PIL RGB conversion or not), and forward
+pass, for increasing batch sizes. Parity of the two is checked by the tests.
+"""
+
+from timeit import default_timer as timer
+
+import torch
+from PIL import Image
+
+from models import get_model, VGG_MODEL
+from models.vgg import VGGMachine, VGGNet
+
+BATCH_SIZES = (1, 25, 100)
+REPEAT = 5
+
+
+def timed(fn, *args) -> float:
+    fn(*args)  # warm-up
+    start = timer()
+    for _ in range(REPEAT):
+        fn(*args)
+    return (timer() - start) / REPEAT * 1000
+
+
+def main():
+    machine = get_model(VGG_MODEL)
+    rgb_model = VGGNet(pretrained=False).eval()
+    rgb_model.load_state_dict(machine.weights)
+    gray_model = VGGNet(pretrained=False).eval()
+    gray_model.load_state_dict(machine.weights)
+    gray_model.to_grayscale()
+
+    images = torch.randint(0, 256, (max(BATCH_SIZES), 48, 48), dtype=torch.uint8)
+    pil_images = [Image.fromarray(image.numpy(), mode="L") for image in images]
+    rgb_transform = VGGMachine(grayscale=False)._transformer
+    gray_transform = machine._transformer
+
+    print("batch size   transform RGB   gray (ms)   forward RGB   gray (ms)")
+    with torch.no_grad():
+        for batch_size in BATCH_SIZES:
+            batch = images[:batch_size].unsqueeze(1).float().div(255)
+            rgb_batch = batch.expand(-1, 3, -1, -1).contiguous()
+            samples = pil_images[:batch_size]
+            print(
+                f"{batch_size:>10}   "
+                f"{timed(lambda: [rgb_transform(img) for img in samples]):>13.2f}   "
+                f"{timed(lambda: [gray_transform(img) for img in samples]):>9.2f}   "
+                f"{timed(rgb_model, rgb_batch):>11.1f}   "
+                f"{timed(gray_model, batch):>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Evaluation report of the quantised serving mode of the `VGGMachine`
+(int8 dynamic quantisation of the Linear layers) against float32, on
+the FER test split: accuracy (and drift), agreement of the predicted
+emotions, model size, and CPU throughput.
+
+    python -m benchmarks.vgg_quantisation [n_samples]
+"""
+
+import io
+import sys
+from os import path
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+from torch import nn
+
+import datasets
+from datasets import FER
+from models import get_model, VGG_MODEL
+
+BATCH_SIZE = 64
+
+
+def model_size_mb(model: nn.Module) -> float:
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 2**20
+
+
+def evaluate(machine, images: torch.Tensor) -> (np.ndarray, float):
+    """Predicted emotions of all the images, and throughput (samples/s)"""
+    predictions = list()
+    _ = machine.inference_model  # (quantised) copy is not part of the measure
+    with torch.no_grad():
+        start = timer()
+        for i in range(0, len(images), BATCH_SIZE):
+            batch = machine.batch_transform(images[i : i + BATCH_SIZE])
+            logits = machine._inference_call(batch)
+            predictions.append(machine._get_model_emotion_predictions(logits))
+        throughput = len(images) / (timer() - start)
+    return np.concatenate(predictions).argmax(axis=1), throughput
+
+
+def main(n_samples: int = None):
+    root = path.dirname(path.abspath(datasets.__file__))
+    fer_test = FER(root=root, download=True, split="test")
+    images, targets = fer_test.data[:n_samples], fer_test.targets[:n_samples].numpy()
+
+    machine = get_model(VGG_MODEL)
+    machine.model.eval()
+    machine.quantised = False
+    float_predictions, float_throughput = evaluate(machine, images)
+    float_size = model_size_mb(machine.inference_model)
+    machine.quantised = True
+    int8_predictions, int8_throughput = evaluate(machine, images)
+    int8_size = model_size_mb(machine.inference_model)
+    machine.quantised = False
+
+    float_accuracy = (float_predictions == targets).mean()
+    int8_accuracy = (int8_predictions == targets).mean()
+    print(f"FER test split: {len(targets)} samples")
+    print("            accuracy   size (MB)   samples/s")
+    print(
+        f"float32     {float_accuracy:>8.2%}   {float_size:>9.1f}   "
+        f"{float_throughput:>9.1f}"
+    )
+    print(
+        f"int8 (dyn)  {int8_accuracy:>8.2%}   {int8_size:>9.1f}   "
+        f"{int8_throughput:>9.1f}"
+    )
+    print(
+        f"accuracy drift: {int8_accuracy - float_accuracy:+.2%}, "
+        f"same emotion predicted: {(int8_predictions == float_predictions).mean():.2%}"
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,60 @@
+"""
+Cost of snapshots of trained weights (and optimiser state), and restart time
+of the learning machines from the newest snapshot: model weights read in
+full (`torch.load`), or memory-mapped from the file.
+
+Snapshots written by the benchmark are removed at the end.
+"""
+
+from timeit import default_timer as timer
+
+import torch
+
+from models import get_model, UNET_MODEL, VGG_MODEL
+
+REPEAT = 3
+
+
+def timed(fn) -> float:
+    start = timer()
+    for _ in range(REPEAT):
+        fn()
+    return (timer() - start) / REPEAT * 1000
+
+
+def restore(machine, filepath, mmap: bool):
+    """Model built from the weights of the snapshot, as on startup"""
+    weights = machine._weights
+    try:
+        snapshot = torch.load(filepath, mmap=mmap, weights_only=True)
+        machine._weights = snapshot["model"]
+        return machine._load_model()
+    finally:
+        machine._weights = weights
+
+
+def main():
+    print("model   copy (ms)   save (ms)   size (MB)   restore: read (ms)   mmap (ms)")
+    for key in (UNET_MODEL, VGG_MODEL):
+        machine = get_model(key)
+        manager = machine.checkpoints
+        _ = machine.optimiser
+        copy = timed(manager._state)  # training is held only for the copy
+        machine._updates += 1  # so that there is an update to snapshot
+        start = timer()
+        filepath = manager.save()
+        save = (timer() - start) * 1000
+        size = filepath.stat().st_size / 2**20
+        read = timed(lambda: restore(machine, filepath, mmap=False))
+        mapped = timed(lambda: restore(machine, filepath, mmap=True))
+        print(
+            f"{key:>5}   {copy:>9.1f}   {save:>9.1f}   {size:>9.1f}   "
+            f"{read:>18.1f}   {mapped:>9.1f}"
+        )
+        filepath.unlink()
+        machine._updates -= 1
+        manager.saved_updates = machine.updates
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Tests import the backend packages as the app does (e.g. `from datasets import ...`):
+this (root) conftest puts the backend folder on the import path.
+"""
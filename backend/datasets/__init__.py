@@ -4,7 +4,7 @@ This package provides access to all the datasets available to the learning machi
 
 from .fer import FER
 from .sources import load_fer_dataset_lazy, load_fer_training_lazy
-from .sources import DataSource, Sample
+from .sources import DataSource, Sample, stack_images
 
 
 # Available Dataset Keys
@@ -52,4 +52,5 @@ __all__ = [
     "DATASETS_PROXY",
     "get_dataset",
     "Sample",
+    "stack_images",
 ]
@@ -0,0 +1,244 @@
+"""
+Persistent, append-only store of the annotations provided by users
+"""
+
+import sqlite3
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import sleep, time
+from typing import Iterator, List, Optional, Tuple
+
+
+class AnnotationStore:
+    """Append-only log of annotations, stored in a SQLite database in WAL mode.
+
+    Annotations are queued, and written by a background thread in group
+    commits: all the annotations received within `commit_interval` seconds
+    (and up to `max_batch`) are written in a single transaction, so that
+    high annotation rates do not pay for one disk sync per request.
+    Annotations are indexed by image id, and can be replayed (in order)
+    in large batches, e.g. to feed them back into `LearningMachine.fit`.
+
+    Transactions failing because the database is locked are retried (up to
+    `WRITE_ATTEMPTS` times): if a batch still cannot be written, the writer
+    stops, and keeps the annotations not written yet, which are retried by
+    the next writer (started by `add` or `flush`). Until then, `flush` (and
+    `replay`) raise the error.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to the SQLite database file. Created on first use.
+    commit_interval : float (default 0.05)
+        Maximum time (in seconds) an annotation waits before being committed.
+    max_batch : int (default 1024)
+        Maximum number of annotations written in a single transaction.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS annotations ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " image_id TEXT NOT NULL,"
+        " sample_index INTEGER NOT NULL,"
+        " emotion INTEGER NOT NULL,"
+        " created REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS annotations_image_id ON annotations (image_id)",
+    )
+
+    # Seconds a connection waits for a lock held by another connection,
+    # attempts to write a batch, and delay (doubled at each attempt) in between
+    BUSY_TIMEOUT = 5.0
+    WRITE_ATTEMPTS = 3
+    RETRY_DELAY = 0.1
+
+    def __init__(
+        self, filepath: Path, commit_interval: float = 0.05, max_batch: int = 1024
+    ) -> None:
+        self.filepath = Path(filepath)
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._pending = dict()  # image_id -> latest record not committed yet
+        self._unwritten = list()  # records left by a failed writer, in order
+        self._error = None  # why the last writer failed, if it did
+        self._lock = Lock()
+        self._reader = None
+        self._writer = None
+        self._stopped = Event()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            str(self.filepath), timeout=self.BUSY_TIMEOUT, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode, NORMAL only syncs at checkpoints, and it is still durable
+        # against application crashes
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+        return connection
+
+    @property
+    def reader(self) -> sqlite3.Connection:
+        if self._reader is None:
+            self._reader = self._connect()
+        return self._reader
+
+    def _start_writer(self) -> None:
+        """Start the writer (under lock), if not running: records left by a
+        failed writer are queued first, to be written in order."""
+        if self._writer is None:
+            for record in self._unwritten:
+                self._queue.put(record)
+            self._unwritten.clear()
+            self._stopped.clear()
+            self._writer = Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def add(self, image_id: str, index: int, emotion: int) -> None:
+        """Append an annotation to the store, without waiting for the commit"""
+        record = (image_id, index, emotion, time())
+        with self._lock:
+            self._start_writer()
+            self._pending[image_id] = record
+            self._queue.put(record)
+
+    def _commit(self, connection: sqlite3.Connection, batch: List[Tuple]) -> None:
+        """Write the batch in one transaction, retrying while the database is locked"""
+        for attempt in range(1, self.WRITE_ATTEMPTS + 1):
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO annotations"
+                        " (image_id, sample_index, emotion, created)"
+                        " VALUES (?, ?, ?, ?)",
+                        batch,
+                    )
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == self.WRITE_ATTEMPTS:
+                    raise
+                print(f"[WARNING] Annotations not written (attempt {attempt}): {e}")
+                sleep(self.RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _fail(self, batch: List[Tuple], error: Exception) -> None:
+        """Stop the writer (under lock), keeping the batch and all the queued
+        records to be retried by the next writer."""
+        print(f"[ERROR] Annotations could not be written: {error}")
+        self._error = error
+        self._unwritten.extend(batch)
+        while not self._queue.empty():
+            self._unwritten.append(self._queue.get_nowait())
+            self._queue.task_done()
+        self._writer = None
+
+    def _write_loop(self) -> None:
+        try:
+            connection = self._connect()
+        except sqlite3.Error as e:
+            with self._lock:
+                self._fail(list(), e)
+            return
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.commit_interval)]
+            except Empty:
+                continue
+            # group commit: collect whatever arrives within the interval
+            deadline = time() + self.commit_interval
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time(), 0)))
+                except Empty:
+                    break
+            try:
+                self._commit(connection, batch)  # one transaction per batch
+            except Exception as e:
+                with self._lock:
+                    self._fail(batch, e)
+                break
+            else:
+                with self._lock:
+                    self._error = None
+                    for record in batch:
+                        if self._pending.get(record[0]) is record:
+                            del self._pending[record[0]]
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        connection.close()
+
+    def flush(self) -> None:
+        """Wait until all the queued annotations have been committed.
+
+        Raises
+        ------
+        RuntimeError
+            If annotations could not be written (they are kept, and retried
+            by the next call to `add` or `flush`).
+        """
+        with self._lock:
+            if self._unwritten:
+                self._start_writer()
+        self._queue.join()
+        with self._lock:
+            error, unwritten = self._error, len(self._unwritten)
+        if unwritten:
+            raise RuntimeError(f"{unwritten} annotations not written: {error}")
+
+    def close(self) -> None:
+        """Commit pending annotations, and stop the background writer"""
+        with self._lock:
+            writer = self._writer
+        if writer is not None:
+            self._stopped.set()
+            writer.join()
+        with self._lock:
+            self._writer = None
+            if self._unwritten:
+                print(
+                    f"[WARNING] {len(self._unwritten)} annotations not written: "
+                    f"{self._error}"
+                )
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def latest(self, image_id: str) -> Optional[int]:
+        """Most recent emotion annotated for the image, if any"""
+        with self._lock:
+            record = self._pending.get(image_id, None)
+        if record is not None:
+            return record[2]
+        if not self.filepath.exists():
+            return None
+        row = self.reader.execute(
+            "SELECT emotion FROM annotations WHERE image_id = ?"
+            " ORDER BY id DESC LIMIT 1",
+            (image_id,),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def __len__(self) -> int:
+        pending = self._queue.unfinished_tasks + len(self._unwritten)
+        if not self.filepath.exists():
+            return pending
+        (count,) = self.reader.execute("SELECT COUNT(*) FROM annotations").fetchone()
+        return count + pending
+
+    def replay(self, batch_size: int = 1024) -> Iterator[List[Tuple[int, int]]]:
+        """Iterate over all the annotations, in order, in batches of
+        (sample index, emotion) pairs."""
+        self.flush()
+        if not self.filepath.exists():
+            return
+        cursor = self.reader.execute(
+            "SELECT sample_index, emotion FROM annotations ORDER BY id"
+        )
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
@@ -0,0 +1,69 @@
+"""
+Bounded caches for data served by DataSources
+"""
+
+from collections import OrderedDict
+from io import BytesIO
+from threading import Lock
+from typing import Optional
+
+from PIL.Image import Image as PILImage
+
+
+def encode_png(image: PILImage) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="png")
+    return buffer.getvalue()
+
+
+class EncodedImageCache:
+    """Least-recently-used cache of encoded images, bounded in bytes.
+
+    Encoded images are immutable for a given sample uuid, hence entries are
+    never invalidated, only evicted (least recently used first) once the
+    total size of the cached images exceeds `max_bytes`.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size (in bytes) of the encoded images in cache.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._nbytes = 0
+        self._lock = Lock()  # pre-warming may run in the threadpool
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._images
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._images.get(key, None)
+            if content is not None:
+                self._images.move_to_end(key)
+            return content
+
+    def put(self, key: str, content: bytes) -> None:
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self._nbytes -= len(previous)
+            self._images[key] = content
+            self._nbytes += len(content)
+            while self._nbytes > self.max_bytes and self._images:
+                _, evicted = self._images.popitem(last=False)
+                self._nbytes -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._nbytes = 0
@@ -77,16 +77,22 @@ References
 """
 
 import os
+import shutil
+import sys
 import torch
-import pandas as pd
 import numpy as np
 from PIL import Image
 from torchvision.datasets import VisionDataset
 from torchvision.datasets.utils import download_url, extract_archive
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
 from enum import Enum
 from pathlib import Path
+from itertools import islice
 from math import sqrt
-from typing import Callable, Optional, Any
+from timeit import default_timer as timer
+from typing import Callable, Optional, Any, Tuple, Dict, List
 
 
 class Partition(Enum):
@@ -133,6 +139,17 @@ class FER(VisionDataset):
         Partition.test: "test.pt",
     }
 
+    # Memory-mapped processed format: all the partitions as one contiguous
+    # raw uint8 image file, plus an index file with targets and per-partition
+    # sample offsets (in `Partition` order).
+    mmap_images_file = "images.u8"
+    mmap_index_file = "index.npz"
+
+    # Raw CSV processing: number of rows per chunk, and number of worker
+    # processes parsing chunks (`None` means one per CPU)
+    PROCESSING_CHUNK_SIZE = 2048
+    PROCESSING_WORKERS = None
+
     classes = [
         "angry",
         "disgust",
@@ -168,9 +185,34 @@ class FER(VisionDataset):
             )
 
         self.split = Partition[split]
-        data_file = self.data_files[self.split]
-        data_filepath = self.processed_folder / data_file
-        self.data, self.targets = torch.load(data_filepath)
+        if self._check_exists_mmap():
+            self.data, self.targets = self._load_mmap(self.split)
+        else:
+            data_file = self.data_files[self.split]
+            data_filepath = self.processed_folder / data_file
+            self.data, self.targets = torch.load(data_filepath)
+
+    def _load_mmap(self, partition: Partition) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Memory-map the images of the partition from the raw image file.
+
+        Images are not read at load time: pages are brought in on access, and
+        backed by the OS page cache shared among all the processes mapping
+        the same file. The copy-on-write mode keeps the file untouched whilst
+        still returning writable (hence torch-compatible) arrays.
+        """
+        with np.load(self.processed_folder / self.mmap_index_file) as index:
+            position = _position(partition)
+            start, stop = index["offsets"][position : position + 2]
+            image_shape = tuple(int(d) for d in index["image_shape"])
+            targets = index["targets"][start:stop].astype(np.int64)
+        images = np.memmap(
+            self.processed_folder / self.mmap_images_file,
+            dtype=np.uint8,
+            mode="c",
+            offset=int(start) * int(np.prod(image_shape)),
+            shape=(int(stop - start),) + image_shape,
+        )
+        return torch.from_numpy(images), torch.from_numpy(targets)
 
     def __len__(self):
         return len(self.data)
@@ -224,12 +266,76 @@ class FER(VisionDataset):
         return {i: c for i, c in enumerate(FER.classes)}
 
     def _check_exists(self):
+        if self._check_exists_mmap():
+            return True
         for data_fname in self.data_files.values():
             data_file = self.processed_folder / data_fname
             if not data_file.exists():
                 return False
         return True
 
+    def _check_exists_mmap(self):
+        for data_fname in (self.mmap_images_file, self.mmap_index_file):
+            if not (self.processed_folder / data_fname).exists():
+                return False
+        return True
+
+    def save_mmap(self):
+        """Convert the processed torch files into the memory-mapped format.
+
+        Partitions are written one at a time into a single raw uint8 image
+        file, so that `FER` instances transparently open the new format
+        when available.
+        """
+
+        def _write_images(images_file):
+            offsets, targets, image_shape = [0], list(), None
+            for partition in Partition:
+                data_filepath = self.processed_folder / self.data_files[partition]
+                images, labels = torch.load(data_filepath)
+                images_file.write(images.contiguous().numpy().tobytes())
+                targets.append(labels.numpy().astype(np.uint8))
+                offsets.append(offsets[-1] + len(images))
+                image_shape = tuple(images.shape[1:])
+            return np.concatenate(targets), offsets, image_shape
+
+        self._write_mmap(_write_images)
+
+    def _write_mmap(self, write_images: Callable[[Any], Tuple]):
+        """Write the memory-mapped format atomically.
+
+        Both files are written to temporary files first, then moved in place
+        (the index last), so that processes that have the images memory-mapped
+        keep reading the old (unlinked) file, and an interrupted run never
+        leaves an index next to a partial images file.
+
+        Parameters
+        ----------
+        write_images : Callable[[Any], Tuple]
+            Writes the raw uint8 images (in `Partition` order) to the given
+            file, and returns their targets, partition offsets, and image shape.
+        """
+        images_filepath = self.processed_folder / self.mmap_images_file
+        index_filepath = self.processed_folder / self.mmap_index_file
+        images_temp, index_temp = map(_temp_filepath, (images_filepath, index_filepath))
+        try:
+            with open(images_temp, "wb") as images_file:
+                targets, offsets, image_shape = write_images(images_file)
+            with open(index_temp, "wb") as index_file:
+                np.savez(
+                    index_file,
+                    targets=targets,
+                    offsets=np.asarray(offsets, dtype=np.int64),
+                    image_shape=np.asarray(image_shape, dtype=np.int64),
+                )
+            # Without an index, the (new) images are never paired with an old one
+            index_filepath.unlink(missing_ok=True)
+            os.replace(images_temp, images_filepath)
+            os.replace(index_temp, index_filepath)
+        finally:
+            for temp in (images_temp, index_temp):
+                temp.unlink(missing_ok=True)
+
     def extra_repr(self):
         return "Split: {}".format(self.split.value)
 
@@ -257,6 +363,9 @@ class FER(VisionDataset):
         """Download the FER data if it doesn't already exist in the processed folder"""
 
         if self._check_exists():
+            if not self._check_exists_mmap():
+                # one-off conversion of previously processed torch files
+                self.save_mmap()
             return
 
         os.makedirs(self.raw_folder, exist_ok=True)
@@ -269,59 +378,161 @@ class FER(VisionDataset):
                 url, download_root=self.raw_folder, filename=filename, md5=md5
             )
 
-        # process and save as torch files
-        def _set_partition(label: str) -> str:
-            if label == "Training":
-                return Partition.train.value
-            if label == "PrivateTest":
-                return Partition.validation.value
-            return Partition.test.value
-
         print("Processing...", end="")
         raw_data_filepath = self.raw_folder / self.RAW_DATA_FOLDER / self.RAW_DATA_FILE
-        raw_df = pd.read_csv(raw_data_filepath)
-        raw_df["data_partition"] = raw_df.Usage.apply(_set_partition)
+        stats = self._process_raw_data(raw_data_filepath)
+        print("Done!")
+        print(
+            "Processed {rows} rows in {seconds:.1f}s ({rows_per_sec:,.0f} rows/sec, "
+            "peak RSS: {peak_rss_mb:.0f} MB main, {peak_rss_workers_mb:.0f} MB "
+            "workers)".format(**stats)
+        )
+
+    def _process_raw_data(self, raw_data_filepath: Path) -> Dict[str, float]:
+        """Stream the raw CSV file in chunks, and convert it into the processed
+        (memory-mapped, and torch) formats.
+
+        Chunks of raw CSV lines are read by the main process, and parsed in bulk
+        (i.e. one parse per chunk, rather than per row) by a pool of worker
+        processes. Parsed images are appended to per-partition files as soon as
+        they are ready, and the number of chunks in flight is bounded, so that
+        peak memory does not depend on the size of the CSV file.
 
+        Returns
+        -------
+        Dict[str, float]
+            Processing statistics, i.e. number of rows, elapsed time, rows/sec,
+            and peak RSS (in MB) of the main process and of the worker processes.
+        """
+        start = timer()
+        workers = self.PROCESSING_WORKERS or os.cpu_count() or 1
+        parts_filepaths = {
+            partition: self.processed_folder / f"{partition.value}.u8.part"
+            for partition in Partition
+        }
+        targets = {partition: list() for partition in Partition}
+        n_pixels = None
+
+        def _write_chunk(chunk_future: Future):
+            nonlocal n_pixels
+            images, labels, partitions = chunk_future.result()
+            n_pixels = images.shape[1]
+            for position, partition in enumerate(Partition):
+                mask = partitions == position
+                parts[partition].write(images[mask].tobytes())
+                targets[partition].append(labels[mask])
+
+        with ExitStack() as stack:
+            raw_data = stack.enter_context(open(raw_data_filepath))
+            columns = raw_data.readline().strip().split(",")
+            if columns != ["emotion", "pixels", "Usage"]:
+                raise ValueError(f"Unexpected columns in raw data file: {columns}")
+            parts = {
+                partition: stack.enter_context(open(filepath, "wb"))
+                for partition, filepath in parts_filepaths.items()
+            }
+            if workers > 1:
+                executor = ProcessPoolExecutor(max_workers=workers)
+                submit = stack.enter_context(executor).submit
+            else:  # no point in paying for inter-process communication
+                submit = _run_inline
+            in_flight = deque()
+            while True:
+                lines = list(islice(raw_data, self.PROCESSING_CHUNK_SIZE))
+                if not lines:
+                    break
+                in_flight.append(submit(_parse_chunk, lines))
+                if len(in_flight) >= 2 * workers:
+                    _write_chunk(in_flight.popleft())
+            while in_flight:
+                _write_chunk(in_flight.popleft())
+
+        # Assemble partitions (in `Partition` order) into the memory-mapped format
+        offsets = [0]
+
+        def _write_images(images_file):
+            for partition, filepath in parts_filepaths.items():
+                with open(filepath, "rb") as part:
+                    shutil.copyfileobj(part, images_file)
+                filepath.unlink()
+                offsets.append(offsets[-1] + sum(map(len, targets[partition])))
+            side = int(sqrt(n_pixels or 0))
+            labels = np.concatenate([np.concatenate(t) for t in targets.values()])
+            return labels, offsets, (side, side)
+
+        self._write_mmap(_write_images)
+
+        # Torch files are written from the memory-mapped images, for compatibility
         for partition in Partition:
-            dataset = raw_df[raw_df["data_partition"] == partition.value]
-            images = self._images_as_torch_tensors(dataset)
-            labels = self._labels_as_torch_tensors(dataset)
+            images, labels = self._load_mmap(partition)
             data_file = self.processed_folder / self.data_files[partition]
             with open(data_file, "wb") as f:
                 torch.save((images, labels), f)
-        print("Done!")
 
-    def _images_as_torch_tensors(self, dataset: pd.DataFrame) -> torch.Tensor:
-        """
-        Extract all the pixel from the input dataframes, and convert images in
-        a [sample x features] torch.Tensor
+        elapsed = timer() - start
+        return {
+            "rows": offsets[-1],
+            "seconds": elapsed,
+            "rows_per_sec": offsets[-1] / elapsed,
+            "peak_rss_mb": _peak_rss_mb(),
+            "peak_rss_workers_mb": _peak_rss_mb(children=True),
+        }
 
-        Parameters
-        ----------
-        dataset : pd.DataFrame
-            The target dataset data_partition (i.e. training, validation, or test)
-            as extracted from the original dataset
-        Returns
-        -------
-        torch.Tensor
-            [sample x pixels] tensor representing the whole data data_partition as
-            torch Tensor.
-        """
-        imgs_np = (dataset["pixels"].map(self._to_numpy)).values
-        imgs_np = np.concatenate(imgs_np, axis=0)
-        samples_no, pixels = imgs_np.shape
-        new_shape = (samples_no, int(sqrt(pixels)), int(sqrt(pixels)))
-        return torch.from_numpy(imgs_np).view(new_shape)
 
-    @staticmethod
-    def _labels_as_torch_tensors(dataset: pd.DataFrame):
-        """Extract labels from pd.Series and convert into torch.Tensor"""
-        labels_np = dataset["emotion"].values.astype(np.int)
-        return torch.from_numpy(labels_np)
+_USAGE_PARTITIONS = {
+    "Training": Partition.train,
+    "PrivateTest": Partition.validation,
+    "PublicTest": Partition.test,
+}
 
-    @staticmethod
-    def _to_numpy(pixels: str):
-        """Convert one-line string pixels into NumPy array, adding the first
-        extra axis (sample dimension) later used as the concatenation axis"""
-        img_array = np.fromstring(pixels, dtype=np.uint8, sep=" ")[np.newaxis, ...]
-        return img_array
+
+def _parse_chunk(lines: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parse a chunk of raw `emotion,pixels,Usage` CSV lines in bulk.
+
+    Usage labels are split off each line, and emotions and pixels of the
+    whole chunk are then parsed at once (rather than row by row).
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        [samples x pixels] uint8 images, uint8 labels, and the position
+        of the data partition of each sample (in `Partition` order).
+    """
+    values, usages = zip(*(line.rsplit(",", 1) for line in lines))
+    flat = np.fromstring(" ".join(values).replace(",", " "), dtype=np.uint8, sep=" ")
+    if flat.size % len(lines):
+        raise ValueError("Inconsistent number of pixels among rows in chunk")
+    flat = flat.reshape(len(lines), -1)
+    default_position = _position(Partition.test)
+    positions = {usage: _position(p) for usage, p in _USAGE_PARTITIONS.items()}
+    partitions = [positions.get(u.strip(), default_position) for u in usages]
+    return flat[:, 1:], flat[:, 0].copy(), np.asarray(partitions, dtype=np.int8)
+
+
+def _position(partition: Partition) -> int:
+    return list(Partition).index(partition)
+
+
+def _temp_filepath(filepath: Path) -> Path:
+    """Temporary (hidden, per-process) file to be moved to `filepath`"""
+    return filepath.with_name(f".{filepath.name}.{os.getpid()}.tmp")
+
+
+def _run_inline(fn: Callable, *args: Any) -> Future:
+    """Run the function straight away, wrapping its result in a (done) Future"""
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def _peak_rss_mb(children: bool = False) -> float:
+    """Peak resident set size in MB of this process, or of its (terminated)
+    children, i.e. processing workers. NaN where unavailable (e.g. Windows)."""
+    try:
+        import resource  # Unix only
+    except ImportError:
+        return float("nan")
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    max_rss = resource.getrusage(who).ru_maxrss
+    # `ru_maxrss` is in bytes on macOS, KB otherwise
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
@@ -1,5 +1,13 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Union, Tuple, Dict, Optional, Any
+from random import random
+from threading import Lock
+from functools import partial
+from typing import Union, Tuple, Dict, Optional, Any, List, Sequence, Iterable
+import numpy as np
+from PIL import Image
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
@@ -7,13 +15,17 @@ from pymongo.errors import ServerSelectionTimeoutError
 from torch.utils.data import Dataset
 
 try:
-    from .fer import Sample
+    from .fer import FER
+    from .sources import Sample
 except ImportError:
-    from dataset import Sample
+    from fer import FER
+    from sources import Sample
 
 MLSet = Union[str, Tuple[str]]
 MongoFilter = Union[Dict[str, str], Dict[str, int], Dict[str, Dict[str, Tuple[str]]]]
 
+FACE_SHAPE = (48, 48)
+
 
 @dataclass
 class MongoDatabaseInfo:
@@ -23,16 +35,114 @@ class MongoDatabaseInfo:
     collection: str = "kaggle_faces"
 
 
+# Clients are thread-safe, and each of them holds a pool of connections:
+# a single client per server is shared by all the proxies in the process.
+MONGO_POOL_SIZE = 32
+_CLIENTS: Dict[Tuple[str, int], MongoClient] = dict()
+_CLIENTS_LOCK = Lock()
+
+
+def get_mongo_client(host: str, port: int) -> Optional[MongoClient]:
+    """
+    Process-wide, pooled MongoDB client for the given server.
+    The connection to the server is only checked when the client is created:
+    `None` will be returned if the connection cannot be established.
+    """
+    with _CLIENTS_LOCK:
+        mongo_client = _CLIENTS.get((host, port), None)
+        if mongo_client is not None:
+            return mongo_client
+        mongo_client = MongoClient(
+            host=host,
+            port=port,
+            serverSelectionTimeoutMS=3000,
+            maxPoolSize=MONGO_POOL_SIZE,
+        )
+        try:
+            _ = mongo_client.server_info()
+        except ServerSelectionTimeoutError:
+            print(
+                "Connection to MongoDB[{}:{}] refused! Please check.".format(host, port)
+            )
+            mongo_client.close()
+            return None
+        _CLIENTS[(host, port)] = mongo_client
+        return mongo_client
+
+
+def close_mongo_clients() -> None:
+    """Close all the shared clients (e.g. on application shutdown)"""
+    with _CLIENTS_LOCK:
+        for mongo_client in _CLIENTS.values():
+            mongo_client.close()
+        _CLIENTS.clear()
+
+
+class DocumentCache:
+    """Least-recently-used cache of MongoDB documents, keyed by ObjectId"""
+
+    def __init__(self, max_documents: int) -> None:
+        self.max_documents = max_documents
+        self._documents = OrderedDict()
+        self._lock = Lock()  # documents are also cached by the read-ahead thread
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def get(self, oid: Any) -> Optional[Dict]:
+        with self._lock:
+            document = self._documents.get(oid, None)
+            if document is not None:
+                self._documents.move_to_end(oid)
+            return document
+
+    def put(self, oid: Any, document: Dict) -> None:
+        with self._lock:
+            self._documents[oid] = document
+            self._documents.move_to_end(oid)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+
+
 class MongoProxy:
-    """Class to Proxy Dataset interactions with MongoDB"""
+    """Class to Proxy Dataset interactions with MongoDB
 
-    def __init__(self, mongodb_info: MongoDatabaseInfo, ml_set: MLSet):
+    The proxy starts in constant time: ObjectIds of all the samples are only
+    retrieved when samples are accessed by index, whilst `sample` draws
+    random documents server-side.
+
+    Documents are fetched in batches (a single `$in` query per batch),
+    and kept in a bounded LRU cache. When samples are accessed sequentially
+    (e.g. by a DataLoader without shuffling), the following `read_ahead`
+    documents are fetched in background, in a single round trip.
+    """
+
+    RANDOM_KEY = "random_key"
+    MAX_SAMPLE_ROUNDS = 4  # `$sample` draws, for documents not excluded
+
+    def __init__(
+        self,
+        mongodb_info: MongoDatabaseInfo,
+        ml_set: MLSet,
+        cache_size: int = 4096,
+        read_ahead: int = 256,
+    ):
         self._ml_set_filter = self._generate_mongo_filter(ml_set)
         self.db_info = mongodb_info
         self._mongo_client = self._init_mongo_connection()
         self._db = self._set_database()
         self._collection = self._set_collection()
-        self._sample_oids = self._retrieve_all_oids()
+        self._sample_oids = None  # retrieved on first access by index
+        self._cache = DocumentCache(max_documents=cache_size)
+        self.read_ahead = read_ahead
+        self._last_index = None
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetched = list()  # (range of indices, Future) being read ahead
+        self._last_window = None
+        self._class_counts = None  # statistics cache
+        self._excluded = set()  # ObjectIds already served, or blacklisted
+        self._random_keys = None  # whether documents have indexed random keys
+        self._lock = Lock()  # the proxy may be shared by concurrent requests
 
     @staticmethod
     def _generate_mongo_filter(ml_set: MLSet) -> MongoFilter:
@@ -42,40 +152,29 @@ class MongoProxy:
 
     def _init_mongo_connection(self) -> Optional[MongoClient]:
         """
-        Initialise Client to connect to MongoDB. `None` will be returned
+        Shared Client to connect to MongoDB. `None` will be returned
         if the connection cannot be established.
         """
-        host, port = self.db_info.host, self.db_info.port
-        mongo_client = MongoClient(host=host, port=port, serverSelectionTimeoutMS=3000)
-        try:
-            _ = mongo_client.server_info()
-        except ServerSelectionTimeoutError:
-            print(
-                "Connection to MongoDB[{}:{}] refused! Please check.".format(host, port)
-            )
-            return None
-        else:
-            return mongo_client
+        return get_mongo_client(self.db_info.host, self.db_info.port)
 
     def _set_database(self) -> Optional[Database]:
         """Initialise the Database as set in the
         provided `MongoDatabaseInfo`.
-        If no matching database is found, None is returned."""
+        Whether the database exists is checked along with the collection."""
         if self._mongo_client is None:
             return None
-        db_name = self.db_info.db
-        if db_name not in self._mongo_client.list_database_names():
-            return None
-        return self._mongo_client[db_name]
+        return self._mongo_client[self.db_info.db]
 
     def _set_collection(self) -> Optional[Collection]:
         """Initialise the Mongo Collection as set in the
         provided `MongoDatabaseInfo`.
-        If no matching collection is found, None is returned."""
+        If no matching collection (or database) is found, None is returned."""
         if self._mongo_client is None or self._db is None:
             return None
         collection = self.db_info.collection
-        if collection not in self._db.list_collection_names():
+        # only look up the selected collection, rather than listing all of them
+        if not self._db.list_collection_names(filter={"name": collection}):
+            self._db = None
             return None
         return self._db[collection]
 
@@ -85,7 +184,7 @@ class MongoProxy:
         If case of any error in connecting to the db or the collection, None
         is returned.
         """
-        if all((self._mongo_client, self._db, self._collection)):
+        if self.connected:
             # fetch all IDs of docs matching current filter
             ids_cursor = self._collection.find(self._ml_set_filter, {"_id": 1}).sort(
                 "_id"
@@ -93,27 +192,277 @@ class MongoProxy:
             return tuple(obj_id["_id"] for obj_id in ids_cursor)
         return None
 
+    @property
+    def sample_oids(self) -> Optional[Tuple[Any, ...]]:
+        """ObjectIds of all the samples, sorted, only needed (and retrieved
+        once) to access samples by index. Random sampling does not need them."""
+        if self._sample_oids is None:
+            with self._lock:
+                if self._sample_oids is None:
+                    self._sample_oids = self._retrieve_all_oids()
+        return self._sample_oids
+
+    @property
+    def connected(self) -> bool:
+        return all(
+            conn is not None
+            for conn in (self._mongo_client, self._db, self._collection)
+        )
+
+    def _query_filter(self, query_filter: MongoFilter = None) -> MongoFilter:
+        """Selection filter on the `ml_set`, refined by the (optional) query
+        filter. A new filter is returned, leaving the `ml_set` filter untouched."""
+        selection = dict(self._ml_set_filter)
+        if query_filter:
+            selection.update(query_filter)
+        return selection
+
+    def class_counts(self) -> Dict[Any, int]:
+        """Number of samples per emotion in the reference collection.
+
+        Counts are computed with a single `$group` aggregation, and cached
+        until `invalidate_stats` is called (e.g. when documents are added).
+        """
+        if self._class_counts is None:
+            if not self.connected:
+                return dict()
+            pipeline = [
+                {"$match": self._query_filter()},
+                {"$group": {"_id": "$emotion", "count": {"$sum": 1}}},
+            ]
+            self._class_counts = {
+                group["_id"]: group["count"]
+                for group in self._collection.aggregate(pipeline)
+            }
+        return self._class_counts
+
+    def invalidate_stats(self) -> None:
+        self._class_counts = None
+
     def count(self, query_filter: MongoFilter = None):
         """Returns the total number of sample in the reference collection.
         An additional query filter can be provided to refine the selection,
-        in addition to the default selection on the `ml_set`
+        in addition to the default selection on the `ml_set`.
+        Total and per-emotion counts are served from the statistics cache.
         """
-        if all((self._mongo_client, self._db, self._collection)):
-            filter = self._ml_set_filter
-            if query_filter:
-                filter.update(query_filter)
-            return self._collection.count_documents(filter)
-        return 0
+        if not self.connected:
+            return 0
+        if not query_filter:
+            return sum(self.class_counts().values())
+        if set(query_filter.keys()) == {"emotion"} and not isinstance(
+            query_filter["emotion"], dict
+        ):
+            return self.class_counts().get(query_filter["emotion"], 0)
+        return self._collection.count_documents(self._query_filter(query_filter))
 
-    def fetch(self, index):
+    def _oid(self, index: int) -> Optional[Any]:
         try:
-            oid = self._sample_oids[index]
-        except IndexError:
-            pass
-        else:
-            query_filter = {"_id": oid}
-            query_filter.update(self._ml_set_filter)
-            return self._collection.find_one(query_filter)
+            return self.sample_oids[index]
+        except (IndexError, TypeError):
+            return None
+
+    def fetch_many(self, indices: Sequence[int]) -> List[Optional[Dict]]:
+        """Fetch the documents of the selected samples, in order, with a single
+        `$in` query for all those which are not already in cache.
+        `None` is returned in place of documents not found."""
+        oids = [self._oid(index) for index in indices]
+        documents = {oid: self._cache.get(oid) for oid in oids if oid is not None}
+        missing = [oid for oid, document in documents.items() if document is None]
+        if missing and self._collection is not None:
+            query_filter = self._query_filter({"_id": {"$in": missing}})
+            for document in self._collection.find(query_filter):
+                documents[document["_id"]] = document
+                self._cache.put(document["_id"], document)
+        return [documents.get(oid, None) if oid is not None else None for oid in oids]
+
+    def _read_ahead_from(self, index: int) -> None:
+        """Fetch the next `read_ahead` documents in background, as soon as
+        the current position gets past half of the last window read ahead."""
+        if self.read_ahead <= 0:
+            return
+        self._prefetched = [(r, f) for r, f in self._prefetched if not f.done()]
+        start, window = index, self._last_window
+        if window is not None and window.start <= index < window.stop:
+            if index + self.read_ahead // 2 < window.stop:
+                return
+            start = window.stop
+        indices = range(start, min(start + self.read_ahead, len(self.sample_oids)))
+        if len(indices):
+            future = self._prefetcher.submit(self.fetch_many, indices)
+            self._prefetched.append((indices, future))
+            self._last_window = indices
+
+    def exclude(self, oids: Iterable[Any]) -> None:
+        """Exclude documents from random sampling (e.g. blacklisted samples)"""
+        self._excluded.update(oids)
+
+    def ensure_random_keys(self) -> None:
+        """Assign a random key to the documents that have none, and index the
+        keys (along with the `ml_set`), enabling index-based random sampling.
+        Requires MongoDB >= 4.4.2 (`$rand`). To be run once, offline."""
+        if not self.connected:
+            return
+        self._collection.update_many(
+            {self.RANDOM_KEY: {"$exists": False}},
+            [{"$set": {self.RANDOM_KEY: {"$rand": {}}}}],
+        )
+        self._collection.create_index([("set", 1), (self.RANDOM_KEY, 1)])
+        self._random_keys = True
+
+    @property
+    def random_keys(self) -> bool:
+        if self._random_keys is None:
+            self._random_keys = self.connected and any(
+                field == self.RANDOM_KEY
+                for index in self._collection.index_information().values()
+                for field, _ in index["key"]
+            )
+        return self._random_keys
+
+    def sample(self, k: int) -> List[Dict]:
+        """Draw (up to) k random documents, server-side, among those in the
+        `ml_set` which have not been already served, nor excluded.
+
+        If documents have an indexed random key (see `ensure_random_keys`),
+        documents are selected with an index range scan starting from a random
+        point, wrapping around the key space. Otherwise, the `$sample`
+        aggregation stage is used.
+
+        Excluded documents are skipped client-side, rather than listed in the
+        query, which would grow with every document served.
+        """
+        if not self.connected or k <= 0:
+            return list()
+        # concurrent draws must not return the same documents
+        with self._lock:
+            if self.random_keys:
+                documents = self._scan_random_keys(k)
+            else:
+                documents = self._sample_stage(k)
+            for document in documents:
+                self._excluded.add(document["_id"])
+                self._cache.put(document["_id"], document)
+            return documents
+
+    def _scan_random_keys(self, k: int) -> List[Dict]:
+        pivot = random()
+        documents = list()
+        for key_range in ({"$gte": pivot}, {"$lt": pivot}):
+            query_filter = self._query_filter({self.RANDOM_KEY: key_range})
+            cursor = self._collection.find(query_filter).sort(self.RANDOM_KEY, 1)
+            with cursor:
+                for document in cursor.batch_size(k):
+                    if document["_id"] not in self._excluded:
+                        documents.append(document)
+                        if len(documents) == k:
+                            return documents
+        return documents
+
+    def _sample_stage(self, k: int) -> List[Dict]:
+        documents, drawn_oids = list(), set()
+        for _ in range(self.MAX_SAMPLE_ROUNDS):
+            # oversample by the share of excluded documents (all of them, at most)
+            total = self.count()
+            available = max(total - len(self._excluded), 1)
+            size = max(min(total, -(-(k - len(documents)) * total // available)), 1)
+            pipeline = [{"$match": self._query_filter()}, {"$sample": {"size": size}}]
+            drawn = list(self._collection.aggregate(pipeline))
+            for document in drawn:
+                oid = document["_id"]
+                if oid not in self._excluded and oid not in drawn_oids:
+                    drawn_oids.add(oid)
+                    documents.append(document)
+            if len(documents) >= k or len(drawn) < size:
+                break  # enough documents, or all of them drawn already
+        return documents[:k]
+
+    def fetch(self, index):
+        oid = self._oid(index)
+        if oid is None:
+            return None
+        sequential = self._last_index is not None and index == self._last_index + 1
+        self._last_index = index
+        document = self._cache.get(oid)
+        if document is None:
+            for indices, future in self._prefetched:
+                if index in indices:
+                    future.result()  # wait for the read-ahead, rather than re-fetching
+                    document = self._cache.get(oid)
+                    break
+        if document is None:
+            (document,) = self.fetch_many([index])
+        if sequential:
+            self._read_ahead_from(index + 1)
+        return document
+
+
+def document_to_sample(document: Optional[Dict], index: int = -1) -> Optional[Sample]:
+    """Sample of a face document, i.e. `emotion`, and 48x48 grayscale pixels
+    either as raw bytes (`image`), or space-separated values (`pixels`, as in
+    the FER CSV). Samples not accessed by index (e.g. random ones) get -1.
+    `None` is returned for documents not found."""
+    if document is None:
+        return None
+    if "image" in document:
+        pixels = np.frombuffer(document["image"], dtype=np.uint8)
+    else:
+        pixels = np.fromstring(document["pixels"], dtype=np.uint8, sep=" ")
+    image = Image.fromarray(pixels.reshape(FACE_SHAPE), mode="L")
+    return Sample(index=index, emotion=int(document["emotion"]), image=image)
+
+
+# Blocking pymongo calls of the async proxies run in this (shared) pool:
+# as many concurrent requests as pooled connections can overlap their I/O.
+_MONGO_IO_EXECUTOR = ThreadPoolExecutor(
+    max_workers=MONGO_POOL_SIZE, thread_name_prefix="mongo-io"
+)
+
+
+class AsyncMongoProxy:
+    """Awaitable interface to a `MongoProxy`, for `async` endpoints.
+
+    Queries run on a thread pool shared by the whole process (and on the
+    pooled, shared client), so that the event loop is never blocked by
+    the database, and the DB I/O of concurrent requests overlaps.
+    Use `AsyncMongoProxy.create` to also set up the proxy (i.e. connect)
+    off the event loop.
+    """
+
+    def __init__(self, mongo_proxy: MongoProxy) -> None:
+        self.proxy = mongo_proxy
+
+    @classmethod
+    async def create(
+        cls, mongodb_info: MongoDatabaseInfo, ml_set: MLSet, **kwargs
+    ) -> "AsyncMongoProxy":
+        mongo_proxy = await cls._run(
+            partial(MongoProxy, mongodb_info=mongodb_info, ml_set=ml_set, **kwargs)
+        )
+        return cls(mongo_proxy)
+
+    @staticmethod
+    async def _run(fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_MONGO_IO_EXECUTOR, fn, *args)
+
+    @property
+    def connected(self) -> bool:
+        return self.proxy.connected
+
+    async def fetch(self, index: int) -> Optional[Dict]:
+        return await self._run(self.proxy.fetch, index)
+
+    async def fetch_many(self, indices: Sequence[int]) -> List[Optional[Dict]]:
+        return await self._run(self.proxy.fetch_many, list(indices))
+
+    async def count(self, query_filter: MongoFilter = None) -> int:
+        return await self._run(self.proxy.count, query_filter)
+
+    async def class_counts(self) -> Dict[Any, int]:
+        return await self._run(self.proxy.class_counts)
+
+    async def sample(self, k: int) -> List[Dict]:
+        return await self._run(self.proxy.sample, k)
 
 
 class KaggleMongoDataset(Dataset):
@@ -124,23 +473,56 @@ class KaggleMongoDataset(Dataset):
         if db_info is None:
             db_info = MongoDatabaseInfo()  # default values
         self._mongo_proxy = MongoProxy(ml_set=ml_set, mongodb_info=db_info)
+        self._async_proxy = AsyncMongoProxy(self._mongo_proxy)
 
     def __len__(self):
         return self._mongo_proxy.count()
 
     def __getitem__(self, index):
         db_entry = self._mongo_proxy.fetch(index)
-        sample = Sample.from_json(db_entry)
-        if self._transform:
+        return self._to_sample(db_entry, index)
+
+    def __getitems__(self, indices: Sequence[int]) -> List:
+        """Batched access, used by torch DataLoaders to fetch a whole batch
+        of samples at once (i.e. with a single query)"""
+        db_entries = self._mongo_proxy.fetch_many(indices)
+        return [self._to_sample(e, i) for e, i in zip(db_entries, indices)]
+
+    def _to_sample(self, db_entry: Optional[Dict], index: int = -1) -> Optional[Sample]:
+        sample = document_to_sample(db_entry, index)
+        if sample is not None and self._transform:
             sample.image = self._transform(sample.image)
         return sample
 
+    def random_samples(self, k: int) -> List:
+        """Draw k random samples not served yet, without retrieving all the
+        ObjectIds of the collection"""
+        return [self._to_sample(db_entry) for db_entry in self._mongo_proxy.sample(k)]
+
+    async def get_items_async(self, indices: Sequence[int]) -> List:
+        """Awaitable batched access, not blocking the event loop"""
+        db_entries = await self._async_proxy.fetch_many(indices)
+        return [self._to_sample(e, i) for e, i in zip(db_entries, indices)]
+
+    async def random_samples_async(self, k: int) -> List:
+        """Awaitable version of `random_samples`"""
+        db_entries = await self._async_proxy.sample(k)
+        return [self._to_sample(db_entry) for db_entry in db_entries]
+
+    async def count_async(self) -> int:
+        return await self._async_proxy.count()
+
     def class_weights(self) -> Dict[int, float]:
-        """"""
-        num_samples = self._mongo_proxy.count()
-        n_classes = len(Sample.EMOTION_MAP.keys())
+        """Balanced weight of each emotion (i.e. inversely proportional to its
+        number of samples). Emotions with no samples get no weight."""
+        class_counts = self._mongo_proxy.class_counts()
+        num_samples = sum(class_counts.values())
+        emotions = FER.classes_map()
+        n_classes = len(emotions)
         class_weights = {}
-        for emotion in Sample.EMOTION_MAP:
-            y_count = self._mongo_proxy.count(query_filter={"emotion": emotion})
-            class_weights[emotion] = num_samples / (n_classes * y_count)
+        for emotion in emotions:
+            y_count = class_counts.get(emotion, 0)
+            class_weights[emotion] = (
+                num_samples / (n_classes * y_count) if y_count else 0.0
+            )
         return class_weights
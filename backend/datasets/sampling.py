@@ -0,0 +1,87 @@
+"""
+Incrementally maintained pool of dataset indices available for sampling.
+"""
+
+import numpy as np
+from random import randrange
+from typing import Iterable, List
+
+
+class IndexPool:
+    """Pool of available sample indices supporting O(k) random draws.
+
+    Indices are kept in a dense array whose first `size` entries are the
+    indices still available, alongside a position map recording where each
+    index lives in that array. Removing an index swaps it with the last
+    available entry and shrinks the pool by one, so both removals and draws
+    never touch more than a constant number of cells per index.
+
+    Parameters
+    ----------
+    n_indices : int
+        Total number of indices, i.e. the pool is initialised with
+        `range(n_indices)`.
+    excluded : Iterable[int] or np.ndarray, optional
+        Indices to remove from the pool straight away (e.g. samples
+        already served, or blacklisted in a previous session).
+    """
+
+    def __init__(self, n_indices: int, excluded: Iterable[int] = ()) -> None:
+        dtype = np.int32 if n_indices < np.iinfo(np.int32).max else np.int64
+        available = np.ones(n_indices, dtype=bool)
+        if not isinstance(excluded, np.ndarray):
+            excluded = np.fromiter(excluded, dtype=np.int64)
+        available[excluded[(excluded >= 0) & (excluded < n_indices)]] = False
+        # available indices first, then excluded ones (vectorised removal)
+        self._pool = np.concatenate(
+            (np.flatnonzero(available), np.flatnonzero(~available))
+        ).astype(dtype)
+        self._position = np.empty(n_indices, dtype=dtype)
+        self._position[self._pool] = np.arange(n_indices, dtype=dtype)
+        self._size = int(available.sum())
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, index: int) -> bool:
+        if not 0 <= index < len(self._position):
+            return False
+        return self._position[index] < self._size
+
+    def remove(self, index: int) -> bool:
+        """Remove index from the pool in O(1).
+
+        Returns
+        -------
+        bool
+            True if the index was available, False if it had already been
+            removed (or it is out of range).
+        """
+        if index not in self:
+            return False
+        pos = self._position[index]
+        last = self._size - 1
+        last_index = self._pool[last]
+        # swap with the last available entry, then shrink the pool
+        self._pool[pos], self._pool[last] = last_index, index
+        self._position[last_index], self._position[index] = pos, last
+        self._size = last
+        return True
+
+    def draw(self, k: int) -> List[int]:
+        """Draw (and remove) k distinct random indices from the pool in O(k).
+
+        Raises
+        ------
+        ValueError
+            Raised if k is negative, or larger than the number of indices
+            still available.
+        """
+        if not 0 <= k <= self._size:
+            raise ValueError("Sample larger than population or is negative")
+        drawn = list()
+        for _ in range(k):
+            index = int(self._pool[randrange(self._size)])
+            self.remove(index)
+            drawn.append(index)
+        return drawn
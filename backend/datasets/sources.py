@@ -2,24 +2,70 @@
 Specify Data sources used to proxy access to available Torch Datasets
 """
 
-from dataclasses import dataclass
+from bisect import bisect_right
+import numpy as np
+import torch
+from torch import Tensor
 from torch.utils.data import Dataset, ConcatDataset
 from .fer import FER
-from typing import Callable, Sequence, Union, Set
+from .sampling import IndexPool
+from .cache import EncodedImageCache, encode_png
+from .state import BackgroundFlusher, IndexBitset
+from .annotations import AnnotationStore
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Union, Set
 from PIL.Image import Image as PILImage
-from random import sample
 from hashlib import sha256
 from os import path
 from pathlib import Path
+from threading import RLock
 
 SECRET_SPICE = "supersecrectspiceonthebackend"
 
 
-@dataclass
+def _uuid_prefix(emotion: int) -> str:
+    encode_s = f"{SECRET_SPICE}_{emotion}"
+    return sha256(bytes(encode_s, encoding="utf8")).hexdigest()
+
+
+# Digests only depend on the emotion: compute them once
+UUID_PREFIXES = {emotion: _uuid_prefix(emotion) for emotion in FER.classes_map()}
+
+
 class Sample:
-    index: int
-    emotion: int
-    image: PILImage
+    """Compact record of a dataset sample.
+
+    Only the index and the emotion label are stored: the image is
+    retrieved from the source dataset on first access, and then kept.
+    """
+
+    __slots__ = ("index", "emotion", "_image", "_source")
+
+    def __init__(
+        self,
+        index: int,
+        emotion: int,
+        image: Optional[PILImage] = None,
+        source: Optional[Dataset] = None,
+    ) -> None:
+        self.index = index
+        self.emotion = emotion
+        self._image = image
+        self._source = source
+
+    @property
+    def image(self) -> PILImage:
+        if self._image is None:
+            self._image, _ = self._source[self.index]
+        return self._image
+
+    @image.setter
+    def image(self, image: PILImage) -> None:
+        self._image = image
+        self._source = None  # image no longer matches the one in the source
+
+    @property
+    def source(self) -> Optional[Dataset]:
+        return self._source
 
     @property
     def emotion_label(self):
@@ -27,14 +73,23 @@ class Sample:
 
     @property
     def uuid(self) -> str:
-        encode_s = f"{SECRET_SPICE}_{self.emotion}"
-        encode_b = sha256(bytes(encode_s, encoding="utf8")).hexdigest()
+        try:
+            encode_b = UUID_PREFIXES[self.emotion]
+        except KeyError:
+            encode_b = _uuid_prefix(self.emotion)
         ref = hex(self.index)[2:]  # getting rid of 0x
-        uuid = f"{encode_b}_{ref}"
-        return uuid
+        return f"{encode_b}_{ref}"
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Sample):
+            return NotImplemented
+        return (self.index, self.emotion) == (other.index, other.emotion)
 
     def __hash__(self) -> int:
-        return int(self.uuid, base=16)
+        return hash((self.index, self.emotion))
+
+    def __repr__(self) -> str:
+        return f"Sample(index={self.index}, emotion={self.emotion})"
 
     def __iter__(self):
         return iter((self,))
@@ -48,6 +103,69 @@ class Sample:
             return -1
 
 
+def dataset_target(dataset: Dataset, index: int) -> int:
+    """Retrieve the target of a sample without loading its image, whenever
+    the dataset (or the datasets it concatenates) exposes its `targets`."""
+    if index < 0:
+        index += len(dataset)
+    if isinstance(dataset, ConcatDataset):
+        dataset_idx = bisect_right(dataset.cumulative_sizes, index)
+        if dataset_idx > 0:
+            index -= dataset.cumulative_sizes[dataset_idx - 1]
+        return dataset_target(dataset.datasets[dataset_idx], index)
+    targets = getattr(dataset, "targets", None)
+    if targets is not None:
+        return int(targets[index])
+    _, target = dataset[index]
+    return target
+
+
+def dataset_images(dataset: Dataset, indices: Sequence[int]) -> Optional[Tensor]:
+    """Retrieve the images of the selected samples as a single [n x H x W]
+    uint8 tensor, with one fancy-indexing operation over the data of the
+    dataset (or of each concatenated dataset). `None` is returned if the
+    dataset does not expose its data as a tensor."""
+    indices = torch.as_tensor(indices, dtype=torch.long)
+    indices = torch.where(indices < 0, indices + len(dataset), indices)
+    if isinstance(dataset, ConcatDataset):
+        ends = torch.as_tensor(dataset.cumulative_sizes)
+        starts = torch.cat((torch.zeros(1, dtype=ends.dtype), ends[:-1]))
+        dataset_ids = torch.bucketize(indices, ends, right=True)
+        images = None
+        for dataset_idx, sub_dataset in enumerate(dataset.datasets):
+            mask = dataset_ids == dataset_idx
+            if not mask.any():
+                continue
+            sub_images = dataset_images(
+                sub_dataset, indices[mask] - starts[dataset_idx]
+            )
+            if sub_images is None:
+                return None
+            if images is None:
+                shape = (len(indices),) + tuple(sub_images.shape[1:])
+                images = sub_images.new_empty(shape)
+            images[mask] = sub_images
+        return images
+    data = getattr(dataset, "data", None)
+    if not isinstance(data, Tensor):
+        return None
+    return data[indices]
+
+
+def stack_images(samples: Sequence[Sample]) -> Optional[Tensor]:
+    """Images of samples as a single [n x H x W] uint8 tensor, retrieved in
+    one go from their source dataset, without creating any PIL image.
+    `None` is returned if samples do not share the same source dataset,
+    or if the dataset does not support batched access."""
+    samples = list(iter(samples))
+    if not samples:
+        return None
+    source = samples[0].source
+    if source is None or any(s.source is not source for s in samples):
+        return None
+    return dataset_images(source, [s.index for s in samples])
+
+
 DatasetLoadFn = Callable[[], Dataset]
 
 
@@ -66,8 +184,16 @@ def only_fer_training() -> Dataset:
 
 class DataSource:
 
-    BLACKLIST_SAMPLES = Path("indices_blacklist.txt")
-    RETURNED_SAMPLES = Path("indices_sampled.txt")
+    BLACKLIST_SAMPLES = Path("indices_blacklist.bits")
+    RETURNED_SAMPLES = Path("indices_sampled.bits")
+    # Comma-separated files used by previous sessions, imported once if found
+    LEGACY_SAMPLES_LISTS = {
+        BLACKLIST_SAMPLES: Path("indices_blacklist.txt"),
+        RETURNED_SAMPLES: Path("indices_sampled.txt"),
+    }
+    SESSION_FLUSH_INTERVAL = 1.0  # seconds
+    ANNOTATIONS_DB = Path("annotations.db")
+    IMAGES_CACHE_BYTES = 32 * 2**20  # PNG-encoded images (~2KB each)
 
     def __init__(
         self,
@@ -75,6 +201,9 @@ class DataSource:
         target_emotions: Sequence[str] = FER.classes,
     ) -> None:
         self._dataset = None  # Instantiated once via property
+        self._pool = None  # Instantiated once via property
+        # concurrent (first) requests, and the warm-up, load the dataset once
+        self._loading = RLock()
         self._ds_load_fn = dataset_load_fn
         self._items_sampled = self._init_list(
             self.RETURNED_SAMPLES
@@ -82,12 +211,23 @@ class DataSource:
         self._blacklist = self._init_list(
             self.BLACKLIST_SAMPLES
         )  # Set of indices to exclude *ever*
+        self._session_flusher = BackgroundFlusher(
+            (self._items_sampled, self._blacklist),
+            interval=self.SESSION_FLUSH_INTERVAL,
+        )
+        self._session_flusher.start()
         self._emotions = target_emotions
-
-    def _init_list(self, samples_list_filepath: Path) -> Set:
-        if samples_list_filepath.exists():
-            return self._load_from(samples_list_filepath)
-        return set()
+        self._images_cache = EncodedImageCache(max_bytes=self.IMAGES_CACHE_BYTES)
+        self._annotations = AnnotationStore(self.ANNOTATIONS_DB)
+
+    def _init_list(self, samples_list_filepath: Path) -> IndexBitset:
+        legacy_filepath = self.LEGACY_SAMPLES_LISTS[samples_list_filepath]
+        import_legacy = not samples_list_filepath.exists() and legacy_filepath.exists()
+        indices = IndexBitset(samples_list_filepath)
+        if import_legacy:
+            indices.update(self._load_from(legacy_filepath))
+            indices.flush()
+        return indices
 
     @staticmethod
     def _load_from(samples_list_filepath: Path) -> Set:
@@ -98,18 +238,25 @@ class DataSource:
         indices = set(indices)
         return indices
 
-    @staticmethod
-    def _serialise(indices: Set, target_list_filepath: Path) -> None:
-        with open(target_list_filepath, "w") as f:
-            line = ",".join(map(str, indices))
-            f.write(f"{line}\n")
-
     @property
     def dataset(self) -> Dataset:
         if self._dataset is None:
-            self._dataset = self._ds_load_fn()
+            with self._loading:
+                if self._dataset is None:
+                    self._dataset = self._ds_load_fn()
         return self._dataset
 
+    @property
+    def pool(self) -> IndexPool:
+        if self._pool is None:
+            with self._loading:
+                if self._pool is None:
+                    excluded = np.concatenate(
+                        (self._items_sampled.indices(), self._blacklist.indices())
+                    )
+                    self._pool = IndexPool(len(self.dataset), excluded=excluded)
+        return self._pool
+
     @property
     def emotions(self) -> Sequence[str]:
         return self._emotions
@@ -121,22 +268,44 @@ class DataSource:
             idx = -1
         return idx
 
+    def images(self, indices: Sequence[int]) -> Optional[Tensor]:
+        """Images of the selected samples as a single [n x H x W] uint8 tensor"""
+        return dataset_images(self.dataset, indices)
+
     def __getitem__(self, index: Union[str, int]) -> Sample:
         try:
             index = int(index)
         except ValueError:
             index = Sample.retrieve_index(str(index))
-        image, label = self.dataset[index]
-        return Sample(index=index, emotion=label, image=image)
+        label = dataset_target(self.dataset, index)
+        return Sample(index=index, emotion=label, source=self.dataset)
+
+    def encoded_image(self, image_id: str) -> bytes:
+        """PNG-encoded image of the sample, served from cache if available"""
+        content = self._images_cache.get(image_id)
+        if content is None:
+            content = encode_png(self[image_id].image)
+            self._images_cache.put(image_id, content)
+        return content
+
+    def prewarm_images(self, samples: Sequence[Sample]) -> None:
+        """Encode (and cache) the images of samples about to be requested"""
+        for sample in samples:
+            if sample.uuid not in self._images_cache:
+                self._images_cache.put(sample.uuid, encode_png(sample.image))
 
     def get_random_samples(self, k: int) -> Sequence[Sample]:
         samples = list()
-        excluded = self._items_sampled.union(self._blacklist)
-        pool = set(range(len(self.dataset))).difference(excluded)
-        rnd_indices = sample(pool, k=k)
-        for sample_idx in rnd_indices:
-            samples.append(self[sample_idx])
-            self._items_sampled.add(sample_idx)
+        rnd_indices = self.pool.draw(k=k)
+        while rnd_indices:
+            for sample_idx in rnd_indices:
+                # with multiple serving processes, samples may have been
+                # returned (or discarded) by another process in the meantime
+                if sample_idx in self._items_sampled or sample_idx in self._blacklist:
+                    continue
+                samples.append(self[sample_idx])
+                self._items_sampled.add(sample_idx)
+            rnd_indices = self.pool.draw(k=min(k - len(samples), len(self.pool)))
         # #  tweak
         # samples.append(
         #     self["c69b31e495d132603ae3c8e72dc236ed0e1889bd7b62b0e2f431161ca5ad0c1f_2f6"]
@@ -149,14 +318,38 @@ class DataSource:
         except ValueError:
             index = Sample.retrieve_index(str(index))
         self._blacklist.add(index)
+        if self._pool is not None:
+            self._pool.remove(index)
+
+    @property
+    def annotations(self) -> AnnotationStore:
+        return self._annotations
+
+    def annotate(self, image_id: str, emotion_label: str) -> Sample:
+        """Set the emotion of the sample to the one annotated by the user,
+        and record the annotation in the store."""
+        sample = self[image_id]
+        sample.emotion = self.emotion_index(emotion_label)
+        if sample.emotion >= 0:
+            self._annotations.add(image_id, sample.index, sample.emotion)
+        return sample
+
+    def annotated_samples(self, batch_size: int = 1024) -> Iterator[List[Sample]]:
+        """Replay all the recorded annotations, in order, as batches of samples
+        (e.g. `for samples in data_source.annotated_samples(): machine.fit(samples)`)
+        """
+        for batch in self._annotations.replay(batch_size=batch_size):
+            yield [
+                Sample(index=index, emotion=emotion, source=self.dataset)
+                for index, emotion in batch
+            ]
 
     def serialise_session(self) -> None:
-        # Serialise Items Sampled
-        # self._serialise(self._items_sampled, self.RETURNED_SAMPLES)
-        # Serialise the MODEL WEIGHTS
-        # TODO
-        # Serialise Blacklist
-        self._serialise(self._blacklist, self.BLACKLIST_SAMPLES)
+        # Items Sampled and Blacklist are persisted as they change:
+        # just make sure pending updates are written to disk.
+        # Model weights are snapshotted by the learning machines (see checkpoints)
+        self._session_flusher.stop()
+        self._annotations.close()
 
 
 def load_fer_dataset_lazy() -> DataSource:
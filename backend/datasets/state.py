@@ -0,0 +1,127 @@
+"""
+Durable, memory-mapped session state of DataSources
+"""
+
+import numpy as np
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Iterable, Iterator, Sequence
+
+
+class IndexBitset:
+    """Set of (non-negative) sample indices stored as a memory-mapped bitset.
+
+    Every update is written straight into a shared memory mapping of the
+    file, hence it is in the OS page cache (and survives a crash of the
+    process) as soon as it is made. Writing pages back to disk is left
+    to `flush`, to be called periodically (see `BackgroundFlusher`).
+    The file is created on the first update, and it grows (doubling its
+    size) when an index beyond its current capacity is added.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to the bitset file.
+    capacity : int
+        Minimum number of indices the bitset file is created for.
+    """
+
+    def __init__(self, filepath: Path, capacity: int = 2**16) -> None:
+        self.filepath = Path(filepath)
+        self._initial_nbytes = (capacity + 7) // 8
+        self._lock = Lock()
+        self._dirty = False
+        if self.filepath.exists() and self.filepath.stat().st_size > 0:
+            self._bits = self._map()
+        else:  # file is only created on first update
+            self._bits = np.zeros(0, dtype=np.uint8)
+
+    def _map(self) -> np.memmap:
+        return np.memmap(self.filepath, dtype=np.uint8, mode="r+")
+
+    def _grow(self, index: int) -> None:
+        nbytes = max(2 * (index // 8 + 1), 2 * len(self._bits), self._initial_nbytes)
+        if isinstance(self._bits, np.memmap):
+            self._bits.flush()
+        del self._bits
+        with open(self.filepath, "ab") as f:
+            # never shrink a file grown by another process in the meantime
+            f.truncate(max(nbytes, f.seek(0, 2)))
+        self._bits = self._map()
+
+    @property
+    def capacity(self) -> int:
+        return len(self._bits) * 8
+
+    def _remap(self) -> None:
+        """Map the file again, if another process created (or grew) it"""
+        with self._lock:
+            if self.filepath.exists() and self.filepath.stat().st_size > len(
+                self._bits
+            ):
+                self._bits = self._map()
+
+    def __contains__(self, index: int) -> bool:
+        if index >= self.capacity:
+            self._remap()
+        if not 0 <= index < self.capacity:
+            return False
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index: int) -> bool:
+        """Add the index to the set. Returns False if the index is not valid."""
+        if index < 0:
+            return False
+        with self._lock:
+            if index >= self.capacity:
+                self._grow(index)
+            self._bits[index >> 3] |= 1 << (index & 7)
+            self._dirty = True
+        return True
+
+    def update(self, indices: Iterable[int]) -> None:
+        for index in indices:
+            self.add(index)
+
+    def indices(self) -> np.ndarray:
+        """All the indices in the set, in ascending order (vectorised)"""
+        nonzero = np.flatnonzero(self._bits)
+        bits = np.unpackbits(self._bits[nonzero, np.newaxis], axis=1, bitorder="little")
+        rows, cols = np.nonzero(bits)
+        return nonzero[rows] * 8 + cols
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.indices().tolist())
+
+    def __len__(self) -> int:
+        return int(np.unpackbits(self._bits).sum())
+
+    def flush(self) -> None:
+        """Write pending updates back to disk"""
+        with self._lock:
+            if self._dirty:
+                self._bits.flush()
+                self._dirty = False
+
+
+class BackgroundFlusher(Thread):
+    """Daemon thread flushing bitsets to disk every `interval` seconds,
+    so that many updates are batched into a single write."""
+
+    def __init__(self, bitsets: Sequence[IndexBitset], interval: float = 1.0):
+        super(BackgroundFlusher, self).__init__(daemon=True)
+        self.bitsets = bitsets
+        self.interval = interval
+        self._stopped = Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self) -> None:
+        for bitset in self.bitsets:
+            bitset.flush()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.flush()
@@ -1,13 +1,25 @@
-from io import BytesIO
-from typing import Sequence, List
+import os
+from typing import Sequence, List, Optional
 
-from starlette.responses import StreamingResponse
+from fastapi import BackgroundTasks, Header, HTTPException
+from starlette.responses import JSONResponse, Response
 
 from datasets import Sample, get_dataset
-from models import get_model
+from models import get_model, get_scheduler, INFERENCE_SCHEDULERS, MODELS
+from models import get_trainer, TRAINERS
+from models.shared import SharedWeights
 from models.learning_machine import Prediction
 from schemas import Node, EmotionLink, BackendResponse, Annotation
-from settings import LEARNING_MACHINE_MODEL, DATASET_NAME
+from settings import LEARNING_MACHINE_MODEL, DATASET_NAME, PREWARM_IMAGES_CACHE
+from settings import INFERENCE_BATCH_WINDOW, INFERENCE_MAX_BATCH_SIZE
+from settings import SERVING_WORKERS, SHARED_WEIGHTS_FOLDER
+from settings import BACKGROUND_TRAINING, TRAINING_BATCH_SIZE, REPLAY_BUFFER_SIZE
+from settings import TRAINING_PUBLISH_EVERY, HEAD_ONLY_TRAINING
+from settings import WARM_UP_ON_STARTUP, WARM_UP_BATCH_SIZES, WARM_UP_ITERATIONS
+from warmup import WarmUp
+
+# Images are immutable for a given uuid
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 
 def make_nodes(
@@ -21,83 +33,224 @@ def make_nodes(
         emotion_map.pop("neutral")
 
         emotion_map = {c: v / norm for c, v in emotion_map.items()}
+        uuid = sample.uuid
         links = [
-            EmotionLink(source=sample.uuid, value=prob, target=emotion)
+            EmotionLink(source=uuid, value=prob, target=emotion)
             for emotion, prob in emotion_map.items()
         ]
         node = Node(
-            id=sample.uuid,
-            image=f"http://localhost:8000/faces/image/{sample.uuid}",
+            id=uuid,
+            image=f"http://localhost:8000/faces/image/{uuid}",
             links=links,
         )
         nodes.append(node)
     return nodes
 
 
-async def faces(number_of_faces: int = 25):
+def image_etag(image_id: str) -> str:
+    """Strong ETag of the PNG image of the sample, derived from its uuid only"""
+    return f'"{image_id}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Weak comparison of ETag against the `If-None-Match` header (RFC 7232)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == "*" or tag.replace("W/", "", 1) == etag for tag in tags)
+
+
+def prewarm_images(background_tasks: BackgroundTasks, samples: Sequence[Sample]):
+    """Encode images in the background, after the response has been sent,
+    as the frontend is going to request them straight away."""
+    if PREWARM_IMAGES_CACHE:
+        dataset = get_dataset(DATASET_NAME)
+        background_tasks.add_task(dataset.prewarm_images, samples)
+
+
+def get_machine():
+    """Scheduler of the predictions (and updates) of the learning machine"""
+    return get_scheduler(
+        LEARNING_MACHINE_MODEL,
+        window=INFERENCE_BATCH_WINDOW,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    )
+
+
+def get_trainer_of_machine():
+    """Background trainer of the learning machine"""
+    return get_trainer(
+        LEARNING_MACHINE_MODEL,
+        batch_size=TRAINING_BATCH_SIZE,
+        buffer_size=REPLAY_BUFFER_SIZE,
+        publish_every=TRAINING_PUBLISH_EVERY,
+    )
+
+
+def warm_up_dataset():
+    dataset = get_dataset(DATASET_NAME)
+    _ = dataset.pool  # loads (or downloads) the dataset, and the session state
+
+
+def warm_up_model():
     machine = get_model(LEARNING_MACHINE_MODEL)
+    _ = machine.inference_model  # loads the weights, and the inference copy
+    if machine.compiled:
+        _ = machine.engine
+
+
+def warm_up_inference():
+    """Predictions on batches of typical sizes: allocator and kernel caches
+    are primed before the first actual request. Predictions go through the
+    scheduler, so that they are batched with (rather than run alongside)
+    requests admitted in the meantime."""
+    dataset = get_dataset(DATASET_NAME)
+    machine = get_machine()
+    for batch_size in WARM_UP_BATCH_SIZES:
+        samples = [dataset[index] for index in range(batch_size)]
+        for _ in range(WARM_UP_ITERATIONS):
+            machine.submit(samples, refresh=True).result()
+
+
+SERVER_WARM_UP = WarmUp(
+    [
+        ("dataset", warm_up_dataset),
+        ("model", warm_up_model),
+        ("inference", warm_up_inference),
+    ]
+    if WARM_UP_ON_STARTUP
+    else []
+)
+
+
+async def faces(background_tasks: BackgroundTasks, number_of_faces: int = 25):
+    machine = get_machine()
     dataset = get_dataset(DATASET_NAME)
     samples = dataset.get_random_samples(k=number_of_faces)
-    emotions = machine.predict(samples=samples)
+    prewarm_images(background_tasks, samples)
+    emotions = await machine.predict(samples=samples)
     nodes = make_nodes(samples, emotions, dataset.emotions)
     response = BackendResponse(nodes=nodes)
     return response.dict()
 
 
-async def test_face(image_id: str):
+async def test_face(image_id: str, refresh: bool = False):
     dataset = get_dataset(DATASET_NAME)
-    machine = get_model(LEARNING_MACHINE_MODEL)
+    machine = get_machine()
     test_sample = dataset[image_id]
-    emotions = machine.predict(samples=test_sample)
+    emotions = await machine.predict(samples=test_sample, refresh=refresh)
     nodes = make_nodes([test_sample], emotions, dataset.emotions)
     response = BackendResponse(nodes=nodes)
     return response.dict()
 
 
-async def get_face(image_id: str):
+async def get_face(image_id: str, if_none_match: Optional[str] = Header(None)):
+    etag = image_etag(image_id)
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
     dataset = get_dataset(DATASET_NAME)
-    sample = dataset[image_id]
-    image = sample.image
-    buffer = BytesIO()
-    image.save(buffer, format="png")
-    buffer.seek(0)
-    return StreamingResponse(
-        buffer,
-        media_type="image/png",
+    return Response(
+        dataset.encoded_image(image_id), media_type="image/png", headers=headers
     )
 
 
-async def annotate(annotation: Annotation):
+async def annotate(annotation: Annotation, background_tasks: BackgroundTasks):
     dataset = get_dataset(DATASET_NAME)
-    machine = get_model(LEARNING_MACHINE_MODEL)
+    machine = get_machine()
     emotion = annotation.label
     if emotion == "not-human":
         dataset.discard_sample(annotation.image_id)
+    elif dataset.emotion_index(emotion) < 0:
+        raise HTTPException(status_code=422, detail=f"Unknown emotion: {emotion}")
     else:
-        annotated_sample = dataset[annotation.image_id]
-        # TODO: this should go in the DB too!!
-        annotated_sample.emotion = dataset.emotion_index(emotion)
-        machine.fit((annotated_sample,))
+        annotated_sample = dataset.annotate(annotation.image_id, emotion)
+        if BACKGROUND_TRAINING:
+            # predictions reflect the annotation once trained on, and published
+            get_trainer_of_machine().add(annotated_sample)
+        else:
+            await machine.fit((annotated_sample,))
 
     other_samples = [dataset[nid] for nid in annotation.current_nodes]
-    other_samples += dataset.get_random_samples(k=annotation.new_nodes)
-    updated_emotions = machine.predict(samples=other_samples)
+    new_samples = dataset.get_random_samples(k=annotation.new_nodes)
+    prewarm_images(background_tasks, new_samples)
+    other_samples += new_samples
+    updated_emotions = await machine.predict(samples=other_samples)
     nodes = make_nodes(other_samples, updated_emotions, dataset.emotions)
     response = BackendResponse(nodes=nodes)
     return response.dict()
 
 
-async def discard_image(image_id: str):
+async def discard_image(image_id: str, background_tasks: BackgroundTasks):
     dataset = get_dataset(DATASET_NAME)
-    machine = get_model(LEARNING_MACHINE_MODEL)
+    machine = get_machine()
     dataset.discard_sample(image_id)
     new_sample = dataset.get_random_samples(k=1)
-    models_preds = machine.predict(samples=new_sample)
+    prewarm_images(background_tasks, new_sample)
+    models_preds = await machine.predict(samples=new_sample)
     nodes = make_nodes(new_sample, models_preds, dataset.emotions)
     response = BackendResponse(nodes=nodes)
     return response.dict()
 
 
+async def inference_stats():
+    return {key: s.stats.summary() for key, s in INFERENCE_SCHEDULERS.items()}
+
+
+async def training_stats():
+    return {key: t.summary() for key, t in TRAINERS.items()}
+
+
+async def liveness():
+    """The server is up: it is only reported dead if its warm-up failed,
+    as it is not going to get ready without a restart."""
+    if SERVER_WARM_UP.failed:
+        return JSONResponse({"alive": False, "error": SERVER_WARM_UP.error}, 503)
+    return {"alive": True}
+
+
+async def readiness():
+    """The server is warmed up, and ready to serve requests: progress of the
+    warm-up is reported in the meantime."""
+    summary = SERVER_WARM_UP.summary()
+    return JSONResponse(summary, status_code=200 if summary["ready"] else 503)
+
+
+async def warm_up_on_startup():
+    SERVER_WARM_UP.start()
+
+
+async def configure_training_on_startup():
+    get_model(LEARNING_MACHINE_MODEL).head_only = HEAD_ONLY_TRAINING
+
+
+async def share_weights_on_startup():
+    """Serving workers (all started by the same parent process) use a single,
+    shared copy of the weights of the learning machine."""
+    if SERVING_WORKERS > 1:
+        shared_weights = SharedWeights(
+            SHARED_WEIGHTS_FOLDER / f"{LEARNING_MACHINE_MODEL}.weights",
+            token=os.getppid(),
+        )
+        get_model(LEARNING_MACHINE_MODEL).share_weights(shared_weights)
+
+
 async def serialise_on_shutdown():
     dataset = get_dataset(DATASET_NAME)
     dataset.serialise_session()
+
+
+async def stop_training_on_shutdown():
+    for trainer in TRAINERS.values():
+        trainer.stop()
+
+
+async def save_checkpoints_on_shutdown():
+    """Snapshot the latest updates of the models (after training stops)"""
+    for machine in list(MODELS.values()):
+        machine.checkpoints.stop()
+
+
+async def stop_inference_on_shutdown():
+    for scheduler in INFERENCE_SCHEDULERS.values():
+        scheduler.stop()
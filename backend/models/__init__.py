@@ -1,15 +1,24 @@
+from threading import Lock
+
 from .vgg import VGGMachine
 from .unet import UNetMachine
 from .learning_machine import LearningMachine
+from .scheduler import InferenceScheduler
+from .trainer import BackgroundTrainer
 
-VGG_MODEL = "vgg"
-UNET_MODEL = "unet"
-MODELS_PROXY = {VGG_MODEL: VGGMachine(), UNET_MODEL: UNetMachine()}
+VGG_MODEL = VGGMachine.KEY
+UNET_MODEL = UNetMachine.KEY
+# Factories of the models: each one is only created (and loaded) on first use
+MODELS_PROXY = {VGG_MODEL: VGGMachine, UNET_MODEL: UNetMachine}
+MODELS = dict()  # models created so far
+_MODELS_LOCK = Lock()
 
 
 def get_model(key: str) -> LearningMachine:
     """
     Instantiate a Learning Machine Model given a key for Models Proxy.
+    A single instance is created per model, on first request; weights are
+    then loaded on first use (e.g. the first prediction).
 
     Parameters
     ----------
@@ -29,8 +38,79 @@ def get_model(key: str) -> LearningMachine:
         Raised if input key is not valid. No default fall-back model implemented.
     """
     try:
-        net = MODELS_PROXY[key]
+        factory = MODELS_PROXY[key]
     except KeyError:
         raise ValueError(f"Invalid Model Key: {key}")
-    else:
-        return net
+    with _MODELS_LOCK:
+        if key not in MODELS:
+            MODELS[key] = factory()
+        return MODELS[key]
+
+
+INFERENCE_SCHEDULERS = dict()
+_SCHEDULERS_LOCK = Lock()
+
+
+def get_scheduler(key: str, **scheduler_options) -> InferenceScheduler:
+    """
+    Inference Scheduler owning the Learning Machine Model of the given key.
+    A single scheduler is created per model, on first request.
+
+    Parameters
+    ----------
+    key : str
+        A model proxy key
+    scheduler_options :
+        Options of the scheduler (i.e. `window` and `max_batch_size`),
+        only used when the scheduler is created.
+
+    Returns
+    -------
+    InferenceScheduler
+        Scheduler batching predict requests to the selected model.
+
+    Raises
+    ------
+    ValueError
+        Raised if input key is not valid.
+    """
+    model = get_model(key)
+    with _SCHEDULERS_LOCK:
+        if key not in INFERENCE_SCHEDULERS:
+            INFERENCE_SCHEDULERS[key] = InferenceScheduler(model, **scheduler_options)
+        return INFERENCE_SCHEDULERS[key]
+
+
+TRAINERS = dict()
+_TRAINERS_LOCK = Lock()
+
+
+def get_trainer(key: str, **trainer_options) -> BackgroundTrainer:
+    """
+    Background Trainer of the Learning Machine Model of the given key.
+    A single trainer is created per model, on first request.
+
+    Parameters
+    ----------
+    key : str
+        A model proxy key
+    trainer_options :
+        Options of the trainer (i.e. `batch_size`, `buffer_size`, and
+        `publish_every`), only used when the trainer is created.
+
+    Returns
+    -------
+    BackgroundTrainer
+        Trainer taking mini-batched steps on the annotations of the model,
+        and publishing updated weights to its predictions.
+
+    Raises
+    ------
+    ValueError
+        Raised if input key is not valid.
+    """
+    model = get_model(key)
+    with _TRAINERS_LOCK:
+        if key not in TRAINERS:
+            TRAINERS[key] = BackgroundTrainer(model, **trainer_options)
+        return TRAINERS[key]
@@ -0,0 +1,86 @@
+"""
+Bounded cache of the predictions of LearningMachines
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Iterable, Optional, Tuple
+
+import numpy as np
+
+PredictionKey = Tuple[Hashable, int, int]  # (model key, sample index, model version)
+
+
+class PredictionCache:
+    """Least-recently-used cache of per-sample predictions, bounded in bytes.
+
+    Predictions are keyed by model key, sample index and model version:
+    whenever the model is updated (i.e. its version increases) predictions
+    of older versions are never hit again, and they are evicted (least
+    recently used first) once the total size of the cache exceeds `max_bytes`.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size (in bytes) of the predictions in cache,
+        including an estimate of the overhead of each entry.
+    """
+
+    ENTRY_OVERHEAD = 256  # bytes: key tuple, dict slot, and array header
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._predictions = OrderedDict()
+        self._nbytes = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._predictions)
+
+    def __contains__(self, key: PredictionKey) -> bool:
+        return key in self._predictions
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def _entry_nbytes(self, prediction: np.ndarray) -> int:
+        return prediction.nbytes + self.ENTRY_OVERHEAD
+
+    def get(self, key: PredictionKey) -> Optional[np.ndarray]:
+        with self._lock:
+            prediction = self._predictions.get(key, None)
+            if prediction is not None:
+                self._predictions.move_to_end(key)
+            return prediction
+
+    def put(self, key: PredictionKey, prediction: np.ndarray) -> None:
+        prediction = np.array(prediction)  # own copy, not a view on the batch
+        prediction.flags.writeable = False
+        with self._lock:
+            previous = self._predictions.pop(key, None)
+            if previous is not None:
+                self._nbytes -= self._entry_nbytes(previous)
+            self._predictions[key] = prediction
+            self._nbytes += self._entry_nbytes(prediction)
+            while self._nbytes > self.max_bytes and self._predictions:
+                _, evicted = self._predictions.popitem(last=False)
+                self._nbytes -= self._entry_nbytes(evicted)
+
+    def invalidate(self, model_key: Hashable, indices: Iterable[int] = None) -> None:
+        """Drop the cached predictions of the model, for all the samples
+        or only for the selected sample indices (any model version)."""
+        indices = None if indices is None else set(indices)
+        with self._lock:
+            stale = [
+                key
+                for key in self._predictions
+                if key[0] == model_key and (indices is None or key[1] in indices)
+            ]
+            for key in stale:
+                self._nbytes -= self._entry_nbytes(self._predictions.pop(key))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._predictions.clear()
+            self._nbytes = 0
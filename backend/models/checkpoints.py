@@ -0,0 +1,209 @@
+"""
+Periodic snapshots of the weights (and optimiser state) of Learning Machines
+"""
+
+import copy
+import inspect
+import os
+import pickle
+import time
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Optional
+
+import torch
+
+SNAPSHOT_FORMAT = 1
+
+# Snapshots are loaded memory-mapped (torch >= 2.1), and as weights only
+# (torch >= 1.13), whenever supported by the installed version of torch
+_LOAD_OPTIONS = {
+    option: True
+    for option in ("mmap", "weights_only")
+    if option in inspect.signature(torch.load).parameters
+}
+# Errors of snapshots which cannot be read (e.g. truncated, or corrupted)
+_LOAD_ERRORS = (OSError, EOFError, RuntimeError, pickle.UnpicklingError)
+
+
+class CheckpointManager:
+    """Snapshots of the weights being trained by a LearningMachine, along
+    with the state of its optimiser, so that no update is lost on restart
+    (nor on a crash, but for the latest ones).
+
+    Once the machine has been updated, a background thread writes a snapshot
+    every `every_updates` updates, or every `every_seconds` seconds (if any
+    update happened in the meantime). Weights are copied while training is
+    held, and written to disk afterwards, hence training only waits for the
+    copy. Snapshots are written atomically (i.e. write, sync, then rename)
+    next to the checkpoint of the machine, and only the latest `keep` ones
+    are retained.
+
+    Parameters
+    ----------
+    machine : LearningMachine
+        The learning machine to take snapshots of.
+    every_updates : int (default 50)
+        Number of updates (i.e. training steps) between two snapshots.
+    every_seconds : float (default 300)
+        Maximum time between an update and the snapshot including it.
+    keep : int (default 3)
+        Number of snapshots retained: older ones are removed.
+    """
+
+    # temporary files of interrupted saves are removed once this old (seconds)
+    STALE_TEMP_FILES_AFTER = 3600.0
+
+    def __init__(
+        self,
+        machine,
+        every_updates: int = 50,
+        every_seconds: float = 300.0,
+        keep: int = 3,
+    ) -> None:
+        self.machine = machine
+        self.every_updates = every_updates
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.saved_updates = 0  # updates included in the latest snapshot
+        self._saved_at = time.monotonic()
+        self._worker = None
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._lock = Lock()
+        self._saving = Lock()
+
+    @property
+    def folder(self) -> Path:
+        return self.machine.CHECKPOINTS_FOLDER
+
+    @property
+    def _pattern(self) -> str:
+        return f"{self.machine.checkpoint.stem}.snapshot-*.pt"
+
+    def snapshots(self) -> List[Path]:
+        """Snapshots on disk, newest first"""
+        return sorted(self.folder.glob(self._pattern), reverse=True)
+
+    def _temp_filepath(self, filepath: Path) -> Path:
+        return filepath.with_name(f".{filepath.name}.{os.getpid()}.tmp")
+
+    @staticmethod
+    def _is_valid(snapshot: Any) -> bool:
+        return (
+            isinstance(snapshot, dict)
+            and snapshot.get("format") == SNAPSHOT_FORMAT
+            and isinstance(snapshot.get("model"), dict)
+            and isinstance(snapshot.get("optimiser"), dict)
+        )
+
+    def load_latest(self, map_location=None) -> Optional[Dict]:
+        """Newest valid snapshot (if any). Tensors are memory-mapped from the
+        file (i.e. loaded from the page cache, on access) rather than read."""
+        self._remove_stale_temp_files()
+        for filepath in self.snapshots():
+            try:
+                snapshot = torch.load(
+                    filepath, map_location=map_location, **_LOAD_OPTIONS
+                )
+            except _LOAD_ERRORS as e:
+                print(f"[WARNING]: skipping unreadable snapshot {filepath}: {e}")
+                continue
+            if not self._is_valid(snapshot):
+                print(f"[WARNING]: skipping invalid snapshot {filepath}")
+                continue
+            print(f"[INFO]: loading {filepath}")
+            self.saved_updates = snapshot["updates"]
+            return snapshot
+        return None
+
+    def updated(self) -> None:
+        """To be called on every update: snapshots are taken in the background"""
+        with self._lock:
+            if self._worker is None:
+                self._stopped.clear()
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+        if self.machine.updates - self.saved_updates >= self.every_updates:
+            self._wakeup.set()
+
+    def _due(self) -> bool:
+        pending = self.machine.updates - self.saved_updates
+        return pending >= self.every_updates or (
+            pending > 0 and time.monotonic() - self._saved_at >= self.every_seconds
+        )
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=min(self.every_seconds, 1.0))
+            self._wakeup.clear()
+            if self._due():
+                self.save()
+
+    def _state(self) -> Dict:
+        machine = self.machine
+        with machine._reading_training_weights():
+            weights = {
+                name: tensor.detach().clone()
+                for name, tensor in machine.model.state_dict().items()
+            }
+            optimiser = copy.deepcopy(machine.optimiser.state_dict())
+            updates = machine.updates
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "key": machine.KEY,
+            "updates": updates,
+            "created": time.time(),
+            "model": weights,
+            "optimiser": optimiser,
+        }
+
+    def save(self) -> Optional[Path]:
+        """Write a snapshot now, if the machine has been updated since the
+        latest one. Returns the path of the snapshot (if any)."""
+        with self._saving:
+            if self.machine.updates == self.saved_updates:
+                return None
+            state = self._state()
+            filepath = self.folder / self._pattern.replace("*", f"{time.time_ns()}")
+            temp_filepath = self._temp_filepath(filepath)
+            with open(temp_filepath, "wb") as f:
+                torch.save(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filepath, filepath)
+            # make the rename itself durable
+            folder = os.open(self.folder, os.O_RDONLY)
+            try:
+                os.fsync(folder)
+            finally:
+                os.close(folder)
+            self.saved_updates, self._saved_at = state["updates"], time.monotonic()
+            self._prune()
+        return filepath
+
+    def _prune(self) -> None:
+        for stale in self.snapshots()[self.keep :]:
+            stale.unlink(missing_ok=True)
+        self._remove_stale_temp_files()
+
+    def _remove_stale_temp_files(self) -> None:
+        """Remove temporary files left by interrupted saves (e.g. on a crash).
+        Recent ones are kept, as other processes may still be writing them."""
+        stale_before = time.time() - self.STALE_TEMP_FILES_AFTER
+        for temp_filepath in self.folder.glob(f".{self._pattern}.*.tmp"):
+            try:
+                if temp_filepath.stat().st_mtime < stale_before:
+                    temp_filepath.unlink()
+            except OSError:  # removed already, or still open (e.g. on Windows)
+                continue
+
+    def stop(self) -> None:
+        """Stop the background thread, and write the latest updates (if any)"""
+        with self._lock:
+            if self._worker is not None:
+                self._stopped.set()
+                self._wakeup.set()
+                self._worker.join()
+                self._worker = None
+        self.save()
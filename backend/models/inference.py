@@ -0,0 +1,128 @@
+"""
+Inference-optimised copies of the models of Learning Machines
+"""
+
+import copy
+import hashlib
+import os
+from pathlib import Path
+
+import torch
+from torch import nn, Tensor
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+def fold_batchnorm(model: nn.Module) -> nn.Module:
+    """
+    Eval-mode copy of the model, where every BatchNorm2d directly following
+    a Conv2d (in a nn.Sequential block) is folded into the convolution.
+
+    In eval mode, BatchNorm is a fixed affine transform of each channel, hence
+    it can be applied to the weights (and bias) of the convolution once,
+    rather than to its output at every forward pass. Folded BatchNorms are
+    replaced by Identity layers, so that the structure of the model is kept.
+    The original model is left untouched (e.g. to keep training it).
+
+    Parameters
+    ----------
+    model : nn.Module
+        The model to fold.
+
+    Returns
+    -------
+    nn.Module
+        The folded copy, in eval mode, with no gradient required.
+    """
+    folded = copy.deepcopy(model).eval()
+    for module in folded.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        names = list(module._modules.keys())
+        for conv_name, norm_name in zip(names, names[1:]):
+            conv, norm = module._modules[conv_name], module._modules[norm_name]
+            if isinstance(conv, nn.Conv2d) and isinstance(norm, nn.BatchNorm2d):
+                module._modules[conv_name] = fuse_conv_bn_eval(conv, norm)
+                module._modules[norm_name] = nn.Identity()
+    for parameter in folded.parameters():
+        parameter.requires_grad_(False)
+    return folded
+
+
+def quantise_linear(model: nn.Module) -> nn.Module:
+    """
+    Eval-mode copy of the model, where all the Linear layers are quantised
+    with int8 dynamic quantisation: weights are stored as int8 (i.e. 4x
+    smaller), and activations are quantised on the fly, batch by batch,
+    hence no calibration is needed. Other layers are left in float32.
+
+    Parameters
+    ----------
+    model : nn.Module
+        The model to quantise.
+
+    Returns
+    -------
+    nn.Module
+        The quantised copy, in eval mode (CPU only).
+    """
+    model = copy.deepcopy(model).eval().to("cpu")
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def _update_digest(digest, value) -> None:
+    if isinstance(value, Tensor):
+        if value.is_quantized:
+            value = value.dequantize()
+        digest.update(value.detach().cpu().contiguous().numpy().tobytes())
+    elif isinstance(value, (tuple, list)):  # e.g. packed quantised parameters
+        for item in value:
+            _update_digest(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def weights_digest(model: nn.Module, tag: str = "") -> str:
+    """Hex digest (sha256) of the weights (and buffers) of the model,
+    optionally salted with a tag (e.g. identifying how it is compiled).
+    Quantised models are supported too."""
+    digest = hashlib.sha256(f"{tag}|torch-{torch.__version__}".encode())
+    for name, value in model.state_dict().items():
+        digest.update(name.encode())
+        _update_digest(digest, value)
+    return digest.hexdigest()
+
+
+def compile_model(
+    model: nn.Module, example: Tensor, method: str = "forward"
+) -> torch.jit.ScriptModule:
+    """
+    Trace the (eval-mode) model method on the example batch, and freeze it:
+    weights are inlined as constants, and the graph is optimised for
+    inference (e.g. no Python dispatch per layer, fused operations).
+
+    Parameters
+    ----------
+    model : nn.Module
+        The model to compile. It is expected to be in eval mode.
+    example : Tensor
+        Example input batch, used for tracing.
+    method : str (default "forward")
+        The method of the model to compile, the only one preserved.
+
+    Returns
+    -------
+    torch.jit.ScriptModule
+        The compiled (frozen) module.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace_module(model, {method: example})
+    preserved = [] if method == "forward" else [method]
+    return torch.jit.freeze(traced.eval(), preserved_attrs=preserved)
+
+
+def save_compiled(engine: torch.jit.ScriptModule, filepath: Path) -> None:
+    """Save the compiled module atomically (i.e. write, then rename), so that
+    concurrent (or interrupted) starts never load a partial artifact."""
+    temp_filepath = filepath.with_name(f".{filepath.name}.{os.getpid()}.tmp")
+    torch.jit.save(engine, str(temp_filepath))
+    os.replace(temp_filepath, filepath)
@@ -2,20 +2,30 @@
 LearningMachine Abstract base class definition
 """
 
-from typing import Any, NoReturn, Sequence, Tuple
+import copy
+import time
+from contextlib import contextmanager, nullcontext
+from threading import Lock, RLock, Thread
+from typing import Any, ContextManager, Iterable, NoReturn, Sequence, Tuple
 from nptyping import NDArray
+import numpy as np
 from numpy import float32 as float32
 import torch
 from abc import abstractmethod, ABC
 from torch import nn, optim, Tensor
 from torch.utils.data.dataloader import default_collate
 from pathlib import Path
+from hashlib import sha256
 import os
 from torchvision.transforms import ToTensor
 from torchvision.datasets.utils import download_url
-from datasets import Sample
+from datasets import Sample, stack_images
 from typing import Callable, Union, Dict, Optional
 from PIL.Image import Image as PILImage
+from .cache import PredictionCache
+from .checkpoints import CheckpointManager
+from .inference import compile_model, save_compiled, weights_digest
+from .shared import SharedWeights
 
 # Types
 ModelOutput = Union[Tensor, Tuple[Tensor, Tensor]]
@@ -34,13 +44,55 @@ class LearningMachine(ABC):
     """ """
 
     CHECKPOINTS_FOLDER = BASE_FOLDER / "weights"
+    KEY = None  # model key, in the models proxy
+    # compiled engines of previous weights are removed once they are this old
+    # (in seconds), so that other processes are done loading them
+    STALE_ENGINES_AFTER = 60.0
 
-    def __init__(self) -> None:
+    # Predictions of all the machines, keyed by (model key, sample index, version)
+    PREDICTIONS_CACHE_BYTES = 16 * 2**20
+    predictions_cache = PredictionCache(max_bytes=PREDICTIONS_CACHE_BYTES)
+
+    # Encoded features of annotated samples (head-only fine-tuning), keyed by
+    # (model key, sample index, encoder version)
+    FEATURES_CACHE_BYTES = 64 * 2**20
+    features_cache = PredictionCache(max_bytes=FEATURES_CACHE_BYTES)
+
+    # Snapshots of trained weights, every N updates or T seconds (see checkpoints)
+    SNAPSHOT_EVERY_UPDATES = 50
+    SNAPSHOT_EVERY_SECONDS = 300.0
+    SNAPSHOTS_KEPT = 3
+
+    def __init__(self, compiled: bool = False, head_only: bool = False) -> None:
         self._model = None
         self._weights = None
+        self._saved_weights = False  # weights are those of a checkpoint (or snapshot)
+        self._version = 0
+        # training updates the head of the model only: the feature extractor is
+        # frozen, and features of the samples are cached (see `features_cache`)
+        self.head_only = head_only
+        self._encoder_version = 0  # of the feature extractor, i.e. all but the head
+        self._updates = 0  # training steps, since the base checkpoint
+        self._optimiser_state = None  # of the snapshot weights are loaded from
+        self.checkpoints = CheckpointManager(
+            self,
+            every_updates=self.SNAPSHOT_EVERY_UPDATES,
+            every_seconds=self.SNAPSHOT_EVERY_SECONDS,
+            keep=self.SNAPSHOTS_KEPT,
+        )
+        self._compiled = compiled
+        self._engine = None  # (compiled inference model, version)
+        self._engine_lock = Lock()  # held while compiling
+        self._compiler = None  # background thread compiling the engine
+        self._serving = None  # (inference model, version), swapped at once
+        self._double_buffered = False
+        self._training_lock = RLock()  # held while weights are being trained
+        self._version_lock = Lock()
+        self._shared_weights = None  # multi-process serving
+        self._shared_version = None
         self._transformer = self._set_transformer()
         self._criterion = self._init_criterion()
-        self._optimiser = self._init_optimiser()
+        self._optimiser = None  # created (or restored) on the first update
 
         os.makedirs(self.CHECKPOINTS_FOLDER, exist_ok=True)
 
@@ -55,8 +107,115 @@ class LearningMachine(ABC):
             self._model = self._load_model()
             # Move model instance to the target memory location
             self._model = self._model.to(TORCH_DEVICE)
+            self._saved_weights = True
+            self._model_updated()
         return self._model
 
+    @property
+    def version(self) -> int:
+        """Version of the model weights, increased on every update"""
+        return self._version
+
+    @property
+    def updates(self) -> int:
+        """Number of training steps on the weights (including those of
+        previous runs, restored from snapshots)"""
+        return self._updates
+
+    def _model_updated(self) -> None:
+        """To be called whenever model weights change (i.e. loaded, or trained),
+        or the way predictions are computed (e.g. compiled, or quantised):
+        cached predictions of previous versions are not used anymore."""
+        with self._version_lock:
+            self._version += 1
+
+    def _encoder_updated(self) -> None:
+        """To be called whenever weights of the feature extractor may have
+        changed: cached features of previous versions are not used anymore."""
+        self._encoder_version += 1
+
+    @property
+    def compiled(self) -> bool:
+        """Predictions run on a compiled (traced, and frozen) engine"""
+        return self._compiled
+
+    @compiled.setter
+    def compiled(self, compiled: bool) -> None:
+        if compiled != self._compiled:
+            self._compiled = compiled
+            self._model_updated()
+
+    @property
+    def double_buffered(self) -> bool:
+        """Predictions are served by a copy of the weights being trained,
+        replaced by an updated copy whenever new weights are published
+        (see `publish`), rather than by the weights being trained.
+
+        Shared weights (see `share_weights`) are never copied, as each worker
+        would hold a private copy otherwise: predictions run on the shared
+        weights, under the shared lock, hence never see half-updated weights."""
+        return self._double_buffered
+
+    @double_buffered.setter
+    def double_buffered(self, double_buffered: bool) -> None:
+        self._double_buffered = double_buffered
+        self._serving = self._engine = None
+
+    def share_weights(self, shared_weights: SharedWeights) -> None:
+        """Move model weights to memory shared with other processes (i.e.
+        serving workers): a single copy of the weights is used by all of them,
+        and updates made by any process are published to all the others.
+        Weights are only shared on CPU, and on Unix: they are kept private
+        otherwise."""
+        if not shared_weights.supported(self.model):
+            print("[WARNING]: model weights are not shared (only on CPU, on Unix)")
+            return
+        shared_weights.attach(self.model)
+        self._shared_weights = shared_weights
+        self._shared_version = shared_weights.version
+        # shared weights may have been trained by other processes already
+        self._saved_weights = self._saved_weights and self._shared_version == 0
+        self._weights = None  # loaded checkpoint is not needed anymore
+        self._encoder_updated()
+        self._model_updated()
+
+    def _sync_shared_weights(self) -> None:
+        """Follow updates of the shared weights made by other processes"""
+        if self._shared_weights is None:
+            return
+        if self._shared_weights.version != self._shared_version:
+            self._shared_version = self._shared_weights.version
+            self._saved_weights = False
+            self._encoder_updated()  # other processes may train the whole model
+            self._model_updated()
+
+    def _reading_weights(self) -> ContextManager:
+        if self._shared_weights is None:
+            return nullcontext()
+        return self._shared_weights.reading()
+
+    def _writing_weights(self) -> ContextManager:
+        if self._shared_weights is None:
+            return nullcontext()
+        return self._shared_weights.writing()
+
+    @contextmanager
+    def _reading_training_weights(self):
+        """Weights being trained are not updated in the meantime"""
+        with self._training_lock, self._reading_weights():
+            yield
+
+    def _reading_serving_weights(self, model: nn.Module) -> ContextManager:
+        # only the weights being trained may be updated while serving
+        if model is self._model:
+            return self._reading_weights()
+        return nullcontext()
+
+    def refresh_predictions(self, indices: Iterable[int] = None) -> None:
+        """Drop cached predictions for all the samples (full refresh),
+        or only for the selected sample indices (partial refresh)"""
+        self.predictions_cache.invalidate(self.KEY, indices)
+
     @property
     @abstractmethod
     def checkpoint(self) -> Path:
@@ -70,9 +229,17 @@ class LearningMachine(ABC):
     @property
     def optimiser(self) -> optim.Optimizer:
         if self._optimiser is None:
-            self._optimiser = self._init_optimiser()
+            self._optimiser = self._new_optimiser()
         return self._optimiser
 
+    def _new_optimiser(self) -> optim.Optimizer:
+        optimiser = self._init_optimiser()
+        if self._optimiser_state is not None:
+            # resume training where the snapshot left it
+            optimiser.load_state_dict(self._optimiser_state)
+            self._optimiser_state = None
+        return optimiser
+
     @property
     def criterion(self) -> nn.Module:
         if self._criterion is None:
@@ -82,6 +249,13 @@ class LearningMachine(ABC):
     @property
     def weights(self) -> StateDictType:
         if self._weights is None:
+            # newest snapshot of trained weights first, then the base checkpoint
+            snapshot = self.checkpoints.load_latest(map_location=TORCH_DEVICE)
+            if snapshot is not None:
+                self._weights = snapshot["model"]
+                self._optimiser_state = snapshot["optimiser"]
+                self._updates = snapshot["updates"]
+                return self._weights
             print(f"[INFO]: loading {self.checkpoint}")
             if not self.checkpoint.exists():
                 self._download_weights()
@@ -124,11 +298,234 @@ class LearningMachine(ABC):
     def _model_call(self, batch: Sequence[Sample]) -> Tensor:
         return self.model(batch)
 
+    @property
+    def inference_model(self) -> nn.Module:
+        """Model used for predictions, i.e. not for training, regenerated
+        whenever model weights are updated (e.g. by `fit`), unless an updated
+        one has been published already (see `publish`)."""
+        serving = self._serving
+        if serving is None or serving[1] < self.version:
+            with self._reading_training_weights():
+                version = self.version
+                serving = self._build_serving_model(), version
+            self._serving = serving
+        return serving[0]
+
+    def _build_inference_model(self) -> nn.Module:
+        """Subclasses may use an inference-optimised copy of the model"""
+        return self.model
+
+    def _build_serving_model(self) -> nn.Module:
+        model = self._build_inference_model()
+        # shared weights are not copied (see `double_buffered`)
+        shared = self._shared_weights is not None
+        if model is self.model and self.double_buffered and not shared:
+            model = copy.deepcopy(model)
+            for parameter in model.parameters():
+                parameter.requires_grad_(False)
+        return model.eval()
+
+    def _restore_serving_mode(self) -> None:
+        # predictions may run on the weights being trained (e.g. shared ones)
+        serving = self._serving
+        if serving is not None and serving[0] is self._model:
+            self._model.eval()
+
+    def publish(self) -> None:
+        """Double buffering: build the inference model from the weights being
+        trained, and swap it with the one serving predictions, at once.
+        Predictions running in the meantime complete on the previous model:
+        they never wait for training, nor see half-updated weights.
+
+        The engine of compiled machines is compiled here too, i.e. on the
+        training thread: predictions are served by the previous one meanwhile."""
+        with self._reading_training_weights():
+            model = self._build_serving_model()
+        engine = self._compile_engine(model) if self.compiled else None
+        with self._version_lock:
+            # model first: readers never find it older than the version
+            self._serving = model, self._version + 1
+            self._version += 1
+            if engine is not None:
+                self._engine = engine, self._version
+
+    @property
+    def inference_method(self) -> str:
+        """Method of the inference model computing predictions: subclasses
+        may skip what is not needed for emotion predictions."""
+        return "forward"
+
+    def _inference_batch(self, batch: Tensor) -> Tensor:
+        """Input batch, in the layout expected by the inference model"""
+        return batch
+
+    @property
+    def _engine_tag(self) -> str:
+        """Identifies how the engine is compiled, along with model weights"""
+        return self.inference_method
+
+    @property
+    def _engines_prefix(self) -> str:
+        """Prefix of the compiled engines of this machine, with this tag"""
+        tag = sha256(self._engine_tag.encode("utf8")).hexdigest()[:8]
+        return f"{self.checkpoint.stem}.{tag}"
+
+    def _engine_filepath(self, digest: str) -> Path:
+        return self.CHECKPOINTS_FOLDER / f"{self._engines_prefix}.{digest[:16]}.ts"
+
+    def _load_engine(self, filepath: Path) -> Optional[torch.jit.ScriptModule]:
+        # the engine may be removed (as stale) by another process in the meantime
+        if filepath.exists():
+            try:
+                return torch.jit.load(str(filepath), map_location=TORCH_DEVICE)
+            except (OSError, RuntimeError, ValueError) as e:
+                print(f"[WARNING]: cannot load {filepath}, compiling again: {e}")
+        return None
+
+    def _remove_stale_engines(self, filepath: Path) -> None:
+        """Remove engines of previous weights, with the same tag: engines of
+        other tags may be used by other processes (or machines). Recent ones are
+        kept, as other processes may still be loading them."""
+        stale_before = time.time() - self.STALE_ENGINES_AFTER
+        for stale in self.CHECKPOINTS_FOLDER.glob(f"{self._engines_prefix}.*.ts"):
+            try:
+                if stale != filepath and stale.stat().st_mtime < stale_before:
+                    stale.unlink()
+            except OSError:  # removed already, or still open (e.g. on Windows)
+                continue
+
+    def _compile_engine(self, model: nn.Module) -> torch.jit.ScriptModule:
+        """Compile the inference model. Engines of weights saved on disk (i.e.
+        the checkpoint, or a snapshot, as loaded) are cached on disk too, next
+        to the checkpoint, keyed by the hash of the weights: later starts load
+        the cached engine rather than compiling the model again. Engines of
+        weights updated since are kept in memory only."""
+        saved = self._saved_weights
+        with self._reading_serving_weights(model):
+            filepath = engine = None
+            if saved:
+                digest = weights_digest(model, self._engine_tag)
+                filepath = self._engine_filepath(digest)
+                engine = self._load_engine(filepath)
+            if engine is None:
+                example = torch.zeros((2, 48, 48), dtype=torch.uint8)
+                example = self.batch_transform(example).to(TORCH_DEVICE)
+                example = self._inference_batch(example)
+                engine = compile_model(model, example, self.inference_method)
+                if filepath is not None:
+                    save_compiled(engine, filepath)
+        if filepath is not None:
+            self._remove_stale_engines(filepath)
+        return engine
+
+    def _update_engine(self) -> Tuple[torch.jit.ScriptModule, int]:
+        """Compile the engine of the current version, unless compiled already"""
+        with self._engine_lock:
+            engine = self._engine
+            if engine is None or engine[1] < self.version:
+                version = self.version
+                engine = self._compile_engine(self.inference_model), version
+                with self._version_lock:  # unless a newer one was published
+                    if self._engine is None or self._engine[1] < version:
+                        self._engine = engine
+        return engine
+
+    def _update_engine_in_background(self) -> None:
+        def _compile():
+            try:
+                self._update_engine()
+            except Exception as e:  # the previous engine keeps serving
+                print(f"[ERROR]: engine not compiled: {e}")
+
+        # at worst, a second thread finds the engine up to date already
+        if self._compiler is None or not self._compiler.is_alive():
+            self._compiler = Thread(target=_compile, daemon=True)
+            self._compiler.start()
+
+    @property
+    def _engine_outdated(self) -> bool:
+        """The engine serving predictions is of previous weights"""
+        engine = self._engine
+        return engine is not None and engine[1] < self.version
+
+    @property
+    def engine(self) -> torch.jit.ScriptModule:
+        """Compiled inference model. Whenever model weights are updated (unless
+        published, see `publish`), the previous engine keeps serving predictions
+        whilst the new one is compiled in the background: only the first engine
+        (e.g. on warm-up) is compiled on the calling thread."""
+        engine = self._engine
+        if engine is None:
+            engine = self._update_engine()
+        elif engine[1] < self.version:
+            self._update_engine_in_background()
+        return engine[0]
+
+    def _inference_call(self, batch: Tensor) -> ModelOutput:
+        """Forward pass used for predictions (i.e. not for training)"""
+        model = self.engine if self.compiled else self.inference_model
+        with self._reading_serving_weights(model):
+            return getattr(model, self.inference_method)(self._inference_batch(batch))
+
     def transform(self, sample: Sample) -> Tensor:
         return self._transformer(sample.image)
 
+    def batch_transform(self, images: Tensor) -> Tensor:
+        """Batched counterpart of `transform`, working directly on a
+        [n x H x W] uint8 tensor of grayscale images (i.e. same as ToTensor)"""
+        return images.unsqueeze(1).float().div_(255)
+
+    def _as_batch(self, samples: Union[Sample, Sequence[Sample]]) -> Tensor:
+        """Convert samples into a batch of torch Tensors, in one vectorised
+        step whenever images can be retrieved from the data source in bulk."""
+        images = stack_images(samples)
+        if images is not None:
+            return self.batch_transform(images)
+        return default_collate(list(map(self.transform, iter(samples))))
+
+    def _prediction_key(self, sample: Sample) -> Optional[Tuple[str, int, int]]:
+        if sample.index is None or sample.index < 0:
+            return None
+        return self.KEY, sample.index, self.version
+
+    def _feature_key(self, sample: Sample) -> Optional[Tuple[str, int, int]]:
+        if sample.index is None or sample.index < 0:
+            return None
+        return self.KEY, sample.index, self._encoder_version
+
+    def _encoded_features(self, samples: Sequence[Sample]) -> Tensor:
+        """Features of the samples from the (frozen) feature extractor, i.e.
+        the input of the head. Only samples whose features are not in cache go
+        through the feature extractor, in a single batch."""
+        keys = [self._feature_key(s) for s in samples]
+        features = [
+            None if key is None else self.features_cache.get(key) for key in keys
+        ]
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            batch = self._as_batch([samples[i] for i in missing]).to(TORCH_DEVICE)
+            with torch.no_grad(), self._reading_training_weights():
+                self.model.eval()
+                encoded = self.model.encode(batch).cpu().numpy()
+            for i, f in zip(missing, encoded):
+                features[i] = f
+                if keys[i] is not None:
+                    self.features_cache.put(keys[i], f)
+        return torch.from_numpy(np.stack(features)).to(TORCH_DEVICE)
+
+    def _predict_logits(self, samples: Sequence[Sample]) -> Prediction:
+        # transform samples into a batch of torch Tensors
+        batch = self._as_batch(samples)
+        with torch.no_grad():
+            batch = batch.to(TORCH_DEVICE)
+            outputs = self._inference_call(batch)
+            return self._get_model_emotion_predictions(outputs)
+
     def predict(
-            self, samples: Union[Sample, Sequence[Sample]], as_proba: bool = True
+            self,
+            samples: Union[Sample, Sequence[Sample]],
+            as_proba: bool = True,
+            refresh: bool = False,
     ) -> Prediction:
         """
 
@@ -139,25 +536,42 @@ class LearningMachine(ABC):
         as_proba : bool (default True)
             If True, returns predictions as probabilities. Otherwise, just
             logits will be returned
+        refresh : bool (default False)
+            If True, predictions are re-computed, even if cached for the
+            current version of the model.
 
         Returns
         -------
             Numpy Array of shape (n_samples x  n_emotions)
         """
-        # transform samples into a batch of torch Tensors
-        batch = default_collate(list(map(self.transform, iter(samples))))
-        with torch.no_grad():
-            self.model.eval()
-            batch = batch.to(TORCH_DEVICE)
-            outputs = self._model_call(batch)
-            outputs = self._get_model_emotion_predictions(outputs)
-            if not as_proba:
-                return outputs  # return logits
-            probabilities = (outputs - outputs.min(axis=1, keepdims=True)) / (
-                    outputs.max(axis=1, keepdims=True) - outputs.min(axis=1, keepdims=True)
-            )
-            probabilities /= probabilities.sum(axis=1, keepdims=True)
-            return probabilities
+        samples = list(iter(samples))
+        _ = self.model  # weights are loaded (hence versioned) before lookups
+        self._sync_shared_weights()
+        keys = [self._prediction_key(s) for s in samples]
+        # predictions of the previous engine (i.e. while compiling the current
+        # one) are not cached, as they are not of the current version
+        if self.compiled and self._engine_outdated:
+            keys = [None] * len(samples)
+        outputs = [
+            None if refresh or key is None else self.predictions_cache.get(key)
+            for key in keys
+        ]
+        # only samples not in cache go through the model, in a single batch
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if missing:
+            logits = self._predict_logits([samples[i] for i in missing])
+            for i, output in zip(missing, logits):
+                outputs[i] = output
+                if keys[i] is not None:
+                    self.predictions_cache.put(keys[i], output)
+        outputs = np.stack(outputs)
+        if not as_proba:
+            return outputs  # return logits
+        probabilities = (outputs - outputs.min(axis=1, keepdims=True)) / (
+                outputs.max(axis=1, keepdims=True) - outputs.min(axis=1, keepdims=True)
+        )
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities
 
     @staticmethod
     def _get_model_emotion_predictions(model_output: ModelOutput) -> Prediction:
@@ -165,11 +579,19 @@ class LearningMachine(ABC):
 
     def fit(self, samples: Sequence[Sample]) -> NoReturn:
         """ """
+        self._fit_step(samples)
+        self._model_updated()
+
+    def _fit_step(self, samples: Sequence[Sample]) -> float:
+        """Optimisation step on the samples (i.e. a mini-batch), updating the
+        weights being trained. Returns the loss on the samples."""
+        if self.head_only:
+            return self._fit_head_step(samples)
         # convert the input sequence of Samples into a batch
         # of torch Tensor
-        batch = default_collate(list(map(self.transform, iter(samples))))
+        batch = self._as_batch(samples)
         labels = default_collate([s.emotion for s in iter(samples)])
-        with torch.set_grad_enabled(True):
+        with torch.set_grad_enabled(True), self._training_lock, self._writing_weights():
             self.model.train()
             # zero the gradient
             self.optimiser.zero_grad()
@@ -183,6 +605,42 @@ class LearningMachine(ABC):
             # backward + optimize
             loss.backward()
             self.optimiser.step()
+            self._updates += 1
+            self._saved_weights = False
+            self._encoder_updated()
+            self._restore_serving_mode()
+        if self._shared_weights is not None:
+            self._shared_version = self._shared_weights.version
+        self.checkpoints.updated()
+        return loss.item()
+
+    def _head_loss(self, labels: Tensor, logits: Tensor) -> Tensor:
+        """Loss of the head only, given the emotion logits"""
+        return self.criterion(logits, labels)
+
+    def _fit_head_step(self, samples: Sequence[Sample]) -> float:
+        """Optimisation step updating the head of the model only, on (cached)
+        features of the samples: the feature extractor is neither run (but on
+        samples never seen before) nor back-propagated through."""
+        samples = list(iter(samples))
+        labels = default_collate([s.emotion for s in samples]).to(TORCH_DEVICE)
+        features = self._encoded_features(samples)
+        with torch.set_grad_enabled(True), self._training_lock, self._writing_weights():
+            head = self.model.head
+            head.train()
+            # parameters of the feature extractor get no gradient,
+            # hence they are left as they are by the optimiser
+            self.optimiser.zero_grad()
+            loss = self._head_loss(labels=labels, logits=head(features))
+            loss.backward()
+            self.optimiser.step()
+            self._updates += 1
+            self._saved_weights = False
+            self._restore_serving_mode()
+        if self._shared_weights is not None:
+            self._shared_version = self._shared_weights.version
+        self.checkpoints.updated()
+        return loss.item()
 
     def __call__(self, samples: Sequence[Sample]) -> Prediction:
         return self.predict(samples=samples)
@@ -0,0 +1,220 @@
+"""
+Dynamic micro-batching of the requests to a LearningMachine
+"""
+
+import asyncio
+from collections import Counter, deque
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Dict, List, NoReturn, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from datasets import Sample
+from .learning_machine import LearningMachine, Prediction
+
+
+class _Request:
+    """Pending predict (or fit) request, and the Future of its result"""
+
+    __slots__ = ("samples", "as_proba", "refresh", "fit", "future", "submitted")
+
+    def __init__(
+        self,
+        samples: List[Sample],
+        as_proba: bool = True,
+        refresh: bool = False,
+        fit: bool = False,
+    ) -> None:
+        self.samples = samples
+        self.as_proba = as_proba
+        self.refresh = refresh
+        self.fit = fit
+        self.future = Future()
+        self.submitted = perf_counter()
+
+
+class InferenceStats:
+    """Latency (from submission to result) of the latest predict requests,
+    and histograms of the size of the batches run by the scheduler."""
+
+    def __init__(self, max_latencies: int = 10_000) -> None:
+        self._latencies = deque(maxlen=max_latencies)
+        self._batch_sizes = Counter()  # number of samples per forward pass
+        self._batch_requests = Counter()  # number of requests per forward pass
+        self._lock = Lock()
+
+    def record(self, requests: Sequence[_Request], completed: float) -> None:
+        with self._lock:
+            self._latencies.extend(completed - r.submitted for r in requests)
+            self._batch_sizes[sum(len(r.samples) for r in requests)] += 1
+            self._batch_requests[len(requests)] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._latencies.clear()
+            self._batch_sizes.clear()
+            self._batch_requests.clear()
+
+    def summary(self) -> Dict:
+        with self._lock:
+            latencies = np.fromiter(self._latencies, dtype=np.float64)
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            batch_requests = dict(sorted(self._batch_requests.items()))
+        p50, p99 = (
+            np.percentile(latencies, (50, 99)) * 1000 if len(latencies) else (0, 0)
+        )
+        return {
+            "requests": len(latencies),
+            "batches": sum(batch_sizes.values()),
+            "latency_p50_ms": float(p50),
+            "latency_p99_ms": float(p99),
+            "batch_sizes": batch_sizes,
+            "requests_per_batch": batch_requests,
+        }
+
+
+class InferenceScheduler:
+    """Owner of a LearningMachine, running all its forward (and training)
+    passes on a dedicated worker thread.
+
+    Predict requests arriving within `window` seconds from the first pending
+    one are merged (up to `max_batch_size` samples) and run in a single
+    batched forward pass; each caller then receives its own slice of the
+    predictions. Fit requests are run in order with predictions, on the same
+    thread, hence the model is never used concurrently.
+
+    Parameters
+    ----------
+    machine : LearningMachine
+        The learning machine used for predictions.
+    window : float (default 0)
+        Maximum time (in seconds) a request waits for others to be batched with.
+        With no window, only the requests already queued (i.e. arrived during
+        the previous forward pass) are batched.
+    max_batch_size : int (default 64)
+        Maximum number of samples in a batch. Larger requests run on their own.
+    """
+
+    def __init__(
+        self, machine: LearningMachine, window: float = 0.0, max_batch_size: int = 64
+    ) -> None:
+        self.machine = machine
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.stats = InferenceStats()
+        self._queue = Queue()
+        self._worker = None
+        self._stopped = Event()
+        self._lock = Lock()
+
+    def _start_worker(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._stopped.clear()
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _submit(self, request: _Request) -> Future:
+        self._start_worker()
+        self._queue.put(request)
+        return request.future
+
+    def submit(
+        self,
+        samples: Union[Sample, Sequence[Sample]],
+        as_proba: bool = True,
+        refresh: bool = False,
+    ) -> Future:
+        """Schedule predictions for the samples. Returns the Future of
+        the (n_samples x n_emotions) predictions."""
+        request = _Request(list(iter(samples)), as_proba=as_proba, refresh=refresh)
+        return self._submit(request)
+
+    def submit_fit(self, samples: Sequence[Sample]) -> Future:
+        """Schedule a training step on the samples, after pending predictions"""
+        return self._submit(_Request(list(iter(samples)), fit=True))
+
+    async def predict(
+        self,
+        samples: Union[Sample, Sequence[Sample]],
+        as_proba: bool = True,
+        refresh: bool = False,
+    ) -> Prediction:
+        future = self.submit(samples, as_proba=as_proba, refresh=refresh)
+        return await asyncio.wrap_future(future)
+
+    async def fit(self, samples: Sequence[Sample]) -> NoReturn:
+        return await asyncio.wrap_future(self.submit_fit(samples))
+
+    def _collect(self, first: _Request) -> Tuple[List[_Request], Optional[_Request]]:
+        """Collect the predict requests to batch with the first one.
+        A fit request, or a request not fitting in the batch, interrupts
+        the collection: it is returned apart, to be run next."""
+        batch, n_samples = [first], len(first.samples)
+        deadline = perf_counter() + self.window
+        while n_samples < self.max_batch_size:
+            try:
+                request = self._queue.get(timeout=max(deadline - perf_counter(), 0))
+            except Empty:
+                break
+            if request.fit or n_samples + len(request.samples) > self.max_batch_size:
+                return batch, request
+            batch.append(request)
+            n_samples += len(request.samples)
+        return batch, None
+
+    def _run(self) -> None:
+        pending = None
+        while not (self._stopped.is_set() and pending is None and self._queue.empty()):
+            if pending is None:
+                try:
+                    pending = self._queue.get(timeout=0.1)
+                except Empty:
+                    continue
+            request, pending = pending, None
+            if request.fit:
+                self._run_fit(request)
+                continue
+            batch, pending = self._collect(request)
+            options = dict.fromkeys((r.as_proba, r.refresh) for r in batch)
+            for as_proba, refresh in options:
+                requests = [
+                    r for r in batch if (r.as_proba, r.refresh) == (as_proba, refresh)
+                ]
+                self._run_predict(requests, as_proba, refresh)
+
+    def _run_predict(
+        self, requests: List[_Request], as_proba: bool, refresh: bool
+    ) -> None:
+        samples = [s for r in requests for s in r.samples]
+        try:
+            predictions = self.machine.predict(
+                samples, as_proba=as_proba, refresh=refresh
+            )
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        start = 0
+        for request in requests:
+            end = start + len(request.samples)
+            request.future.set_result(predictions[start:end])
+            start = end
+        self.stats.record(requests, completed=perf_counter())
+
+    def _run_fit(self, request: _Request) -> None:
+        try:
+            request.future.set_result(self.machine.fit(request.samples))
+        except Exception as e:
+            request.future.set_exception(e)
+
+    def stop(self) -> None:
+        """Complete the pending requests, and stop the worker thread"""
+        with self._lock:
+            if self._worker is not None:
+                self._stopped.set()
+                self._worker.join()
+                self._worker = None
@@ -0,0 +1,155 @@
+"""
+Model weights shared in memory by multiple (worker) processes
+"""
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import torch
+from torch import nn
+
+try:
+    import fcntl
+except ImportError:  # e.g. on Windows: weights cannot be shared
+    fcntl = None
+
+
+class SharedWeights:
+    """Weights (i.e. parameters and buffers) of a model stored in a file
+    mapped in shared memory (e.g. under /dev/shm) by all the processes.
+
+    Once attached, parameters and buffers of the model are views on the
+    shared mapping: a single copy of the weights is used by all the worker
+    processes, and an update made by any of them (e.g. a `fit` step) is
+    immediately visible to all the others. Updates are published under an
+    exclusive (file) lock, and they increase the version in the header of
+    the file, so that processes can tell when weights have changed.
+    Forward passes run under a shared lock, hence never see half-updated
+    weights.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to the shared weights file (and, with a `.lock` suffix,
+        to the lock file).
+    token : int
+        Identifies the processes meant to share the weights (e.g. the pid of
+        their parent): the first process attaching with a new token copies
+        its weights to the file, the following ones only map them.
+    """
+
+    MAGIC = 0x4C4D5745  # "LMWE"
+    HEADER_SIZE = 64  # bytes: magic, layout digest, token, version
+    ALIGNMENT = 64
+
+    def __init__(self, filepath: Path, token: int) -> None:
+        self.filepath = Path(filepath)
+        self.token = token
+        self._header = None
+        self._local = threading.local()
+        self._lock_files = list()
+
+    @staticmethod
+    def supported(model: nn.Module) -> bool:
+        """Weights of the model can be shared: only on CPU (i.e. weights in
+        host memory), where file locks are available (i.e. not on Windows)."""
+        return fcntl is not None and all(
+            tensor.device.type == "cpu" for tensor in model.state_dict().values()
+        )
+
+    @property
+    def lock_file(self):
+        # flock locks belong to the open file: each thread opens its own,
+        # so that threads of the same process exclude each other too
+        lock_file = getattr(self._local, "lock_file", None)
+        if lock_file is None:
+            self.filepath.parent.mkdir(parents=True, exist_ok=True)
+            lock_file = open(self.filepath.with_suffix(".lock"), "a+b")
+            self._local.lock_file = lock_file
+            self._lock_files.append(lock_file)
+        return lock_file
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        fcntl.flock(self.lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Shared lock: weights are not updated in the meantime"""
+        with self._locked(fcntl.LOCK_SH):
+            yield
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Exclusive lock: weights updated within are published on exit"""
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                yield
+            finally:
+                self._header[3] += 1
+
+    @property
+    def version(self) -> int:
+        return 0 if self._header is None else int(self._header[3])
+
+    @staticmethod
+    def _layout_digest(tensors) -> int:
+        layout = [(name, tuple(t.shape), str(t.dtype)) for name, t in tensors.items()]
+        digest = hashlib.sha256(repr(layout).encode()).digest()
+        return int.from_bytes(digest[:8], "little", signed=True)
+
+    def attach(self, model: nn.Module) -> None:
+        """Move the weights of the model to the shared memory file.
+
+        Parameters are updated in place (i.e. their data is swapped), so that
+        optimisers already holding them keep working.
+        """
+        if not self.supported(model):
+            raise RuntimeError("Weights can only be shared for models on CPU, on Unix")
+        tensors = model.state_dict(keep_vars=True)
+        offsets, nbytes = list(), self.HEADER_SIZE
+        for tensor in tensors.values():
+            offsets.append(nbytes)
+            size = tensor.numel() * tensor.element_size()
+            nbytes += -(-size // self.ALIGNMENT) * self.ALIGNMENT
+        digest = self._layout_digest(tensors)
+        with self._locked(fcntl.LOCK_EX):
+            if not self.filepath.exists() or self.filepath.stat().st_size != nbytes:
+                with open(self.filepath, "wb") as f:
+                    f.truncate(nbytes)
+            storage = torch.from_file(
+                str(self.filepath), shared=True, size=nbytes, dtype=torch.uint8
+            )
+            header = storage[: self.HEADER_SIZE].view(torch.int64)
+            initialise = header[:3].tolist() != [self.MAGIC, digest, self.token]
+            for tensor, offset in zip(tensors.values(), offsets):
+                size = tensor.numel() * tensor.element_size()
+                view = storage[offset : offset + size].view(tensor.dtype)
+                view = view.view(tensor.shape)
+                if initialise:
+                    view.copy_(tensor.detach())
+                tensor.data = view
+            if initialise:
+                header[:4] = torch.tensor([self.MAGIC, digest, self.token, 0])
+            self._header = header
+
+    def close(self) -> None:
+        for lock_file in self._lock_files:
+            lock_file.close()
+        self._lock_files.clear()
+        self._local = threading.local()
+
+    def unlink(self) -> None:
+        """Remove the shared weights (and lock) files"""
+        self.close()
+        for filepath in (self.filepath, self.filepath.with_suffix(".lock")):
+            if filepath.exists():
+                os.unlink(filepath)
@@ -0,0 +1,252 @@
+"""
+Background training of a LearningMachine from the annotations of the users
+"""
+
+import random
+from collections import deque
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from datasets import Sample
+from .learning_machine import LearningMachine
+
+
+class ReplayBuffer:
+    """Annotated samples the trainer learns from.
+
+    Fresh annotations (i.e. not trained on yet) are drawn first, in order of
+    arrival; mini-batches are then filled up with samples replayed at random
+    from the (bounded) history of previous annotations, so that a step never
+    overfits to the latest annotation only.
+
+    Parameters
+    ----------
+    capacity : int (default 1024)
+        Maximum number of previous annotations kept for replay.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self._fresh = deque()  # (sample, arrival time)
+        self._history = deque(maxlen=capacity)
+        self._lock = Lock()
+
+    def add(self, sample: Sample) -> None:
+        with self._lock:
+            self._fresh.append((sample, perf_counter()))
+
+    @property
+    def pending(self) -> int:
+        """Number of fresh annotations"""
+        return len(self._fresh)
+
+    @property
+    def oldest_pending(self) -> float:
+        """Arrival time of the oldest fresh annotation (if any)"""
+        with self._lock:
+            return self._fresh[0][1] if self._fresh else None
+
+    def __len__(self) -> int:
+        return len(self._fresh) + len(self._history)
+
+    def draw(self, batch_size: int) -> Tuple[List[Sample], List[float]]:
+        """Mini-batch of (at most) `batch_size` samples: fresh annotations
+        first, then replayed ones. Arrival times of fresh annotations
+        are also returned."""
+        with self._lock:
+            fresh = [
+                self._fresh.popleft() for _ in range(min(batch_size, self.pending))
+            ]
+            n_replayed = min(batch_size - len(fresh), len(self._history))
+            replayed = random.sample(self._history, n_replayed)
+            self._history.extend(sample for sample, _ in fresh)
+        samples = [sample for sample, _ in fresh] + replayed
+        return samples, [arrival for _, arrival in fresh]
+
+    def discard(self, samples: List[Sample]) -> None:
+        """Remove the samples from the history (e.g. those of a failed step),
+        so that they are not replayed anymore"""
+        discarded = set(samples)
+        with self._lock:
+            kept = [sample for sample in self._history if sample not in discarded]
+            self._history.clear()
+            self._history.extend(kept)
+
+
+class TrainingStats:
+    """Rate of the latest training steps, and training lag of the latest
+    annotations, i.e. time from their arrival to the publication of weights
+    trained on them."""
+
+    def __init__(self, max_records: int = 10_000) -> None:
+        self._steps = deque(maxlen=100)  # completion time of the latest steps
+        self._lags = deque(maxlen=max_records)
+        self._n_steps = 0
+        self._n_failed = 0
+        self._n_published = 0
+        self._loss = None
+        self._lock = Lock()
+
+    def record_step(self, loss: float, completed: float) -> None:
+        with self._lock:
+            self._steps.append(completed)
+            self._n_steps += 1
+            self._loss = loss
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._n_failed += 1
+
+    def record_publication(self, arrivals: List[float], published: float) -> None:
+        with self._lock:
+            self._lags.extend(published - arrival for arrival in arrivals)
+            self._n_published += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._steps.clear()
+            self._lags.clear()
+            self._n_steps = self._n_failed = self._n_published = 0
+            self._loss = None
+
+    def summary(self) -> Dict:
+        with self._lock:
+            steps = list(self._steps)
+            lags = np.fromiter(self._lags, dtype=np.float64)
+            summary = {
+                "steps": self._n_steps,
+                "failed_steps": self._n_failed,
+                "publications": self._n_published,
+                "loss": self._loss,
+            }
+        elapsed = steps[-1] - steps[0] if len(steps) > 1 else 0
+        p50, p99 = np.percentile(lags, (50, 99)) * 1000 if len(lags) else (0, 0)
+        summary.update(
+            {
+                "steps_per_s": (len(steps) - 1) / elapsed if elapsed else 0.0,
+                "lag_p50_ms": float(p50),
+                "lag_p99_ms": float(p99),
+            }
+        )
+        return summary
+
+
+class BackgroundTrainer:
+    """Trainer of a LearningMachine, running optimisation steps on a
+    dedicated thread, off the path of the requests.
+
+    Annotations are added to a replay buffer, and the trainer takes
+    mini-batched steps whenever fresh annotations are available. Weights are
+    trained on their own (back) buffer, while predictions are served by a
+    copy of them (i.e. the machine is double buffered): updated weights are
+    published to predictions with an atomic swap, once all fresh annotations
+    have been trained on, or every `publish_every` steps (whichever first).
+    Predictions never wait for training, nor see half-updated weights.
+
+    Parameters
+    ----------
+    machine : LearningMachine
+        The learning machine to train.
+    batch_size : int (default 16)
+        Maximum number of samples (fresh, and replayed) per step.
+    buffer_size : int (default 1024)
+        Maximum number of previous annotations kept for replay.
+    publish_every : int (default 8)
+        Maximum number of steps before updated weights are published.
+    """
+
+    def __init__(
+        self,
+        machine: LearningMachine,
+        batch_size: int = 16,
+        buffer_size: int = 1024,
+        publish_every: int = 8,
+    ) -> None:
+        self.machine = machine
+        self.batch_size = batch_size
+        self.publish_every = publish_every
+        self.buffer = ReplayBuffer(capacity=buffer_size)
+        self.stats = TrainingStats()
+        self._unpublished = list()  # arrival times of annotations trained on
+        self._unpublished_steps = 0
+        self._worker = None
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._lock = Lock()
+        machine.double_buffered = True
+
+    def _start_worker(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._stopped.clear()
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def add(self, sample: Sample) -> None:
+        """Schedule training on the annotated sample"""
+        if sample.emotion < 0:
+            raise ValueError(f"Sample {sample.index} has no (known) emotion")
+        self._start_worker()
+        self.buffer.add(sample)
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while not (self._stopped.is_set() and self.buffer.pending == 0):
+            if self.buffer.pending == 0:
+                self._wakeup.wait(timeout=0.1)
+                self._wakeup.clear()
+                continue
+            self._step()
+            if (
+                self.buffer.pending == 0
+                or self._unpublished_steps >= self.publish_every
+            ):
+                self._publish()
+
+    def _step(self) -> None:
+        samples, arrivals = self.buffer.draw(self.batch_size)
+        try:
+            loss = self.machine._fit_step(samples)
+        except Exception as e:
+            # samples of a failed step are neither retried, nor replayed
+            print(f"[ERROR]: training step failed: {e}")
+            self.buffer.discard(samples)
+            self.stats.record_failure()
+        else:
+            self.stats.record_step(loss, completed=perf_counter())
+            self._unpublished.extend(arrivals)
+            self._unpublished_steps += 1
+
+    def _publish(self) -> None:
+        if self._unpublished_steps:
+            self.machine.publish()
+            self.stats.record_publication(self._unpublished, published=perf_counter())
+        self._unpublished, self._unpublished_steps = list(), 0
+
+    def summary(self) -> Dict:
+        """Training statistics, along with the annotations not published yet
+        (i.e. not reflected in predictions) and the age of the oldest one."""
+        summary = self.stats.summary()
+        oldest = self.buffer.oldest_pending
+        unpublished = list(self._unpublished)
+        if unpublished:
+            oldest = unpublished[0] if oldest is None else min(oldest, unpublished[0])
+        summary.update(
+            {
+                "pending_annotations": self.buffer.pending + len(unpublished),
+                "oldest_pending_s": 0.0 if oldest is None else perf_counter() - oldest,
+                "replay_buffer": len(self.buffer),
+            }
+        )
+        return summary
+
+    def stop(self) -> None:
+        """Train on (and publish) pending annotations, and stop the worker"""
+        with self._lock:
+            if self._worker is not None:
+                self._stopped.set()
+                self._wakeup.set()
+                self._worker.join()
+                self._worker = None
@@ -5,6 +5,7 @@ from torch import nn, optim, Tensor
 from collections import OrderedDict
 from .learning_machine import LearningMachine
 from .learning_machine import Prediction, ModelOutput
+from .inference import fold_batchnorm
 from datasets import Sample
 from typing import Sequence, Tuple, Optional, Union
 
@@ -64,7 +65,7 @@ class Unet(nn.Module):
 
         bottleneck = self.bottleneck(self.pool4(enc4))
 
-        encoding = bottleneck.view(-1, 256 * 3 * 3)
+        encoding = torch.flatten(bottleneck, 1)  # also for channels-last tensors
         fe = self.fc(encoding)
 
         dec4 = self.upconv4(bottleneck)
@@ -86,6 +87,32 @@ class Unet(nn.Module):
         reco = torch.clamp(self.conv(dec1), min=0, max=1)
         return reco, fe
 
+    def classify(self, x) -> Tensor:
+        """Emotion logits only: the encoder path up to the bottleneck, then `fc`.
+        The decoder (i.e. the reconstruction) is skipped altogether."""
+        return self.fc(self.encode(x))
+
+    @property
+    def head(self) -> nn.Module:
+        """Layers computing emotion logits from the encoded features"""
+        return self.fc
+
+    def encode(self, x) -> Tensor:
+        """Features of the images, i.e. the (flattened) bottleneck"""
+        for layer in (
+            self.encoder1,
+            self.pool1,
+            self.encoder2,
+            self.pool2,
+            self.encoder3,
+            self.pool3,
+            self.encoder4,
+            self.pool4,
+            self.bottleneck,
+        ):
+            x = layer(x)
+        return torch.flatten(x, 1)
+
     @staticmethod
     def _block(in_channels, features, name):
         return nn.Sequential(
@@ -123,9 +150,25 @@ class Unet(nn.Module):
 class UNetMachine(LearningMachine):
     """Unet-based Learning Machine"""
 
-    def __init__(self, loss_reco_weight: float = 0.3):
-        super(UNetMachine, self).__init__()
+    KEY = "unet"
+
+    def __init__(
+        self,
+        loss_reco_weight: float = 0.3,
+        encoder_only: bool = True,
+        fold_batchnorm: bool = True,
+        channels_last: bool = True,
+        compiled: bool = False,
+        head_only: bool = False,
+    ):
+        super(UNetMachine, self).__init__(compiled=compiled, head_only=head_only)
         self.loss_reco_coeff = loss_reco_weight
+        # predictions only need the encoder: reconstruction is for training only
+        self.encoder_only = encoder_only
+        # predictions use an eval-mode copy of the model, with BatchNorm folded
+        # into the convolutions (and channels-last layout, faster on CPU)
+        self.fold_batchnorm = fold_batchnorm
+        self.channels_last = channels_last
         self._reconstruction_criterion, self._prediction_criterion = self._criterion
 
     @property
@@ -177,6 +220,30 @@ class UNetMachine(LearningMachine):
     def _model_call(self, batch: Sequence[Sample]) -> Tuple[Tensor, Tensor]:
         return self.model(batch)
 
+    def _build_inference_model(self) -> nn.Module:
+        if not self.fold_batchnorm:
+            return self.model
+        model = fold_batchnorm(self.model)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    @property
+    def inference_method(self) -> str:
+        return "classify" if self.encoder_only else "forward"
+
+    def _inference_batch(self, batch: Tensor) -> Tensor:
+        if self.fold_batchnorm and self.channels_last:
+            return batch.contiguous(memory_format=torch.channels_last)
+        return batch
+
+    @property
+    def _engine_tag(self) -> str:
+        return (
+            f"{self.inference_method}"
+            f"|fold={self.fold_batchnorm}|channels_last={self.channels_last}"
+        )
+
     def _calculate_loss(
         self,
         labels: Tensor,
@@ -191,7 +258,13 @@ class UNetMachine(LearningMachine):
         ) * loss_pred
         return loss
 
+    def _head_loss(self, labels: Tensor, logits: Tensor) -> Tensor:
+        # the decoder is not trained: reconstruction is not part of the loss
+        return self.prediction_criterion(logits, labels)
+
     @staticmethod
     def _get_model_emotion_predictions(model_output: ModelOutput) -> Prediction:
+        if isinstance(model_output, Tensor):  # encoder-only: logits only
+            return model_output.detach().numpy()
         reco_images, emotions_logits = model_output
         return emotions_logits.detach().numpy()
@@ -1,11 +1,12 @@
 """VGG13 based model for Learning Machine """
 
 import torch
-from torch import nn
+from torch import nn, Tensor
 from torch import optim
 from torchvision.models import vgg13
 from torchvision.transforms import Compose, Lambda, ToTensor
 from .learning_machine import LearningMachine, TransformerType
+from .inference import quantise_linear
 from pathlib import Path
 from typing import Any, Tuple
 from PIL.Image import Image as PILImage
@@ -14,13 +15,21 @@ from PIL.Image import Image as PILImage
 class VGGNet(nn.Module):
     """Custom VGG13 model architecture"""
 
+    HEAD_LAYERS = 4  # last layers of the classifier: Linear, ReLU, Dropout, Linear
+
     def __init__(
-        self, freeze: bool = False, pretrained: bool = False, n_classes: int = 7
+        self,
+        freeze: bool = False,
+        pretrained: bool = False,
+        n_classes: int = 7,
+        in_channels: int = 3,
     ):
         super(VGGNet, self).__init__()
         vgg13_architecture = vgg13(pretrained=pretrained, progress=pretrained)
         self.features = vgg13_architecture.features
         self.avgpool = vgg13_architecture.avgpool
+        if in_channels == 1:
+            self.to_grayscale()
         if freeze:
             for param in self.features.parameters():
                 param.requires_grad = False
@@ -37,6 +46,59 @@ class VGGNet(nn.Module):
             nn.Linear(1024, n_classes),
         )
 
+    @property
+    def in_channels(self) -> int:
+        return self.features[0].in_channels
+
+    def to_grayscale(self) -> "VGGNet":
+        """Convert the first convolution to single-channel (grayscale) inputs.
+
+        Kernels are summed over the RGB channels: on grayscale images (i.e. the
+        same values on the three channels) the outputs are the same as those
+        of the RGB convolution, for a third of the input size and work.
+        """
+        rgb_conv = self.features[0]
+        if rgb_conv.in_channels == 1:
+            return self
+        conv = nn.Conv2d(
+            1,
+            rgb_conv.out_channels,
+            kernel_size=rgb_conv.kernel_size,
+            stride=rgb_conv.stride,
+            padding=rgb_conv.padding,
+            bias=rgb_conv.bias is not None,
+        )
+        with torch.no_grad():
+            conv.weight.copy_(rgb_conv.weight.sum(dim=1, keepdim=True))
+            if rgb_conv.bias is not None:
+                conv.bias.copy_(rgb_conv.bias)
+        conv.requires_grad_(rgb_conv.weight.requires_grad)
+        self.features[0] = conv.to(rgb_conv.weight.device)
+        return self
+
+    def to_rgb(self) -> "VGGNet":
+        """Convert the first convolution back to RGB inputs (e.g. for weights
+        trained as grayscale): kernels are split evenly over the RGB channels,
+        hence outputs on grayscale images are the same."""
+        gray_conv = self.features[0]
+        if gray_conv.in_channels == 3:
+            return self
+        conv = nn.Conv2d(
+            3,
+            gray_conv.out_channels,
+            kernel_size=gray_conv.kernel_size,
+            stride=gray_conv.stride,
+            padding=gray_conv.padding,
+            bias=gray_conv.bias is not None,
+        )
+        with torch.no_grad():
+            conv.weight.copy_(gray_conv.weight.expand(-1, 3, -1, -1) / 3)
+            if gray_conv.bias is not None:
+                conv.bias.copy_(gray_conv.bias)
+        conv.requires_grad_(gray_conv.weight.requires_grad)
+        self.features[0] = conv.to(gray_conv.weight.device)
+        return self
+
     def forward(self, x):
         x = self.features(x)
         x = self.avgpool(x)
@@ -44,6 +106,16 @@ class VGGNet(nn.Module):
         x = self.classifier(x)
         return x
 
+    @property
+    def head(self) -> nn.Module:
+        """Layers computing emotion logits from the encoded features"""
+        return self.classifier[-self.HEAD_LAYERS :]
+
+    def encode(self, x) -> Tensor:
+        """Features of the images, i.e. the input of the head"""
+        x = self.avgpool(self.features(x))
+        return self.classifier[: -self.HEAD_LAYERS](torch.flatten(x, 1))
+
     def __call__(self, *args, **kwargs) -> Any:
         return super().__call__(*args, **kwargs)
 
@@ -51,16 +123,38 @@ class VGGNet(nn.Module):
 class VGGMachine(LearningMachine):
     """VGG-based Learning Machine"""
 
-    def __init__(self) -> None:
-        super(VGGMachine, self).__init__()
+    KEY = "vgg"
+
+    def __init__(
+        self,
+        compiled: bool = False,
+        quantised: bool = False,
+        grayscale: bool = True,
+        head_only: bool = False,
+    ) -> None:
+        # the model takes grayscale images as they are, rather than converted to RGB
+        self.grayscale = grayscale
+        super(VGGMachine, self).__init__(compiled=compiled, head_only=head_only)
+        # predictions use a copy of the model with int8 (dynamic) Linear layers:
+        # the classifier holds most of the weights, and most of the CPU time
+        self._quantised = quantised
+
+    def _set_transformer(self) -> TransformerType:
+        if self.grayscale:
+            return ToTensor()
 
-    @staticmethod
-    def _set_transformer() -> TransformerType:
         def _convert_rgb(img: PILImage) -> PILImage:
             return img.convert("RGB")
 
         return Compose([Lambda(_convert_rgb), ToTensor()])
 
+    def batch_transform(self, images: Tensor) -> Tensor:
+        images = super().batch_transform(images)
+        if self.grayscale:
+            return images
+        # same as the RGB conversion: grayscale replicated on three channels
+        return images.expand(-1, 3, -1, -1)
+
     @property
     def checkpoint(self) -> Path:
         return self.CHECKPOINTS_FOLDER / "vgg_learning_machine_overfitting.pt"
@@ -72,6 +166,36 @@ class VGGMachine(LearningMachine):
             "e76c032150d9762e94a6b94b3d5c2b9d",
         )
 
+    @property
+    def quantised(self) -> bool:
+        return self._quantised
+
+    @quantised.setter
+    def quantised(self, quantised: bool) -> None:
+        if quantised == self._quantised:
+            return
+        self._quantised = quantised
+        # inference model (and engine) are rebuilt on the next prediction,
+        # and predictions of the previous setting are not served from cache
+        self._serving = self._engine = None
+        self._model_updated()
+
+    def _build_inference_model(self) -> nn.Module:
+        if not self.quantised:
+            return self.model
+        return quantise_linear(self.model)
+
+    def _inference_batch(self, batch: Tensor) -> Tensor:
+        # quantised kernels only run on CPU
+        return batch.cpu() if self.quantised else batch
+
+    @property
+    def _engine_tag(self) -> str:
+        return (
+            f"{self.inference_method}"
+            f"|quantised={self.quantised}|grayscale={self.grayscale}"
+        )
+
     def _init_optimiser(self) -> optim.Optimizer:
         return optim.SGD(self.model.parameters(), lr=0.001, momentum=0.9)
 
@@ -79,6 +203,9 @@ class VGGMachine(LearningMachine):
         return nn.CrossEntropyLoss()
 
     def _load_model(self) -> nn.Module:
-        model = VGGNet(pretrained=False, freeze=False)
+        # checkpoints may hold RGB (i.e. original), or grayscale weights
+        # (e.g. snapshots of weights trained as grayscale)
+        in_channels = self.weights["features.0.weight"].shape[1]
+        model = VGGNet(pretrained=False, freeze=False, in_channels=in_channels)
         model.load_state_dict(self.weights)
-        return model
+        return model.to_grayscale() if self.grayscale else model.to_rgb()
@@ -1,6 +1,43 @@
+import os
+import tempfile
+from pathlib import Path
+
 from models import UNET_MODEL
 from datasets import FER_DATASET
 
 
 LEARNING_MACHINE_MODEL = UNET_MODEL
 DATASET_NAME = FER_DATASET
+
+# Encode the images of newly served samples in background, before they are requested
+PREWARM_IMAGES_CACHE = True
+
+# Predict requests arriving within the window (in seconds) are run as a single batch
+# (with no window, requests queued during a forward pass are batched with no wait).
+# On CPU, larger batches are no faster per sample: see benchmarks/inference_scheduler
+INFERENCE_BATCH_WINDOW = 0.0
+INFERENCE_MAX_BATCH_SIZE = 64
+
+# Annotations are trained on in the background (mini-batches of fresh, and
+# replayed annotations), and updated weights published to predictions at once
+BACKGROUND_TRAINING = True
+TRAINING_BATCH_SIZE = 16
+REPLAY_BUFFER_SIZE = 1024
+TRAINING_PUBLISH_EVERY = 8  # steps
+# Annotations only fine-tune the head of the model (i.e. the feature extractor
+# is frozen, and features of annotated samples cached): much cheaper updates
+HEAD_ONLY_TRAINING = False
+
+# Worker processes serving the app: with more than one worker, model weights
+# are shared in memory by all the workers (and so are their updates)
+SERVING_WORKERS = 1
+SHARED_WEIGHTS_FOLDER = (
+    Path("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+    / "learning_machine"
+)
+
+# At startup, dataset and model are loaded (and inference run on batches of
+# typical sizes) in the background: the server is ready once warmed up
+WARM_UP_ON_STARTUP = True
+WARM_UP_BATCH_SIZES = (1, 25)
+WARM_UP_ITERATIONS = 3
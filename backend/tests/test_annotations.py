@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from datasets.annotations import AnnotationStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AnnotationStore(tmp_path / "annotations.db", commit_interval=0.01)
+    store.BUSY_TIMEOUT = store.RETRY_DELAY = 0.01
+    yield store
+    store.close()
+
+
+def test_replay(store):
+    for index in range(5):
+        store.add(f"image-{index}", index, index % 3)
+    assert list(store.replay(batch_size=2)) == [
+        [(0, 0), (1, 1)],
+        [(2, 2), (3, 0)],
+        [(4, 1)],
+    ]
+    assert len(store) == 5
+
+
+def test_locked_database(store):
+    store.add("image-0", 0, 1)
+    store.flush()
+    other = sqlite3.connect(str(store.filepath), isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")  # "database is locked" for the writer
+    store.add("image-1", 1, 2)
+    with pytest.raises(RuntimeError, match="1 annotations not written"):
+        store.flush()  # does not hang on the failed writer
+    assert store.latest("image-1") == 2
+    store.add("image-2", 2, 3)  # kept, to be retried after the failed ones
+    with pytest.raises(RuntimeError, match="2 annotations not written"):
+        list(store.replay())
+    other.execute("ROLLBACK")
+    other.close()
+    store.flush()  # retries the annotations not written
+    assert list(store.replay()) == [[(0, 1), (1, 2), (2, 3)]]
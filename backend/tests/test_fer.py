@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from datasets.fer import FER, Partition
+
+
+@pytest.fixture
+def fer(tmp_path):
+    processed = tmp_path / "FER" / "processed"
+    processed.mkdir(parents=True)
+    for position, partition in enumerate(Partition):
+        images = torch.full((position + 2, 48, 48), position, dtype=torch.uint8)
+        labels = torch.arange(position + 2) % len(FER.classes)
+        torch.save((images, labels), processed / FER.data_files[partition])
+    return FER(str(tmp_path), split="validation")
+
+
+def test_save_mmap(fer):
+    fer.save_mmap()
+    dataset = FER(fer.root, split="validation")
+    assert len(dataset) == 3
+    assert torch.equal(dataset.data, torch.ones((3, 48, 48), dtype=torch.uint8))
+    assert not list(fer.processed_folder.glob(".*.tmp"))
+
+
+def test_interrupted_save_mmap_keeps_previous_files(fer, monkeypatch):
+    fer.save_mmap()
+    images = (fer.processed_folder / fer.mmap_images_file).read_bytes()
+    index = (fer.processed_folder / fer.mmap_index_file).read_bytes()
+
+    def _interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(torch, "load", _interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        fer.save_mmap()
+    assert (fer.processed_folder / fer.mmap_images_file).read_bytes() == images
+    assert (fer.processed_folder / fer.mmap_index_file).read_bytes() == index
+    assert not list(fer.processed_folder.glob(".*.tmp"))
@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+from models.inference import fold_batchnorm
+from models.unet import Unet
+
+
+@pytest.fixture
+def unet():
+    """Unet with random BatchNorm statistics and affine parameters:
+    freshly initialised BatchNorms would fold into identities"""
+    torch.manual_seed(0)
+    model = Unet()
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+@pytest.mark.parametrize("channels_last", [False, True])
+def test_fold_batchnorm_parity(unet, channels_last):
+    batch = torch.rand(8, 1, 48, 48)
+    folded = fold_batchnorm(unet)
+    if channels_last:
+        folded = folded.to(memory_format=torch.channels_last)
+        folded_batch = batch.contiguous(memory_format=torch.channels_last)
+    else:
+        folded_batch = batch
+    with torch.no_grad():
+        reco, logits = unet(batch)
+        folded_reco, folded_logits = folded(folded_batch)
+        classify_logits = folded.classify(folded_batch)
+    torch.testing.assert_close(folded_reco, reco, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(folded_logits, logits, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(classify_logits, logits, rtol=1e-4, atol=1e-4)
+
+
+def test_fold_batchnorm_leaves_model_untouched(unet):
+    folded = fold_batchnorm(unet)
+    assert not any(isinstance(m, torch.nn.BatchNorm2d) for m in folded.modules())
+    assert any(isinstance(m, torch.nn.BatchNorm2d) for m in unet.modules())
+    assert not any(p.requires_grad for p in folded.parameters())
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torch import nn, optim
+
+from datasets import Sample
+from models.learning_machine import LearningMachine
+
+
+class TinyMachine(LearningMachine):
+    """Learning machine of a linear model, with weights in a temporary folder"""
+
+    KEY = "tiny"
+
+    def __init__(self, folder):
+        self.CHECKPOINTS_FOLDER = folder
+        super().__init__(compiled=True)
+        self.checkpoints.every_updates = self.checkpoints.every_seconds = 1e9
+
+    @property
+    def checkpoint(self):
+        return self.CHECKPOINTS_FOLDER / "tiny.pt"
+
+    @property
+    def weights_urls(self):
+        return "", ""
+
+    def _load_model(self):
+        model = nn.Sequential(nn.Flatten(), nn.Linear(48 * 48, 7))
+        model.load_state_dict(self.weights)
+        return model
+
+    def _init_optimiser(self):
+        return optim.SGD(self.model.parameters(), lr=0.1)
+
+    def _init_criterion(self):
+        return nn.CrossEntropyLoss()
+
+
+@pytest.fixture
+def machine(tmp_path):
+    torch.manual_seed(0)
+    torch.save(
+        nn.Sequential(nn.Flatten(), nn.Linear(48 * 48, 7)).state_dict(),
+        tmp_path / "tiny.pt",
+    )
+    return TinyMachine(tmp_path)
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (4, 48, 48), dtype=np.uint8)
+    return [
+        Sample(index=i, emotion=i % 7, image=Image.fromarray(image))
+        for i, image in enumerate(images)
+    ]
+
+
+def test_engine_of_loaded_weights_is_cached_on_disk(machine, samples):
+    machine.predict(samples)
+    assert len(list(machine.CHECKPOINTS_FOLDER.glob("*.ts"))) == 1
+
+
+def test_previous_engine_serves_while_compiling(machine, samples):
+    machine.predict(samples)
+    previous = machine.engine
+    machine.fit(samples)
+    engine = machine.engine  # does not wait for the compilation
+    assert engine is previous
+    machine._compiler.join()
+    assert machine.engine is not previous
+    compiled = machine.predict(samples)
+    machine.compiled = False
+    np.testing.assert_allclose(compiled, machine.predict(samples), atol=1e-6)
+    # engines of trained weights are not cached on disk
+    assert len(list(machine.CHECKPOINTS_FOLDER.glob("*.ts"))) == 1
+
+
+def test_published_engine(machine, samples):
+    machine.double_buffered = True
+    machine.predict(samples)
+    machine._fit_step(samples)
+    machine.publish()  # compiles the engine, before publishing it
+    assert machine._engine[1] == machine.version
+    machine.compiled = False
+    eager = machine.predict(samples, refresh=True)
+    machine.compiled = True
+    np.testing.assert_allclose(machine.predict(samples, refresh=True), eager, atol=1e-6)
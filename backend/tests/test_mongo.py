@@ -0,0 +1,106 @@
+from random import Random
+
+import numpy as np
+import pytest
+
+from datasets import mongo
+from datasets.mongo import document_to_sample, KaggleMongoDataset
+from datasets.sources import Sample
+
+
+class FakeCollection:
+    """In-memory stand-in of a MongoDB collection, for the pipelines used"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.pipelines = list()
+        self.random = Random(0)
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        if "$group" in pipeline[-1]:
+            counts = dict()
+            for document in self.documents:
+                counts[document["emotion"]] = counts.get(document["emotion"], 0) + 1
+            return [{"_id": e, "count": c} for e, c in counts.items()]
+        if "$sample" in pipeline[-1]:
+            documents = list(self.documents)
+            self.random.shuffle(documents)
+            return documents[: pipeline[-1]["$sample"]["size"]]
+        raise NotImplementedError(pipeline)
+
+    def index_information(self):
+        return {"_id_": {"key": [("_id", 1)]}}
+
+
+class FakeDatabase(dict):
+    def list_collection_names(self, filter):
+        return [name for name in self if name == filter["name"]]
+
+
+@pytest.fixture
+def faces_collection(monkeypatch):
+    db_info = mongo.MongoDatabaseInfo()
+    collection = FakeCollection(list())
+    client = {db_info.db: FakeDatabase({db_info.collection: collection})}
+    monkeypatch.setattr(mongo, "get_mongo_client", lambda host, port: client)
+    return collection
+
+
+@pytest.fixture
+def face():
+    return np.arange(48 * 48, dtype=np.uint32).astype(np.uint8).reshape(48, 48)
+
+
+def test_document_to_sample(face):
+    document = {"_id": 1, "set": "train", "emotion": 3, "image": face.tobytes()}
+    sample = document_to_sample(document, index=42)
+    assert isinstance(sample, Sample)
+    assert (sample.index, sample.emotion) == (42, 3)
+    assert sample.image.mode == "L"
+    np.testing.assert_array_equal(np.asarray(sample.image), face)
+
+
+def test_document_to_sample_from_csv_pixels(face):
+    pixels = " ".join(map(str, face.ravel()))
+    sample = document_to_sample({"emotion": 0, "pixels": pixels})
+    assert (sample.index, sample.emotion) == (-1, 0)
+    np.testing.assert_array_equal(np.asarray(sample.image), face)
+
+
+def test_document_not_found():
+    assert document_to_sample(None) is None
+
+
+def test_class_weights(faces_collection):
+    # 6 happy (3), 3 sad (4), 1 neutral (6) faces: no sample of other emotions
+    faces_collection.documents += [
+        {"_id": i, "set": "train", "emotion": emotion}
+        for i, emotion in enumerate([3] * 6 + [4] * 3 + [6])
+    ]
+    dataset = KaggleMongoDataset(ml_set="train")
+    weights = dataset.class_weights()
+    assert "$group" in faces_collection.pipelines[0][-1]
+    assert sorted(weights) == list(range(7))
+    assert weights[3] == pytest.approx(10 / (7 * 6))
+    assert weights[4] == pytest.approx(10 / (7 * 3))
+    assert weights[6] == pytest.approx(10 / 7)
+    assert weights[0] == 0.0
+
+
+def test_sample_skips_excluded_documents(faces_collection):
+    faces_collection.documents += [
+        {"_id": i, "set": "train", "emotion": i % 7} for i in range(20)
+    ]
+    proxy = mongo.MongoProxy(mongo.MongoDatabaseInfo(), ml_set="train")
+    proxy.exclude(range(10))
+    drawn = [d["_id"] for d in proxy.sample(4) + proxy.sample(4)]
+    assert len(drawn) == len(set(drawn)) == 8
+    assert all(oid >= 10 for oid in drawn)
+    # the last ones, once (most) documents are excluded
+    assert sorted(d["_id"] for d in proxy.sample(5)) == sorted(
+        set(range(10, 20)) - set(drawn)
+    )
+    assert proxy.sample(1) == list()
+    # queries do not grow with the documents excluded
+    assert all("$nin" not in str(p) for p in faces_collection.pipelines)
@@ -0,0 +1,34 @@
+import pytest
+import torch
+from torch import nn
+
+from models import shared
+from models.shared import SharedWeights
+
+
+@pytest.fixture
+def shared_weights(tmp_path):
+    weights = SharedWeights(tmp_path / "model.weights", token=1)
+    yield weights
+    weights.unlink()
+
+
+@pytest.mark.skipif(shared.fcntl is None, reason="file locks are Unix only")
+def test_attach_shares_weights(shared_weights):
+    model, other = nn.Linear(4, 2), nn.Linear(4, 2)
+    shared_weights.attach(model)
+    other_weights = SharedWeights(shared_weights.filepath, token=1)
+    other_weights.attach(other)  # maps the weights of the first model
+    torch.testing.assert_close(other.weight, model.weight)
+    with shared_weights.writing(), torch.no_grad():
+        model.weight.add_(1)
+    assert other_weights.version == 1
+    torch.testing.assert_close(other.weight, model.weight)
+    other_weights.close()
+
+
+def test_only_cpu_weights_are_shared(shared_weights):
+    model = nn.Linear(4, 2, device="meta")  # i.e. not in host memory
+    assert not SharedWeights.supported(model)
+    with pytest.raises(RuntimeError):
+        shared_weights.attach(model)
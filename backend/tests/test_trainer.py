@@ -0,0 +1,66 @@
+import pytest
+
+from datasets import Sample
+from models.trainer import BackgroundTrainer, ReplayBuffer
+
+
+class FakeMachine:
+    """Learning machine failing on samples with no (known) emotion"""
+
+    double_buffered = False
+
+    def __init__(self):
+        self.trained = list()
+        self.published = 0
+
+    def _fit_step(self, samples):
+        if any(sample.emotion < 0 for sample in samples):
+            raise IndexError("Target -1 is out of bounds.")
+        self.trained.append(samples)
+        return 0.0
+
+    def publish(self):
+        self.published += 1
+
+
+def test_replay_buffer_draws_fresh_first():
+    buffer = ReplayBuffer(capacity=8)
+    for index in range(3):
+        buffer.add(Sample(index=index, emotion=0))
+    samples, arrivals = buffer.draw(batch_size=2)
+    assert [s.index for s in samples] == [0, 1] and len(arrivals) == 2
+    samples, arrivals = buffer.draw(batch_size=3)
+    assert samples[0].index == 2 and len(arrivals) == 1
+    assert {s.index for s in samples[1:]} == {0, 1}
+
+
+def test_replay_buffer_discard():
+    buffer = ReplayBuffer(capacity=8)
+    for index in range(4):
+        buffer.add(Sample(index=index, emotion=0))
+    samples, _ = buffer.draw(batch_size=4)
+    buffer.discard(samples[:2])
+    replayed, _ = buffer.draw(batch_size=4)
+    assert sorted(s.index for s in replayed) == [2, 3]
+
+
+def test_trainer_rejects_samples_with_no_emotion():
+    trainer = BackgroundTrainer(FakeMachine())
+    with pytest.raises(ValueError):
+        trainer.add(Sample(index=0, emotion=-1))
+    assert trainer.buffer.pending == 0
+
+
+def test_failed_step_is_not_replayed():
+    machine = FakeMachine()
+    trainer = BackgroundTrainer(machine, batch_size=2)
+    trainer.buffer.add(Sample(index=0, emotion=-1))  # e.g. added before checks
+    trainer._step()
+    assert trainer.summary()["failed_steps"] == 1
+    for index in range(1, 3):
+        trainer.buffer.add(Sample(index=index, emotion=1))
+    trainer._step()
+    trainer._step()  # replays previous samples only
+    assert trainer.summary()["failed_steps"] == 1
+    assert all(s.index > 0 for samples in machine.trained for s in samples)
+    assert machine.double_buffered
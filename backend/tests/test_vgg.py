@@ -0,0 +1,55 @@
+import pytest
+import torch
+from PIL import Image
+
+from models.vgg import VGGMachine, VGGNet
+
+
+@pytest.fixture
+def vgg():
+    torch.manual_seed(0)
+    return VGGNet(pretrained=False).eval()
+
+
+@pytest.fixture
+def images():
+    return torch.randint(0, 256, (4, 48, 48), dtype=torch.uint8)
+
+
+def test_grayscale_parity(vgg, images):
+    batch = images.unsqueeze(1).float().div(255)
+    with torch.no_grad():
+        rgb_logits = vgg(batch.expand(-1, 3, -1, -1))
+        gray_logits = vgg.to_grayscale()(batch)
+        assert vgg.in_channels == 1
+        torch.testing.assert_close(gray_logits, rgb_logits, rtol=1e-4, atol=1e-4)
+        # and back to RGB inputs
+        rgb_again = vgg.to_rgb()(batch.expand(-1, 3, -1, -1))
+        assert vgg.in_channels == 3
+        torch.testing.assert_close(rgb_again, rgb_logits, rtol=1e-4, atol=1e-4)
+
+
+def test_grayscale_transforms(images):
+    pil_images = [Image.fromarray(image.numpy(), mode="L") for image in images]
+    rgb_inputs = torch.stack(
+        list(map(VGGMachine(grayscale=False)._transformer, pil_images))
+    )
+    gray_inputs = torch.stack(
+        list(map(VGGMachine(grayscale=True)._transformer, pil_images))
+    )
+    assert gray_inputs.shape[1] == 1
+    torch.testing.assert_close(rgb_inputs, gray_inputs.expand(-1, 3, -1, -1))
+
+
+@pytest.mark.parametrize("grayscale", [False, True])
+def test_load_grayscale_weights(vgg, images, grayscale):
+    """Weights trained as grayscale (e.g. a snapshot) load into either model"""
+    vgg.to_grayscale()
+    machine = VGGMachine(grayscale=grayscale)
+    machine._weights = vgg.state_dict()
+    model = machine._load_model().eval()
+    assert model.in_channels == (1 if grayscale else 3)
+    batch = machine.batch_transform(images)
+    with torch.no_grad():
+        expected = vgg(images.unsqueeze(1).float().div(255))
+        torch.testing.assert_close(model(batch), expected, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,87 @@
+"""
+Background warm-up of the server, before it is ready to serve requests
+"""
+
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+WarmUpStage = Tuple[str, Callable[[], None]]
+
+
+class WarmUp:
+    """Stages warming up the server (e.g. loading the dataset, and the model),
+    run in order on a background thread at startup, so that the cold start
+    is never paid for by a request.
+
+    The server is ready once all the stages are done. If a stage fails,
+    the following ones are not run, and the server is never ready.
+
+    Parameters
+    ----------
+    stages : Sequence[WarmUpStage]
+        Name, and function of each stage.
+    """
+
+    PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+    def __init__(self, stages: Sequence[WarmUpStage]) -> None:
+        self.stages = list(stages)
+        self.error = None
+        self._status = {name: self.PENDING for name, _ in self.stages}
+        self._durations = dict()
+        self._worker = None
+        self._done = Event()
+        self._lock = Lock()
+        if not self.stages:
+            self._done.set()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._worker is None and not self._done.is_set():
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        try:
+            for name, stage in self.stages:
+                self._status[name] = self.RUNNING
+                start = perf_counter()
+                try:
+                    stage()
+                except Exception as e:
+                    self._status[name] = self.FAILED
+                    self.error = f"{name}: {e}"
+                    print(f"[ERROR]: warm-up failed ({self.error})")
+                    return
+                finally:
+                    self._durations[name] = perf_counter() - start
+                self._status[name] = self.DONE
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return all(status == self.DONE for status in self._status.values())
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the warm-up to complete. Returns True if ready."""
+        self._done.wait(timeout)
+        return self.ready
+
+    def summary(self) -> Dict:
+        status = dict(self._status)
+        n_done = sum(s == self.DONE for s in status.values())
+        return {
+            "ready": self.ready,
+            "progress": n_done / len(status) if status else 1.0,
+            "stages": {
+                name: {"status": s, "duration_s": self._durations.get(name)}
+                for name, s in status.items()
+            },
+            "error": self.error,
+        }